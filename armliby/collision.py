@@ -0,0 +1,323 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from armliby.ik import Kinematics
+from armliby.mesh_cache import MeshCache
+from armliby.urdf_parser import URDFParser
+
+
+DEFAULT_MAX_SPHERES_PER_LINK = 8
+
+
+def fit_spheres(points: np.ndarray, num_spheres: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cover points with spheres placed along their principal axis.
+
+    The points are split into num_spheres equal slabs along the axis of largest extent,
+    every slab gets the sphere around its bounding box center that contains all its points.
+
+    Args:
+        points: (N, 3) points, e.g. mesh vertices.
+        num_spheres: Number of slabs.
+
+    Returns:
+        (K, 3) sphere centers and (K,) radii, K <= num_spheres as empty slabs are dropped.
+    """
+    mean = points.mean(axis=0)
+    _, _, vt = np.linalg.svd(points - mean, full_matrices=False)
+    proj = (points - mean) @ vt[0]
+    edges = np.linspace(proj.min(), proj.max(), num_spheres + 1)
+    slab = np.clip(np.searchsorted(edges, proj, side='right') - 1, 0, num_spheres - 1)
+
+    centers = []
+    radii = []
+    for ind in range(num_spheres):
+        slab_points = points[slab == ind]
+        if len(slab_points) == 0:
+            continue
+        center = 0.5 * (slab_points.min(axis=0) + slab_points.max(axis=0))
+        centers.append(center)
+        radii.append(np.linalg.norm(slab_points - center, axis=1).max())
+    return np.array(centers), np.array(radii)
+
+
+def _num_spheres(points: np.ndarray, max_spheres: int) -> int:
+    # elongated links get more spheres, about one per link thickness
+    _, singular, _ = np.linalg.svd(points - points.mean(axis=0), full_matrices=False)
+    aspect = singular[0] / max(singular[1], 1e-12)
+    return int(np.clip(np.ceil(2. * aspect), 1, max_spheres))
+
+
+class SelfCollisionChecker:
+    def __init__(
+            self,
+            urdf_path: str,
+            kinematics: Kinematics,
+            max_spheres_per_link: int = DEFAULT_MAX_SPHERES_PER_LINK,
+            padding: float = 0.,
+            mesh_lod: int = 0,
+            skip_links: Optional[List[int]] = None,
+            allowed_pairs: Optional[Iterable[Tuple[str, str]]] = None,
+            default_js: Optional[np.ndarray] = None,
+            ) -> None:
+        """
+        Self-collision and clearance queries of the links of a kinematic chain.
+
+        Every link mesh from URDFParser.get_link_stl_map is approximated by spheres along
+        its principal axis. The spheres of a link are bounded by one link sphere,
+        queries test link spheres first and check the link spheres only for link pairs
+        that may touch. Pairs in the allowed collision matrix are never tested:
+        links connected by a joint and links already overlapping in the default configuration.
+
+        Args:
+            urdf_path: The path to the URDF file.
+            kinematics: Kinematics of a chain containing the checked links,
+                e.g. up to the last gripper link. The numpy backend is the fastest.
+            max_spheres_per_link: Upper bound of spheres approximating one link.
+            padding: Safety margin added to every sphere radius. In meters.
+            mesh_lod: Level of detail of the meshes the spheres are fitted to, see MeshCache.
+            skip_links: Optional list of link indices without collision geometry.
+            allowed_pairs: Additional link name pairs that are never checked.
+            default_js: Configuration whose overlapping link pairs are allowed,
+                zeros if None. Pass an empty array to skip.
+        """
+        self.kinematics = kinematics
+        self.padding = padding
+        parser = URDFParser(urdf_path=urdf_path, skip_links=skip_links)
+        mesh_cache = MeshCache(urdf_path)
+        chain_indices = {link_name: ind for ind, link_name in enumerate(kinematics.link_names)}
+
+        # link local sphere approximations
+        self.link_names: List[str] = []
+        self.spheres: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for link_name, stl_path in parser.get_link_stl_map().items():
+            if link_name not in chain_indices:
+                continue
+            vertices, faces = mesh_cache.load_indexed(stl_path, mesh_lod)
+            if len(faces) == 0:
+                print(f"Warning: mesh of link {link_name} is empty, the link is not checked.")
+                continue
+            # triangle centers reduce the gaps between vertices of large triangles
+            points = np.concatenate([vertices, vertices[faces].mean(axis=1)])
+            self.link_names.append(link_name)
+            self.spheres[link_name] = fit_spheres(points, _num_spheres(points, max_spheres_per_link))
+        if len(self.link_names) < 2:
+            raise ValueError(f"Need at least two links with meshes, got {self.link_names}")
+
+        num_links = len(self.link_names)
+        link_index = {link_name: ind for ind, link_name in enumerate(self.link_names)}
+        chain_link = np.array([chain_indices[link_name] for link_name in self.link_names])
+
+        # flat sphere arrays, sphere_link indexes self.link_names
+        self._sphere_link = np.concatenate([
+            np.full(len(self.spheres[link_name][1]), ind) for ind, link_name in enumerate(self.link_names)])
+        self._centers = np.concatenate([self.spheres[link_name][0] for link_name in self.link_names])
+        self._radii = np.concatenate([self.spheres[link_name][1] for link_name in self.link_names]) + padding
+
+        # bounding sphere of the spheres of each link
+        self._link_centers = np.empty((num_links, 3))
+        self._link_radii = np.empty(num_links)
+        for ind in range(num_links):
+            mask = self._sphere_link == ind
+            centers = self._centers[mask]
+            center = 0.5 * (centers.min(axis=0) + centers.max(axis=0))
+            self._link_centers[ind] = center
+            self._link_radii[ind] = (np.linalg.norm(centers - center, axis=1) + self._radii[mask]).max()
+        # all centers are transformed in one batched product
+        self._all_centers = np.concatenate([self._centers, self._link_centers])
+        self._center_chain_link = chain_link[np.concatenate([self._sphere_link, np.arange(num_links)])]
+
+        self.allowed_collision_matrix = np.eye(num_links, dtype=bool)
+        model = parser.model
+        for parent, child in zip(model.joint_parents, model.joint_children):
+            if parent in link_index and child in link_index:
+                self.allowed_collision_matrix[link_index[parent], link_index[child]] = True
+                self.allowed_collision_matrix[link_index[child], link_index[parent]] = True
+        for link_a, link_b in (allowed_pairs or []):
+            self.allow(link_a, link_b)
+        if default_js is None:
+            default_js = np.zeros(kinematics.num_dof)
+        if len(default_js) > 0:
+            self._update_pairs()
+            distances = self._sphere_pair_distances(self._world_centers(self._link_poses(np.asarray(default_js))))
+            checked_pairs = self.checked_pairs
+            for pair in np.unique(self._sphere_pair_link[distances[0] < 0.]):
+                self.allow(*checked_pairs[pair])
+        self._update_pairs()
+
+    def allow(self, link_a: str, link_b: str, allowed: bool = True) -> None:
+        """Add or remove a link pair from the allowed collision matrix."""
+        ind_a = self.link_names.index(link_a)
+        ind_b = self.link_names.index(link_b)
+        self.allowed_collision_matrix[ind_a, ind_b] = allowed
+        self.allowed_collision_matrix[ind_b, ind_a] = allowed
+        self._update_pairs()
+
+    def _update_pairs(self) -> None:
+        # checked link pairs and the sphere pairs of each of them
+        link_a, link_b = np.nonzero(np.triu(~self.allowed_collision_matrix))
+        self._pair_link_a = link_a
+        self._pair_link_b = link_b
+        self._pair_link_radii = self._link_radii[link_a] + self._link_radii[link_b]
+        sphere_a = []
+        sphere_b = []
+        sphere_pair_link = []
+        for pair, (ind_a, ind_b) in enumerate(zip(link_a, link_b)):
+            grid_a, grid_b = np.meshgrid(
+                np.flatnonzero(self._sphere_link == ind_a), np.flatnonzero(self._sphere_link == ind_b), indexing='ij')
+            sphere_a.append(grid_a.ravel())
+            sphere_b.append(grid_b.ravel())
+            sphere_pair_link.append(np.full(grid_a.size, pair))
+        self._sphere_a = np.concatenate(sphere_a) if sphere_a else np.zeros(0, dtype=int)
+        self._sphere_b = np.concatenate(sphere_b) if sphere_b else np.zeros(0, dtype=int)
+        self._sphere_pair_link = np.concatenate(sphere_pair_link) if sphere_pair_link else np.zeros(0, dtype=int)
+        self._sphere_pair_radii = self._radii[self._sphere_a] + self._radii[self._sphere_b]
+
+        # center differences of all checked pairs are one product with a +1/-1 matrix
+        num_spheres = self.num_spheres
+        self._link_pair_diff = np.zeros((len(link_a), len(self._all_centers)))
+        self._link_pair_diff[np.arange(len(link_a)), num_spheres + link_a] = 1.
+        self._link_pair_diff[np.arange(len(link_a)), num_spheres + link_b] = -1.
+        self._sphere_pair_diff = np.zeros((len(self._sphere_a), len(self._all_centers)))
+        self._sphere_pair_diff[np.arange(len(self._sphere_a)), self._sphere_a] = 1.
+        self._sphere_pair_diff[np.arange(len(self._sphere_a)), self._sphere_b] = -1.
+
+    @property
+    def num_spheres(self) -> int:
+        return len(self._radii)
+
+    @property
+    def checked_pairs(self) -> List[Tuple[str, str]]:
+        """Link name pairs outside the allowed collision matrix."""
+        return [
+            (self.link_names[ind_a], self.link_names[ind_b])
+            for ind_a, ind_b in zip(self._pair_link_a, self._pair_link_b)
+        ]
+
+    def _link_poses(self, js: np.ndarray) -> np.ndarray:
+        tfs, _ = self.kinematics.fk_batch(np.atleast_2d(js))
+        return tfs
+
+    def _world_centers(self, chain_poses: np.ndarray) -> np.ndarray:
+        # (B, num_spheres + num_links, 3) sphere centers followed by link sphere centers
+        chain_poses = np.asarray(chain_poses)
+        chain_poses = chain_poses.reshape((-1,) + chain_poses.shape[-3:])
+        poses = chain_poses[:, self._center_chain_link]
+        centers = np.matmul(poses[..., :3, :3], self._all_centers[..., None])[..., 0]
+        centers += poses[..., :3, 3]
+        return centers
+
+    def world_spheres(self, link_poses: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Collision spheres of all links placed at link poses, e.g. for ObstacleMap.sphere_clearance.
+
+        Args:
+            link_poses: (..., num_chain_links, 4, 4) link transforms ordered as kinematics.link_names.
+
+        Returns:
+            (..., num_spheres, 3) sphere centers and (num_spheres,) radii including the padding.
+        """
+        batch_shape = np.shape(link_poses)[:-3]
+        centers = self._world_centers(link_poses)[:, :self.num_spheres]
+        return centers.reshape(batch_shape + centers.shape[1:]), self._radii
+
+    @property
+    def sphere_link_names(self) -> List[str]:
+        """Link name of every sphere returned by world_spheres."""
+        return [self.link_names[ind] for ind in self._sphere_link]
+
+    def _link_pair_distances(self, centers: np.ndarray) -> np.ndarray:
+        diff = np.matmul(self._link_pair_diff, centers)
+        return np.sqrt(np.einsum('bpi,bpi->bp', diff, diff)) - self._pair_link_radii
+
+    def _sphere_pair_distances(self, centers: np.ndarray) -> np.ndarray:
+        diff = np.matmul(self._sphere_pair_diff, centers)
+        return np.sqrt(np.einsum('bpi,bpi->bp', diff, diff)) - self._sphere_pair_radii
+
+    def in_collision_from_poses(self, link_poses: np.ndarray, margin: float = 0.) -> np.ndarray:
+        """
+        Check link poses for self-collision.
+
+        Args:
+            link_poses: (..., num_chain_links, 4, 4) link transforms ordered as kinematics.link_names,
+                e.g. from Kinematics.fk_batch.
+            margin: Links closer than margin count as colliding. In meters.
+
+        Returns:
+            (...) boolean collision flags, one per configuration.
+        """
+        batch_shape = np.shape(link_poses)[:-3]
+        centers = self._world_centers(link_poses)
+        ret = np.zeros(len(centers), dtype=bool)
+        # broad phase: only configurations with overlapping link spheres go on.
+        # Link spheres contain the spheres of their link, so sphere pairs of
+        # separated link pairs never fall below the margin and need no masking.
+        candidates = (self._link_pair_distances(centers) < margin).any(axis=1)
+        if len(ret) == 1:
+            if candidates[0]:
+                ret[0] = (self._sphere_pair_distances(centers) < margin).any()
+            return ret.reshape(batch_shape)
+        rows = np.flatnonzero(candidates)
+        if len(rows) > 0:
+            ret[rows] = (self._sphere_pair_distances(centers[rows]) < margin).any(axis=1)
+        return ret.reshape(batch_shape)
+
+    def distance_from_poses(self, link_poses: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Smallest distance between checked link pairs.
+
+        Args:
+            link_poses: (..., num_chain_links, 4, 4) link transforms ordered as kinematics.link_names.
+
+        Returns:
+            (...) distances, negative for penetration, in meters, and (...) indices
+            of the closest pair in checked_pairs.
+        """
+        batch_shape = np.shape(link_poses)[:-3]
+        distances = self._sphere_pair_distances(self._world_centers(link_poses))
+        closest = np.argmin(distances, axis=1)
+        ret = np.take_along_axis(distances, closest[:, None], axis=1)[:, 0]
+        return ret.reshape(batch_shape), self._sphere_pair_link[closest].reshape(batch_shape)
+
+    def in_collision(self, js: np.ndarray, margin: float = 0.) -> Union[bool, np.ndarray]:
+        """
+        Check joint configurations for self-collision.
+        A single configuration takes about 90 us including FK, in_collision_from_poses
+        saves the FK part when the link poses are already known.
+
+        Args:
+            js: (dof,) or (N, dof) joint angles. In radians.
+            margin: Links closer than margin count as colliding. In meters.
+
+        Returns:
+            bool for a single configuration, else (N,) boolean flags.
+        """
+        ret = self.in_collision_from_poses(self._link_poses(js), margin)
+        return bool(ret[0]) if np.ndim(js) == 1 else ret
+
+    def min_distance(self, js: np.ndarray) -> Union[float, np.ndarray]:
+        """
+        Smallest distance between checked link pairs of joint configurations.
+
+        Args:
+            js: (dof,) or (N, dof) joint angles. In radians.
+
+        Returns:
+            float for a single configuration, else (N,) distances. Negative for penetration, in meters.
+        """
+        ret, _ = self.distance_from_poses(self._link_poses(js))
+        return float(ret[0]) if np.ndim(js) == 1 else ret
+
+    def closest_links(self, js: np.ndarray) -> Tuple[str, str, float]:
+        """
+        The closest checked link pair of one configuration.
+
+        Args:
+            js: (dof,) joint angles. In radians.
+
+        Returns:
+            The link names and their distance. In meters.
+        """
+        distances, pairs = self.distance_from_poses(self._link_poses(js))
+        link_a, link_b = self.checked_pairs[int(pairs[0])]
+        return link_a, link_b, float(distances[0])
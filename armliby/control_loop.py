@@ -0,0 +1,158 @@
+import bisect
+import math
+import time
+from typing import Callable, List, Optional, Sequence
+
+
+# Histogram bin edges in microseconds for tick start jitter (start - deadline)
+# and period error (start - previous start - period). Values below the first
+# and above the last edge go to the first and the last bin.
+DEFAULT_HIST_EDGES_US = (
+    -1000., -500., -200., -100., -50., -20., -10., 0.,
+    10., 20., 50., 100., 200., 500., 1000., 2000., 5000.,
+)
+
+# sleeping is coarse, the last part of the wait before a deadline is spun
+DEFAULT_SPIN_TIME = 0.0002
+
+
+class LoopStats:
+    def __init__(self, period: float, hist_edges_us: Sequence[float] = DEFAULT_HIST_EDGES_US) -> None:
+        """
+        Timing statistics of a fixed rate loop.
+
+        Args:
+            period: The nominal loop period, seconds.
+            hist_edges_us: Jitter and period error histogram bin edges, microseconds.
+        """
+        self.period = period
+        self.hist_edges_us = list(hist_edges_us)
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_ticks = 0
+        # ticks whose callback finished after the next deadline
+        self.num_overruns = 0
+        # deadlines dropped to get back on schedule after overruns
+        self.num_skipped = 0
+        self.max_jitter = 0.
+        self.sum_jitter = 0.
+        self.max_work_time = 0.
+        self.sum_work_time = 0.
+        self.jitter_hist: List[int] = [0] * (len(self.hist_edges_us) + 1)
+        self.period_hist: List[int] = [0] * (len(self.hist_edges_us) + 1)
+        self._prev_start: Optional[float] = None
+
+    def record(self, start: float, deadline: float, work_time: float) -> None:
+        """
+        Record one tick.
+
+        Args:
+            start: The time the callback started.
+            deadline: The time the callback was scheduled for.
+            work_time: The callback duration.
+        """
+        self.num_ticks += 1
+        jitter = start - deadline
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.sum_jitter += jitter
+        self.max_work_time = max(self.max_work_time, work_time)
+        self.sum_work_time += work_time
+        self.jitter_hist[bisect.bisect_right(self.hist_edges_us, jitter * 1e6)] += 1
+        if self._prev_start is not None:
+            period_error = start - self._prev_start - self.period
+            self.period_hist[bisect.bisect_right(self.hist_edges_us, period_error * 1e6)] += 1
+        self._prev_start = start
+        if work_time + jitter > self.period:
+            self.num_overruns += 1
+
+    def hist_labels(self) -> List[str]:
+        """Bin labels of jitter_hist and period_hist, microseconds."""
+        edges = self.hist_edges_us
+        return (
+            [f"<{edges[0]:g}"]
+            + [f"[{lo:g},{hi:g})" for lo, hi in zip(edges[:-1], edges[1:])]
+            + [f">={edges[-1]:g}"]
+        )
+
+    def summary(self) -> str:
+        """Human readable summary of the statistics."""
+        if self.num_ticks == 0:
+            return "no ticks"
+        lines = [
+            f"ticks {self.num_ticks} overruns {self.num_overruns} skipped {self.num_skipped}",
+            f"jitter mean {self.sum_jitter / self.num_ticks * 1e6:.1f} us max {self.max_jitter * 1e6:.1f} us",
+            f"work mean {self.sum_work_time / self.num_ticks * 1e6:.1f} us max {self.max_work_time * 1e6:.1f} us"
+            f" (period {self.period * 1e6:.0f} us)",
+            "bin us: jitter / period error",
+        ]
+        for label, jitter_count, period_count in zip(self.hist_labels(), self.jitter_hist, self.period_hist):
+            if jitter_count or period_count:
+                lines.append(f"  {label}: {jitter_count} / {period_count}")
+        return '\n'.join(lines)
+
+
+class ControlLoop:
+    def __init__(
+            self,
+            freq: float,
+            spin_time: float = DEFAULT_SPIN_TIME,
+            hist_edges_us: Sequence[float] = DEFAULT_HIST_EDGES_US,
+            ) -> None:
+        """
+        Fixed rate loop scheduler with absolute deadlines.
+
+        Tick k is scheduled at start + k * period, so the callback duration does not
+        stretch the period and timing errors do not accumulate. The wait sleeps until
+        spin_time before the deadline and spins the rest, which keeps wakeups accurate
+        at 100-500 Hz without burning a core between ticks. After an overrun the
+        missed deadlines are skipped instead of running several ticks back to back.
+
+        Args:
+            freq: The loop frequency, Hz.
+            spin_time: Busy-wait this long before each deadline, seconds. 0 to only sleep.
+            hist_edges_us: Jitter and period error histogram bin edges, microseconds.
+        """
+        if freq <= 0:
+            raise ValueError(f"Loop frequency must be positive, got {freq}")
+        self.period = 1. / freq
+        self.spin_time = spin_time
+        self.stats = LoopStats(self.period, hist_edges_us)
+        self._running = False
+
+    def _wait_until(self, deadline: float) -> None:
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_time:
+            time.sleep(remaining - self.spin_time)
+        while time.perf_counter() < deadline:
+            pass
+
+    def run(self, callback: Callable[[], None], num_ticks: Optional[int] = None) -> None:
+        """
+        Call the callback every period until stop is called or num_ticks ticks are done.
+
+        Args:
+            callback: Function called once per tick.
+            num_ticks: Number of ticks to run, None to run until stop.
+        """
+        self._running = True
+        deadline = time.perf_counter()
+        tick = 0
+        while self._running and (num_ticks is None or tick < num_ticks):
+            self._wait_until(deadline)
+            start = time.perf_counter()
+            callback()
+            end = time.perf_counter()
+            self.stats.record(start, deadline, end - start)
+            tick += 1
+
+            deadline += self.period
+            if end > deadline:
+                # overrun, resume at the next deadline still ahead
+                skipped = int(math.floor((end - deadline) / self.period)) + 1
+                deadline += skipped * self.period
+                self.stats.num_skipped += skipped
+
+    def stop(self) -> None:
+        """Make run return after the current tick, e.g. from the callback."""
+        self._running = False
@@ -0,0 +1,268 @@
+from typing import Optional
+
+import numpy as np
+
+
+# below this angle exp and log use Taylor expansions
+_SMALL_ANGLE = 1e-6
+# above this angle log recovers the axis from the symmetric part of the matrix
+_NEAR_PI_COS = -0.99
+
+
+def _out(out: Optional[np.ndarray], shape, dtype=np.float64) -> np.ndarray:
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape):
+        raise ValueError(f"out must have shape {tuple(shape)}, got {out.shape}")
+    return out
+
+
+def skew(v: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Skew-symmetric cross product matrices.
+
+    Args:
+        v: (..., 3) vectors.
+        out: Optional (..., 3, 3) output array.
+
+    Returns:
+        (..., 3, 3) matrices K with K @ x = cross(v, x).
+    """
+    v = np.asarray(v)
+    ret = _out(out, v.shape[:-1] + (3, 3), v.dtype)
+    ret[..., 0, 0] = 0.
+    ret[..., 0, 1] = -v[..., 2]
+    ret[..., 0, 2] = v[..., 1]
+    ret[..., 1, 0] = v[..., 2]
+    ret[..., 1, 1] = 0.
+    ret[..., 1, 2] = -v[..., 0]
+    ret[..., 2, 0] = -v[..., 1]
+    ret[..., 2, 1] = v[..., 0]
+    ret[..., 2, 2] = 0.
+    return ret
+
+
+def so3_exp(rotvec: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Rotation matrices of rotation vectors (Rodrigues formula).
+
+    Args:
+        rotvec: (..., 3) rotation vectors. In radians.
+        out: Optional (..., 3, 3) output array.
+
+    Returns:
+        (..., 3, 3) rotation matrices.
+    """
+    rotvec = np.asarray(rotvec, dtype=np.float64)
+    theta = np.linalg.norm(rotvec, axis=-1)[..., None, None]
+    small = theta < _SMALL_ANGLE
+    theta_sq = theta * theta
+    safe_theta = np.where(small, 1., theta)
+    # sin(t) / t and (1 - cos(t)) / t^2 with their Taylor expansions near zero
+    a = np.where(small, 1. - theta_sq / 6., np.sin(safe_theta) / safe_theta)
+    b = np.where(small, 0.5 - theta_sq / 24., (1. - np.cos(safe_theta)) / (safe_theta * safe_theta))
+    k = skew(rotvec)
+    ret = _out(out, rotvec.shape[:-1] + (3, 3))
+    np.matmul(k, k, out=ret)
+    ret *= b
+    ret += a * k
+    ret[..., 0, 0] += 1.
+    ret[..., 1, 1] += 1.
+    ret[..., 2, 2] += 1.
+    return ret
+
+
+def so3_log(rot: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Rotation vectors of rotation matrices, the inverse of so3_exp.
+
+    Args:
+        rot: (..., 3, 3) rotation matrices.
+        out: Optional (..., 3) output array.
+
+    Returns:
+        (..., 3) rotation vectors with angles in [0, pi]. In radians.
+    """
+    rot = np.asarray(rot, dtype=np.float64)
+    ret = _out(out, rot.shape[:-2] + (3,))
+    # 2 sin(theta) * axis
+    ret[..., 0] = rot[..., 2, 1] - rot[..., 1, 2]
+    ret[..., 1] = rot[..., 0, 2] - rot[..., 2, 0]
+    ret[..., 2] = rot[..., 1, 0] - rot[..., 0, 1]
+    cos = np.clip((rot[..., 0, 0] + rot[..., 1, 1] + rot[..., 2, 2] - 1.) * 0.5, -1., 1.)
+    sin = 0.5 * np.linalg.norm(ret, axis=-1)
+    theta = np.arctan2(sin, cos)
+    small = theta < _SMALL_ANGLE
+    safe_sin = np.where(small, 1., sin)
+    ret *= np.where(small, 0.5 + theta * theta / 12., 0.5 * theta / safe_sin)[..., None]
+
+    near_pi = cos < _NEAR_PI_COS
+    if np.any(near_pi):
+        # sin(theta) is too small to divide by, use axis axis^T = (sym(R) - cos I) / (1 - cos)
+        rot_pi = rot[near_pi]
+        cos_pi = cos[near_pi]
+        sym = 0.5 * (rot_pi + rot_pi.transpose(0, 2, 1))
+        outer = (sym - cos_pi[:, None, None] * np.eye(3)) / (1. - cos_pi)[:, None, None]
+        diag = np.einsum('nii->ni', outer)
+        col = np.argmax(diag, axis=1)
+        axis = outer[np.arange(len(col)), :, col] / np.sqrt(np.maximum(diag[np.arange(len(col)), col], 1e-30))[:, None]
+        # the symmetric part loses the sign, recover it from the antisymmetric part
+        antisym = ret[near_pi]
+        sign = np.where(np.einsum('ni,ni->n', axis, antisym) < 0., -1., 1.)
+        axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+        ret[near_pi] = axis * (sign * theta[near_pi])[:, None]
+    return ret
+
+
+def matrix_to_quat(rot: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Quaternions of rotation matrices.
+
+    Args:
+        rot: (..., 3, 3) rotation matrices.
+        out: Optional (..., 4) output array.
+
+    Returns:
+        (..., 4) unit quaternions in (x, y, z, w) order, as scipy, with w >= 0.
+    """
+    rot = np.asarray(rot, dtype=np.float64)
+    ret = _out(out, rot.shape[:-2] + (4,))
+    m00, m11, m22 = rot[..., 0, 0], rot[..., 1, 1], rot[..., 2, 2]
+    # 4 * squares of w, x, y, z, the largest one gives the best conditioned formula
+    candidates = np.stack([
+        1. + m00 + m11 + m22,
+        1. + m00 - m11 - m22,
+        1. - m00 + m11 - m22,
+        1. - m00 - m11 + m22,
+    ], axis=-1)
+    best = np.argmax(candidates, axis=-1)
+    quats = np.stack([
+        np.stack([rot[..., 2, 1] - rot[..., 1, 2], rot[..., 0, 2] - rot[..., 2, 0],
+                  rot[..., 1, 0] - rot[..., 0, 1], candidates[..., 0]], axis=-1),
+        np.stack([candidates[..., 1], rot[..., 0, 1] + rot[..., 1, 0],
+                  rot[..., 0, 2] + rot[..., 2, 0], rot[..., 2, 1] - rot[..., 1, 2]], axis=-1),
+        np.stack([rot[..., 0, 1] + rot[..., 1, 0], candidates[..., 2],
+                  rot[..., 1, 2] + rot[..., 2, 1], rot[..., 0, 2] - rot[..., 2, 0]], axis=-1),
+        np.stack([rot[..., 0, 2] + rot[..., 2, 0], rot[..., 1, 2] + rot[..., 2, 1],
+                  candidates[..., 3], rot[..., 1, 0] - rot[..., 0, 1]], axis=-1),
+    ], axis=-2)
+    ret[...] = np.take_along_axis(quats, best[..., None, None], axis=-2)[..., 0, :]
+    ret /= np.linalg.norm(ret, axis=-1, keepdims=True)
+    ret *= np.where(ret[..., 3:] < 0., -1., 1.)
+    return ret
+
+
+def quat_to_matrix(quat: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Rotation matrices of quaternions.
+
+    Args:
+        quat: (..., 4) quaternions in (x, y, z, w) order, normalized here.
+        out: Optional (..., 3, 3) output array.
+
+    Returns:
+        (..., 3, 3) rotation matrices.
+    """
+    quat = np.asarray(quat, dtype=np.float64)
+    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+    x, y, z, w = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    ret = _out(out, quat.shape[:-1] + (3, 3))
+    ret[..., 0, 0] = 1. - 2. * (y * y + z * z)
+    ret[..., 0, 1] = 2. * (x * y - z * w)
+    ret[..., 0, 2] = 2. * (x * z + y * w)
+    ret[..., 1, 0] = 2. * (x * y + z * w)
+    ret[..., 1, 1] = 1. - 2. * (x * x + z * z)
+    ret[..., 1, 2] = 2. * (y * z - x * w)
+    ret[..., 2, 0] = 2. * (x * z - y * w)
+    ret[..., 2, 1] = 2. * (y * z + x * w)
+    ret[..., 2, 2] = 1. - 2. * (x * x + y * y)
+    return ret
+
+
+def se3_inverse(pose: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Inverse of rigid transforms.
+
+    Args:
+        pose: (..., 4, 4) transforms.
+        out: Optional (..., 4, 4) output array, must not be pose.
+
+    Returns:
+        (..., 4, 4) inverse transforms.
+    """
+    pose = np.asarray(pose)
+    ret = _out(out, pose.shape, np.result_type(pose.dtype, np.float32))
+    rot_t = np.swapaxes(pose[..., :3, :3], -1, -2)
+    ret[..., :3, :3] = rot_t
+    ret[..., :3, 3] = -np.einsum('...ij,...j->...i', rot_t, pose[..., :3, 3])
+    ret[..., 3, :3] = 0.
+    ret[..., 3, 3] = 1.
+    return ret
+
+
+def se3_compose(pose1: np.ndarray, pose2: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Compose rigid transforms, pose1 @ pose2.
+
+    Args:
+        pose1: (..., 4, 4) transforms.
+        pose2: (..., 4, 4) transforms.
+        out: Optional (..., 4, 4) output array, must not be one of the inputs.
+
+    Returns:
+        (..., 4, 4) composed transforms.
+    """
+    return np.matmul(pose1, pose2, out=out)
+
+
+def pose_diff(
+        from_pose: np.ndarray,
+        to_pose: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        ) -> np.ndarray:
+    """
+    Difference between poses expressed in the common frame: rotation to_rot @ from_rot^T
+    and translation to_pos - from_pos, as Pose.diff_to.
+
+    Args:
+        from_pose: (..., 4, 4) transforms.
+        to_pose: (..., 4, 4) transforms.
+        out: Optional (..., 4, 4) output array, must not be one of the inputs.
+
+    Returns:
+        (..., 4, 4) difference transforms.
+    """
+    from_pose = np.asarray(from_pose)
+    to_pose = np.asarray(to_pose)
+    ret = _out(out, np.broadcast_shapes(from_pose.shape, to_pose.shape))
+    np.matmul(to_pose[..., :3, :3], np.swapaxes(from_pose[..., :3, :3], -1, -2), out=ret[..., :3, :3])
+    np.subtract(to_pose[..., :3, 3], from_pose[..., :3, 3], out=ret[..., :3, 3])
+    ret[..., 3, :3] = 0.
+    ret[..., 3, 3] = 1.
+    return ret
+
+
+def pose_diff_vector(
+        from_pose: np.ndarray,
+        to_pose: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        ) -> np.ndarray:
+    """
+    Cartesian delta between poses: translation difference and rotation vector
+    of to_rot @ from_rot^T, both in the common frame.
+
+    Args:
+        from_pose: (..., 4, 4) transforms.
+        to_pose: (..., 4, 4) transforms.
+        out: Optional (..., 6) output array.
+
+    Returns:
+        (..., 6) deltas. Rotation in radians.
+    """
+    from_pose = np.asarray(from_pose)
+    to_pose = np.asarray(to_pose)
+    shape = np.broadcast_shapes(from_pose.shape, to_pose.shape)[:-2] + (6,)
+    ret = _out(out, shape)
+    np.subtract(to_pose[..., :3, 3], from_pose[..., :3, 3], out=ret[..., :3])
+    so3_log(to_pose[..., :3, :3] @ np.swapaxes(from_pose[..., :3, :3], -1, -2), out=ret[..., 3:])
+    return ret
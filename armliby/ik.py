@@ -1,8 +1,53 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
-import pytorch_kinematics as pk
-from scipy.spatial.transform import Rotation as R
+from armliby.geometry import pose_diff_vector
+from armliby.robot.joint_limits import JointLimits
+from armliby.robot_model import RobotModel
+
+
+BACKEND_TORCH = 'torch'
+BACKEND_NUMPY = 'numpy'
+
+
+def _dls_solve(
+        jac: np.ndarray,
+        dx: np.ndarray,
+        singular_threshold: float,
+        max_damping: float,
+        ) -> np.ndarray:
+    """
+    Solve jac @ dj = dx in the damped least-squares sense using one SVD.
+
+    Damping is zero away from singularities (plain pseudo-inverse) and grows
+    as the smallest singular value falls below singular_threshold:
+    damping^2 = (1 - (s_min / singular_threshold)^2) * max_damping^2.
+    With singular_threshold >= max_damping every gain s / (s^2 + damping^2)
+    stays below 1 / max_damping, so |dj| <= |dx| / max_damping.
+
+    Args:
+        jac: (N, m, dof) Jacobians.
+        dx: (N, m) cartesian deltas.
+        singular_threshold: Smallest singular value below which damping starts.
+            0 disables damping, otherwise at least max_damping.
+        max_damping: Damping applied at an exact singularity.
+
+    Returns:
+        (N, dof) joint deltas.
+    """
+    u, s, vt = np.linalg.svd(jac, full_matrices=False)
+    s_min = s[:, -1:]
+    if singular_threshold > 0:
+        ratio = np.minimum(s_min / singular_threshold, 1.)
+        damping_sq = (1. - ratio ** 2) * max_damping ** 2
+    else:
+        damping_sq = np.zeros_like(s_min)
+    denom = s ** 2 + damping_sq
+    # drop directions that are numerically zero, as pinv does
+    valid = s > np.finfo(s.dtype).eps * s[:, :1] * max(jac.shape[1:])
+    inv_s = np.divide(s, denom, out=np.zeros_like(s), where=valid & (denom > 0))
+    ut_dx = np.einsum('nij,ni->nj', u, dx)
+    return np.einsum('nji,nj->ni', vt, inv_s * ut_dx)
 
 
 class Kinematics:
@@ -11,6 +56,9 @@ class Kinematics:
             urdf_path: str,
             end_link_name: str,
             mod_matrix: Optional[np.ndarray] = None,
+            backend: str = BACKEND_TORCH,
+            singular_threshold: float = 0.05,
+            max_damping: float = 0.05,
             ) -> None:
         """
         Initialize forward and inverse kinematics solvers.
@@ -23,36 +71,159 @@ class Kinematics:
                 Jacobian and cartesian delta is transformed by mod_matrix.
                 dx = mod_matrix @ dx
                 jac = mod_matrix @ jac
+            backend: Kinematics engine, 'torch' (pytorch_kinematics) or 'numpy'.
+                The numpy backend precomputes the chain once and does not import torch.
+            singular_threshold: Smallest Jacobian singular value below which
+                dj starts damping the solution. 0 disables damping,
+                otherwise it must be at least max_damping.
+            max_damping: Damping used by dj at an exact singularity.
+                Joint deltas are bounded by |dx| / max_damping, 20 * |dx| with the defaults.
         """
-        # Load robot description from URDF and specify end effector link
-        with open(urdf_path, "rb") as f:
-            urdf_content = f.read()
-
+        if 0 < singular_threshold < max_damping:
+            raise ValueError(
+                f"singular_threshold {singular_threshold} must be 0 or at least max_damping {max_damping}, "
+                "otherwise joint deltas are not bounded by |dx| / max_damping")
         self._mod_matrix = mod_matrix
-
+        self._ik_warm_start: Optional[np.ndarray] = None
+        self._singular_threshold = singular_threshold
+        self._max_damping = max_damping
+        self._backend = backend
         self.end_link_name = end_link_name
-        self._chain = pk.build_serial_chain_from_urdf(
-            data=urdf_content,
-            end_link_name=end_link_name,
-        )
+
+        if backend == BACKEND_TORCH:
+            import pytorch_kinematics as pk
+
+            # Load robot description from URDF and specify end effector link
+            with open(urdf_path, "rb") as f:
+                urdf_content = f.read()
+
+            self._chain = pk.build_serial_chain_from_urdf(
+                data=urdf_content,
+                end_link_name=end_link_name,
+            )
+            self.link_names: List[str] = self._chain.get_frame_names(exclude_fixed=False)
+            self._num_dof = len(self._chain.get_joints())
+        elif backend == BACKEND_NUMPY:
+            self._chain = RobotModel.load(urdf_path).chain(end_link_name)
+            self.link_names: List[str] = self._chain.link_names
+            self._num_dof = self._chain.num_dof
+        else:
+            raise ValueError(f"Unknown kinematics backend: {backend}")
 
     @property
     def num_dof(self) -> int:
-        return len(self._chain.get_joints())
+        return self._num_dof
+
+    @property
+    def mod_matrix(self) -> Optional[np.ndarray]:
+        return self._mod_matrix
 
-    def fk(self, js: np.ndarray) -> Dict[str, np.ndarray]:
+    def _fk_batch(self, js: np.ndarray, end_only: bool = False) -> np.ndarray:
+        """
+        Compute (N, num_links, 4, 4) link transforms with the selected backend.
+        If end_only is set, only the end link is computed and the shape is (N, 1, 4, 4).
+        """
+        if self._backend == BACKEND_NUMPY:
+            return self._chain.forward_kinematics(js, end_only=end_only)
+
+        if end_only:
+            tf = self._chain.forward_kinematics(js, end_only=True)
+            return tf.get_matrix().cpu().detach().numpy()[:, None]
+
+        tfs = self._chain.forward_kinematics(js, end_only=False)
+        ret = np.empty((js.shape[0], len(self.link_names), 4, 4), dtype=np.float32)
+        for ind, link_name in enumerate(self.link_names):
+            ret[:, ind] = tfs[link_name].get_matrix().cpu().detach().numpy()
+        return ret
+
+    def _jacobian(
+            self,
+            js: np.ndarray,
+            ret_eef_pose: bool = False,
+            ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute (N, 6, dof) end link Jacobians with the selected backend.
+        Optionally also return the (N, 4, 4) end link transforms.
+        """
+        if self._backend == BACKEND_NUMPY:
+            return self._chain.jacobian(js, ret_eef_pose=ret_eef_pose)
+        if ret_eef_pose:
+            jac, pose = self._chain.jacobian(js, ret_eef_pose=True)
+            return jac.detach().numpy(), pose.detach().numpy()
+        return self._chain.jacobian(js).detach().numpy()
+
+    def fk(self, js: np.ndarray, end_only: bool = False) -> Dict[str, np.ndarray]:
         """
         Perform forward kinematics and get transforms for all links.
 
         Args:
             js: The joint angles.
+            end_only: Compute only the end link transform.
 
         Returns:
-            A dictionary of transforms.
+            A dictionary of transforms. Contains only the end link if end_only is set.
         """
-        ret = self._chain.forward_kinematics(js, end_only=False)
-        ret = {key: val.get_matrix().cpu().detach().numpy()[0] for key, val in ret.items()}
-        return ret
+        tfs = self._fk_batch(np.atleast_2d(js), end_only=end_only)[0]
+        link_names = [self.end_link_name] if end_only else self.link_names
+        return dict(zip(link_names, tfs))
+
+    def fk_batch(
+            self,
+            js: np.ndarray,
+            batch_size: Optional[int] = None,
+            end_only: bool = False,
+            ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Perform forward kinematics for a batch of joint configurations.
+
+        Args:
+            js: The joint angles, shape (N, dof). In radians.
+            batch_size: Optional number of configurations evaluated per chain call.
+                Limits peak memory for very large N. Defaults to all at once.
+            end_only: Compute only the end link transforms.
+
+        Returns:
+            A tuple of a contiguous (N, num_links, 4, 4) array of link transforms
+            and the list of link names indexing the second axis.
+            num_links is 1 if end_only is set.
+        """
+        js = np.atleast_2d(js)
+        num = js.shape[0]
+        link_names = [self.end_link_name] if end_only else self.link_names
+        if batch_size is None or batch_size >= num:
+            return np.ascontiguousarray(self._fk_batch(js, end_only=end_only)), link_names
+
+        ret = None
+        for start in range(0, num, batch_size):
+            tfs = self._fk_batch(js[start:start + batch_size], end_only=end_only)
+            if ret is None:
+                ret = np.empty((num,) + tfs.shape[1:], dtype=tfs.dtype)
+            ret[start:start + batch_size] = tfs
+        return ret, link_names
+
+    def jacobian(
+            self,
+            js: np.ndarray,
+            ret_eef_pose: bool = False,
+            ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute end link Jacobians of the controlled subspace, mod_matrix @ jac if mod_matrix is set.
+
+        Args:
+            js: The joint angles, shape (N, dof) or (dof,). In radians.
+            ret_eef_pose: Also return the (N, 4, 4) end link transforms.
+
+        Returns:
+            (N, rows, dof) Jacobians, rows is 6 or the number of mod_matrix rows,
+            and the end link transforms if ret_eef_pose is set.
+        """
+        if ret_eef_pose:
+            jac, pose = self._jacobian(np.atleast_2d(js), ret_eef_pose=True)
+        else:
+            jac = self._jacobian(np.atleast_2d(js))
+        if self._mod_matrix is not None:
+            jac = self._mod_matrix @ jac
+        return (jac, pose) if ret_eef_pose else jac
 
     def dj(
             self,
@@ -61,6 +232,7 @@ class Kinematics:
             ) -> np.ndarray:
         """
         Compute the joint deltas to achieve a desired end effector cartesian delta.
+        Uses damped least squares, so deltas stay bounded near singularities.
 
         Args:
             js: The current joint angles. In radians.
@@ -69,14 +241,144 @@ class Kinematics:
         Returns:
             The joint deltas.
         """
-        jac = self._chain.jacobian(js).detach().numpy()[0]
+        jac = self._jacobian(np.atleast_2d(js))[0]
         if self._mod_matrix is not None:
             jac = self._mod_matrix @ jac
             dx = self._mod_matrix @ dx
 
-        jac_inv = np.linalg.pinv(jac)
-        dj = jac_inv @ dx
-        return dj
+        return _dls_solve(
+            jac[None],
+            np.asarray(dx)[None],
+            singular_threshold=self._singular_threshold,
+            max_damping=self._max_damping,
+        )[0]
+
+    def ik(
+            self,
+            target_pose: np.ndarray,
+            seed: Optional[np.ndarray] = None,
+            joint_limits: Optional[JointLimits] = None,
+            pos_tolerance: float = 1e-4,
+            rot_tolerance: float = 1e-3,
+            max_iters: int = 100,
+            max_step: float = 0.5,
+            ) -> Tuple[np.ndarray, bool]:
+        """
+        Solve inverse kinematics for an absolute end effector pose.
+
+        Iterates damped least-squares steps until the pose error is within tolerance.
+        If seed is not given, the previous solution is used as a warm start.
+
+        Args:
+            target_pose: The desired 4x4 end effector transform in the root frame.
+            seed: The initial joint angles. In radians.
+            joint_limits: Optional joint limits in degrees, as created by JointLimits.from_urdf
+                with the fixed joints in front of the chain skipped, see JointLimits.chain_limits.
+            pos_tolerance: Position error tolerance. In meters.
+            rot_tolerance: Rotation error tolerance. In radians.
+            max_iters: Maximum number of iterations.
+            max_step: Maximum norm of the joint delta per iteration. In radians.
+
+        Returns:
+            The joint angles and whether the solution converged.
+        """
+        if seed is None:
+            seed = self._ik_warm_start
+        js, success = self.ik_batch(
+            target_poses=np.asarray(target_pose)[None],
+            seeds=None if seed is None else np.asarray(seed)[None],
+            joint_limits=joint_limits,
+            pos_tolerance=pos_tolerance,
+            rot_tolerance=rot_tolerance,
+            max_iters=max_iters,
+            max_step=max_step,
+        )
+        self._ik_warm_start = js[0].copy()
+        return js[0], bool(success[0])
+
+    def ik_batch(
+            self,
+            target_poses: np.ndarray,
+            seeds: Optional[np.ndarray] = None,
+            joint_limits: Optional[JointLimits] = None,
+            pos_tolerance: float = 1e-4,
+            rot_tolerance: float = 1e-3,
+            max_iters: int = 100,
+            max_step: float = 0.5,
+            ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Solve inverse kinematics for N end effector poses at once.
+
+        Args:
+            target_poses: The desired end effector transforms, shape (N, 4, 4).
+            seeds: The initial joint angles, shape (N, dof) or (dof,). In radians.
+                Defaults to the middle of the joint limits or zeros.
+            joint_limits: Optional joint limits in degrees, as created by JointLimits.from_urdf
+                with the fixed joints in front of the chain skipped, see JointLimits.chain_limits.
+            pos_tolerance: Position error tolerance. In meters.
+            rot_tolerance: Rotation error tolerance. In radians.
+            max_iters: Maximum number of iterations.
+            max_step: Maximum norm of the joint delta per iteration. In radians.
+
+        Returns:
+            (N, dof) joint angles and (N,) boolean array of converged solutions.
+        """
+        target_poses = np.asarray(target_poses, dtype=np.float64)
+        num = target_poses.shape[0]
+
+        lower = upper = None
+        if joint_limits is not None:
+            lower, upper = joint_limits.chain_limits(self.num_dof)
+
+        if seeds is None:
+            seeds = np.zeros(self.num_dof) if lower is None else 0.5 * (lower + upper)
+        js = np.array(np.broadcast_to(seeds, (num, self.num_dof)), dtype=np.float64)
+        if lower is not None:
+            js = np.clip(js, lower, upper)
+
+        # project errors onto the controllable subspace defined by mod_matrix
+        err_proj = None
+        if self._mod_matrix is not None:
+            err_proj = self._mod_matrix.T @ self._mod_matrix
+
+        success = np.zeros(num, dtype=bool)
+        active = np.arange(num)
+        for _ in range(max_iters + 1):
+            jac, pose = self._jacobian(js[active], ret_eef_pose=True)
+            target = target_poses[active]
+            raw_err = pose_diff_vector(pose, target)
+            # the convergence check only looks at the controllable part of the error
+            err = raw_err if err_proj is None else raw_err @ err_proj.T
+
+            converged = (
+                (np.linalg.norm(err[:, :3], axis=1) <= pos_tolerance)
+                & (np.linalg.norm(err[:, 3:], axis=1) <= rot_tolerance)
+            )
+            success[active[converged]] = True
+            active = active[~converged]
+            if len(active) == 0:
+                break
+            jac = jac[~converged]
+            err = raw_err[~converged]
+
+            if self._mod_matrix is not None:
+                jac = self._mod_matrix @ jac
+                err = err @ self._mod_matrix.T
+
+            step = _dls_solve(
+                jac,
+                err,
+                singular_threshold=self._singular_threshold,
+                max_damping=self._max_damping,
+            )
+            step_norm = np.linalg.norm(step, axis=1, keepdims=True)
+            step *= np.minimum(1., max_step / np.maximum(step_norm, 1e-12))
+
+            js[active] += step
+            if lower is not None:
+                js[active] = np.clip(js[active], lower, upper)
+
+        return js, success
 
     def dx(
             self,
@@ -87,15 +389,22 @@ class Kinematics:
         Compute the cartesian delta between two joint configurations.
 
         Args:
-            js1: The first joint configuration.
-            js2: The second joint configuration.
+            js1: The first joint configuration, shape (dof,) or (N, dof).
+            js2: The second joint configuration, same shape as js1.
 
         Returns:
-            The cartesian delta.
-        """
-        
-        x1 = self.fk(js1)[self.end_link_name]
-        x2 = self.fk(js2)[self.end_link_name]
-        d_translation = x2[:3, 3] - x1[:3, 3]
-        d_rotvec = R.from_matrix(x2[:3, :3] @ x1[:3, :3].T).as_rotvec(degrees=True)
-        return np.concatenate([d_translation, d_rotvec])
+            The cartesian delta, translation and rotation vector in degrees.
+            Shape (6,) or (N, 6).
+        """
+        js1 = np.asarray(js1)
+        single = js1.ndim == 1
+        js1 = np.atleast_2d(js1)
+        js2 = np.atleast_2d(js2)
+
+        # both configurations go through a single end link only FK call
+        tfs = self._fk_batch(np.concatenate([js1, js2]), end_only=True)[:, 0]
+        x1 = tfs[:len(js1)]
+        x2 = tfs[len(js1):]
+        ret = pose_diff_vector(x1, x2)
+        np.rad2deg(ret[:, 3:], out=ret[:, 3:])
+        return ret[0] if single else ret
@@ -0,0 +1,258 @@
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from armliby.robot_model import file_hash, get_cache_dir
+
+
+# Vertex clustering cell size of each level of detail as a fraction of the mesh bounding box diagonal.
+# LOD 0 keeps every triangle, higher levels merge vertices closer than the cell size.
+DEFAULT_LOD_CELL_FRACTIONS = (0., 1. / 200, 1. / 100, 1. / 50)
+
+# bump when the cached files change
+_CACHE_VERSION = 1
+
+# vertices are stored as uint16 offsets inside the mesh bounding box
+_QUANTIZATION_LEVELS = 2 ** 16 - 1
+
+_STL_HEADER_BYTES = 80
+_STL_RECORD_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+_ASCII_VERTEX_RE = re.compile(
+    rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)'
+)
+
+
+def read_stl(path: str) -> np.ndarray:
+    """
+    Read a binary or ASCII STL file.
+
+    Args:
+        path: The STL file path.
+
+    Returns:
+        (num_triangles, 3, 3) float32 triangle vertices.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) >= _STL_HEADER_BYTES + 4:
+        num_triangles = int(np.frombuffer(data, dtype='<u4', count=1, offset=_STL_HEADER_BYTES)[0])
+        # ASCII files may start with "solid" too, the size check tells them apart
+        if len(data) == _STL_HEADER_BYTES + 4 + num_triangles * _STL_RECORD_DTYPE.itemsize:
+            records = np.frombuffer(
+                data, dtype=_STL_RECORD_DTYPE, count=num_triangles, offset=_STL_HEADER_BYTES + 4)
+            return records['vertices'].astype(np.float32)
+    vertices = np.array(_ASCII_VERTEX_RE.findall(data), dtype=np.float32)
+    if len(vertices) % 3 != 0:
+        raise ValueError(f"Malformed STL file {path}")
+    return vertices.reshape(-1, 3, 3)
+
+
+def write_stl(path: str, triangles: np.ndarray) -> None:
+    """
+    Write a binary STL file.
+
+    Args:
+        path: The STL file path.
+        triangles: (num_triangles, 3, 3) triangle vertices.
+    """
+    records = np.zeros(len(triangles), dtype=_STL_RECORD_DTYPE)
+    records['vertices'] = triangles
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    records['normal'] = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    with open(path, 'wb') as f:
+        f.write(b'armliby binary STL'.ljust(_STL_HEADER_BYTES, b' '))
+        f.write(np.uint32(len(records)).astype('<u4').tobytes())
+        f.write(records.tobytes())
+
+
+def index_triangles(triangles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge identical vertices of a triangle soup.
+
+    Args:
+        triangles: (num_triangles, 3, 3) triangle vertices.
+
+    Returns:
+        (num_vertices, 3) unique vertices and (num_triangles, 3) int32 vertex indices.
+    """
+    vertices, faces = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    return vertices, faces.reshape(-1, 3).astype(np.int32)
+
+
+def decimate(vertices: np.ndarray, faces: np.ndarray, cell_size: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simplify an indexed mesh by vertex clustering.
+
+    Vertices falling into the same grid cell are replaced by their mean,
+    triangles that collapse to a line or a point and duplicate triangles are removed.
+
+    Args:
+        vertices: (num_vertices, 3) vertices.
+        faces: (num_triangles, 3) vertex indices.
+        cell_size: The grid cell size, same units as vertices.
+
+    Returns:
+        Simplified vertices and faces.
+    """
+    if cell_size <= 0.:
+        return vertices, faces
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+    new_vertices = np.zeros((len(counts), 3), dtype=np.float64)
+    np.add.at(new_vertices, cluster, vertices)
+    new_vertices /= counts[:, None]
+
+    new_faces = cluster[faces]
+    valid = (
+        (new_faces[:, 0] != new_faces[:, 1])
+        & (new_faces[:, 1] != new_faces[:, 2])
+        & (new_faces[:, 2] != new_faces[:, 0])
+    )
+    new_faces = new_faces[valid]
+    # the same triangle may be produced from several original ones, keep the first
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+
+    # drop clusters no triangle refers to anymore
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    return new_vertices[used].astype(vertices.dtype), new_faces.reshape(-1, 3).astype(np.int32)
+
+
+class MeshCache:
+    def __init__(
+            self,
+            urdf_path: str,
+            lod_cell_fractions: Sequence[float] = DEFAULT_LOD_CELL_FRACTIONS,
+            ) -> None:
+        """
+        Preprocessed link meshes cached next to the URDF.
+
+        Each source mesh is converted once into every level of detail, stored as
+        a binary STL for the web page and a compressed npz with quantized, indexed
+        vertices for Open3D. Cache files are keyed by the source file hash,
+        so edited meshes are picked up automatically.
+
+        Args:
+            urdf_path: The path to the URDF file.
+            lod_cell_fractions: Vertex clustering cell size of each level of detail
+                as a fraction of the mesh bounding box diagonal, 0 keeps the full mesh.
+        """
+        self.cache_dir = get_cache_dir(urdf_path)
+        self.lod_cell_fractions = tuple(lod_cell_fractions)
+        self._source_hashes: Dict[str, str] = {}
+
+    @property
+    def num_lods(self) -> int:
+        return len(self.lod_cell_fractions)
+
+    def _check_lod(self, lod: int) -> None:
+        if not 0 <= lod < self.num_lods:
+            raise ValueError(f"Level of detail must be in [0, {self.num_lods}), got {lod}")
+
+    def _cache_path(self, mesh_path: str, lod: int, ext: str) -> str:
+        if mesh_path not in self._source_hashes:
+            self._source_hashes[mesh_path] = file_hash(mesh_path)[:16]
+        name = os.path.splitext(os.path.basename(mesh_path))[0]
+        fraction = self.lod_cell_fractions[lod]
+        return os.path.join(
+            self.cache_dir,
+            f"{name}.{self._source_hashes[mesh_path]}.v{_CACHE_VERSION}.lod{lod}_{fraction:.6g}.{ext}",
+        )
+
+    def preprocess(self, mesh_path: str) -> None:
+        """
+        Build all levels of detail of a mesh that are not cached yet.
+
+        Args:
+            mesh_path: The source STL file path.
+        """
+        missing = [
+            lod for lod in range(self.num_lods)
+            if not os.path.exists(self._cache_path(mesh_path, lod, 'stl'))
+            or not os.path.exists(self._cache_path(mesh_path, lod, 'npz'))
+        ]
+        if not missing:
+            return
+
+        vertices, faces = index_triangles(read_stl(mesh_path))
+        diagonal = float(np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for lod in missing:
+            lod_vertices, lod_faces = decimate(vertices, faces, self.lod_cell_fractions[lod] * diagonal)
+            self._save_lod(mesh_path, lod, lod_vertices, lod_faces)
+
+    def _save_lod(self, mesh_path: str, lod: int, vertices: np.ndarray, faces: np.ndarray) -> None:
+        stl_path = self._cache_path(mesh_path, lod, 'stl')
+        npz_path = self._cache_path(mesh_path, lod, 'npz')
+
+        origin = vertices.min(axis=0).astype(np.float64)
+        scale = (vertices.max(axis=0) - origin) / _QUANTIZATION_LEVELS
+        scale[scale == 0.] = 1.
+        quantized = np.round((vertices - origin) / scale).astype(np.uint16)
+
+        # write to temporary files first so readers never see a partial cache
+        tmp_suffix = f".{os.getpid()}.tmp"
+        write_stl(stl_path + tmp_suffix, vertices[faces].astype(np.float32))
+        os.replace(stl_path + tmp_suffix, stl_path)
+        np.savez_compressed(
+            npz_path + tmp_suffix + '.npz',
+            vertices=quantized,
+            origin=origin,
+            scale=scale,
+            faces=faces.astype(np.uint16 if len(vertices) <= 2 ** 16 else np.uint32),
+        )
+        os.replace(npz_path + tmp_suffix + '.npz', npz_path)
+
+    def get_stl_path(self, mesh_path: str, lod: int = 0) -> str:
+        """
+        Get the binary STL file of a mesh level of detail, building it on first use.
+
+        Args:
+            mesh_path: The source STL file path.
+            lod: The level of detail, 0 is the full mesh.
+
+        Returns:
+            The cached binary STL file path.
+        """
+        self._check_lod(lod)
+        self.preprocess(mesh_path)
+        return self._cache_path(mesh_path, lod, 'stl')
+
+    def load_indexed(self, mesh_path: str, lod: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Load an indexed mesh level of detail, building it on first use.
+
+        Args:
+            mesh_path: The source STL file path.
+            lod: The level of detail, 0 is the full mesh.
+
+        Returns:
+            (num_vertices, 3) float64 vertices and (num_triangles, 3) int32 vertex indices.
+        """
+        self._check_lod(lod)
+        self.preprocess(mesh_path)
+        with np.load(self._cache_path(mesh_path, lod, 'npz')) as data:
+            vertices = data['vertices'] * data['scale'] + data['origin']
+            return vertices, data['faces'].astype(np.int32)
+
+    def preprocess_all(self, mesh_paths: List[str], verbose: bool = False) -> None:
+        """
+        Build levels of detail for several meshes, e.g. get_link_stl_map().values().
+
+        Args:
+            mesh_paths: The source STL file paths.
+            verbose: Print the triangle count of every level.
+        """
+        for mesh_path in mesh_paths:
+            self.preprocess(mesh_path)
+            if verbose:
+                counts = [len(self.load_indexed(mesh_path, lod)[1]) for lod in range(self.num_lods)]
+                print(f"{mesh_path}: triangles per LOD {counts}")
+
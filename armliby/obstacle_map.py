@@ -0,0 +1,356 @@
+import json
+import os
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# bump when the stored layout changes
+_FORMAT_VERSION = 1
+_META_FILE = 'meta.json'
+_OCCUPANCY_FILE = 'occupancy.npy'
+_SDF_FILE = 'sdf.npy'
+
+# distances are recomputed in blocks of this many voxels per axis, bounds memory use on large maps
+DEFAULT_BLOCK_SIZE = 64
+
+
+def _truncated_distance(mask: np.ndarray, max_steps: int) -> np.ndarray:
+    """
+    Euclidean distance in voxels from every voxel to the nearest True voxel.
+
+    Separable minimum over offsets up to max_steps along each axis, exact for distances
+    up to max_steps, larger distances are only guaranteed to stay larger.
+    """
+    far = np.float32(3 * (max_steps + 1) ** 2)
+    dist = np.where(mask, np.float32(0.), far)
+    for axis in range(3):
+        ret = dist.copy()
+        size = dist.shape[axis]
+        for offset in range(1, min(max_steps, size - 1) + 1):
+            square = np.float32(offset * offset)
+            head = [slice(None)] * 3
+            tail = [slice(None)] * 3
+            head[axis] = slice(0, size - offset)
+            tail[axis] = slice(offset, size)
+            head = tuple(head)
+            tail = tuple(tail)
+            np.minimum(ret[head], dist[tail] + square, out=ret[head])
+            np.minimum(ret[tail], dist[head] + square, out=ret[tail])
+        dist = ret
+    return np.sqrt(dist)
+
+
+def sample_triangles(vertices: np.ndarray, faces: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    Points covering triangle surfaces on a barycentric lattice.
+
+    Args:
+        vertices: (V, 3) mesh vertices.
+        faces: (F, 3) vertex indices.
+        spacing: Largest distance between neighbouring points along an edge.
+
+    Returns:
+        (N, 3) points including the vertices.
+    """
+    triangles = np.asarray(vertices, dtype=np.float64)[np.asarray(faces)]
+    edges = np.linalg.norm(triangles - np.roll(triangles, 1, axis=1), axis=2).max(axis=1)
+    steps = np.maximum(np.ceil(edges / spacing).astype(int), 1)
+    points = []
+    # triangles with the same number of steps share one lattice
+    for num in np.unique(steps):
+        grid_u, grid_v = np.meshgrid(np.arange(num + 1), np.arange(num + 1), indexing='ij')
+        inside = grid_u + grid_v <= num
+        u = grid_u[inside] / num
+        v = grid_v[inside] / num
+        weights = np.stack([1. - u - v, u, v], axis=1)
+        points.append(np.einsum('pk,tki->tpi', weights, triangles[steps == num]).reshape(-1, 3))
+    if not points:
+        return np.zeros((0, 3))
+    return np.concatenate(points)
+
+
+class ObstacleMap:
+    def __init__(
+            self,
+            origin: Sequence[float],
+            voxel_size: float,
+            shape: Sequence[int],
+            max_distance: float = 0.1,
+            path: Optional[str] = None,
+            ) -> None:
+        """
+        Voxel occupancy map of the robot environment with a truncated signed distance field.
+
+        Obstacles are added as points, meshes or boxes and only mark voxels. update recomputes
+        the distance field around the voxels changed since the previous update, so queries
+        never rebuild anything. Distances are measured from voxel boundaries and capped at
+        max_distance, negative inside occupied voxels. Meshes mark their surface only.
+
+        Args:
+            origin: Minimum corner of the map in the robot root frame. In meters.
+            voxel_size: Voxel edge length. In meters.
+            shape: Number of voxels along x, y and z.
+            max_distance: Truncation distance of the field. In meters.
+            path: Directory to store the map in as memory-mapped files,
+                kept in memory if None. Must not hold another map.
+        """
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = float(voxel_size)
+        self.shape = tuple(int(size) for size in shape)
+        self.max_distance = float(max_distance)
+        self.path = path
+
+        if path is None:
+            self.occupancy = np.zeros(self.shape, dtype=np.uint8)
+            self.sdf = np.full(self.shape, self.max_distance, dtype=np.float32)
+        else:
+            if os.path.exists(os.path.join(path, _META_FILE)):
+                raise ValueError(f"Obstacle map already exists: {path}")
+            os.makedirs(path, exist_ok=True)
+            self._write_meta(path)
+            self.occupancy = np.lib.format.open_memmap(
+                os.path.join(path, _OCCUPANCY_FILE), mode='w+', dtype=np.uint8, shape=self.shape)
+            self.sdf = np.lib.format.open_memmap(
+                os.path.join(path, _SDF_FILE), mode='w+', dtype=np.float32, shape=self.shape)
+            self.sdf[...] = self.max_distance
+        self._init_query()
+
+    def _init_query(self) -> None:
+        self._flat_sdf = self.sdf.reshape(-1)
+        self._strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1])
+        self._max_index = np.array(self.shape) - 1
+        self._max_base = np.maximum(self._max_index - 1, 0)
+        # flat index offsets of the 8 interpolation corners in x, y, z order,
+        # neighbour offsets collapse on single voxel axes
+        corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)])
+        self._corner_offsets = corners @ (np.minimum(self._max_index, 1) * self._strides)
+        # (lo, hi) voxel index corners of the changes waiting for update
+        self._dirty: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def _write_meta(self, path: str) -> None:
+        with open(os.path.join(path, _META_FILE), 'w') as f:
+            json.dump({
+                'version': _FORMAT_VERSION,
+                'origin': self.origin.tolist(),
+                'voxel_size': self.voxel_size,
+                'shape': list(self.shape),
+                'max_distance': self.max_distance,
+            }, f)
+
+    @staticmethod
+    def load(path: str, mmap_mode: Optional[str] = 'r+') -> 'ObstacleMap':
+        """
+        Open a map stored with path or save.
+
+        Args:
+            path: The map directory.
+            mmap_mode: np.load memory map mode, 'r' for read-only queries,
+                None loads the map into memory.
+
+        Returns:
+            The obstacle map.
+        """
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        if meta['version'] != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported obstacle map format in {path}: {meta}")
+        obstacle_map = ObstacleMap.__new__(ObstacleMap)
+        obstacle_map.origin = np.array(meta['origin'], dtype=np.float64)
+        obstacle_map.voxel_size = float(meta['voxel_size'])
+        obstacle_map.shape = tuple(meta['shape'])
+        obstacle_map.max_distance = float(meta['max_distance'])
+        obstacle_map.path = path if mmap_mode is not None else None
+        obstacle_map.occupancy = np.load(os.path.join(path, _OCCUPANCY_FILE), mmap_mode=mmap_mode)
+        obstacle_map.sdf = np.load(os.path.join(path, _SDF_FILE), mmap_mode=mmap_mode)
+        obstacle_map._init_query()
+        return obstacle_map
+
+    def save(self, path: str) -> None:
+        """Store the map in a directory, e.g. an in-memory map built once for later load."""
+        os.makedirs(path, exist_ok=True)
+        self._write_meta(path)
+        np.save(os.path.join(path, _OCCUPANCY_FILE), self.occupancy)
+        np.save(os.path.join(path, _SDF_FILE), self.sdf)
+
+    def flush(self) -> None:
+        """Write memory-mapped changes to disk."""
+        for array in (self.occupancy, self.sdf):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    @property
+    def bounds(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Minimum and maximum corners of the map. In meters."""
+        return self.origin, self.origin + np.array(self.shape) * self.voxel_size
+
+    def _mark_dirty(self, lo: np.ndarray, hi: np.ndarray) -> None:
+        if self._dirty is None:
+            self._dirty = (lo, hi)
+        else:
+            self._dirty = (np.minimum(self._dirty[0], lo), np.maximum(self._dirty[1], hi))
+
+    def add_points(self, points: np.ndarray, occupied: bool = True) -> int:
+        """
+        Mark the voxels containing points, e.g. a depth camera point cloud.
+
+        Args:
+            points: (N, 3) points in the map frame. Points outside the map are ignored.
+            occupied: Mark the voxels occupied, or free to remove obstacles.
+
+        Returns:
+            The number of points inside the map.
+        """
+        indices = np.floor((np.asarray(points, dtype=np.float64).reshape(-1, 3) - self.origin) / self.voxel_size)
+        indices = indices[((indices >= 0) & (indices <= self._max_index)).all(axis=1)].astype(np.int64)
+        if len(indices) == 0:
+            return 0
+        self.occupancy[indices[:, 0], indices[:, 1], indices[:, 2]] = occupied
+        self._mark_dirty(indices.min(axis=0), indices.max(axis=0) + 1)
+        return len(indices)
+
+    def add_mesh(self, vertices: np.ndarray, faces: np.ndarray, transform: Optional[np.ndarray] = None) -> int:
+        """
+        Mark the voxels touched by a triangle mesh surface.
+
+        Args:
+            vertices: (V, 3) mesh vertices.
+            faces: (F, 3) vertex indices.
+            transform: Optional 4x4 pose of the mesh in the map frame.
+
+        Returns:
+            The number of surface samples inside the map.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if transform is not None:
+            vertices = vertices @ transform[:3, :3].T + transform[:3, 3]
+        return self.add_points(sample_triangles(vertices, faces, 0.5 * self.voxel_size))
+
+    def add_open3d(self, geometry, transform: Optional[np.ndarray] = None) -> int:
+        """
+        Mark an Open3D TriangleMesh or PointCloud, e.g. from o3d.io.read_triangle_mesh.
+
+        Args:
+            geometry: The Open3D geometry.
+            transform: Optional 4x4 pose of the geometry in the map frame.
+
+        Returns:
+            The number of samples inside the map.
+        """
+        if hasattr(geometry, 'triangles'):
+            return self.add_mesh(np.asarray(geometry.vertices), np.asarray(geometry.triangles), transform)
+        points = np.asarray(geometry.points)
+        if transform is not None:
+            points = points @ transform[:3, :3].T + transform[:3, 3]
+        return self.add_points(points)
+
+    def add_box(self, min_corner: Sequence[float], max_corner: Sequence[float], occupied: bool = True) -> None:
+        """
+        Mark a solid axis aligned box, e.g. a table top.
+
+        Args:
+            min_corner: Minimum box corner in the map frame. In meters.
+            max_corner: Maximum box corner in the map frame. In meters.
+            occupied: Mark the voxels occupied, or free to clear the box.
+        """
+        lo = np.floor((np.asarray(min_corner) - self.origin) / self.voxel_size).astype(np.int64)
+        hi = np.ceil((np.asarray(max_corner) - self.origin) / self.voxel_size).astype(np.int64)
+        lo = np.clip(lo, 0, self.shape)
+        hi = np.clip(hi, 0, self.shape)
+        if (hi <= lo).any():
+            return
+        self.occupancy[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = occupied
+        self._mark_dirty(lo, hi)
+
+    def clear(self) -> None:
+        """Remove all obstacles."""
+        self.occupancy[...] = 0
+        self._mark_dirty(np.zeros(3, dtype=np.int64), np.array(self.shape))
+
+    @property
+    def needs_update(self) -> bool:
+        return self._dirty is not None
+
+    def update(self, block_size: int = DEFAULT_BLOCK_SIZE) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Recompute the distance field where it may have changed since the previous update.
+
+        Only voxels within max_distance of the changed voxels are recomputed,
+        block by block, each block reading a max_distance wide margin around it.
+
+        Args:
+            block_size: Voxels per axis computed at once.
+
+        Returns:
+            (lo, hi) voxel index corners of the recomputed region, None if nothing changed.
+        """
+        if self._dirty is None:
+            return None
+        steps = int(np.ceil(self.max_distance / self.voxel_size)) + 1
+        shape = np.array(self.shape)
+        lo = np.maximum(self._dirty[0] - steps, 0)
+        hi = np.minimum(self._dirty[1] + steps, shape)
+        for x in range(lo[0], hi[0], block_size):
+            for y in range(lo[1], hi[1], block_size):
+                for z in range(lo[2], hi[2], block_size):
+                    block_lo = np.array([x, y, z])
+                    block_hi = np.minimum(block_lo + block_size, hi)
+                    self._update_block(block_lo, block_hi, steps)
+        self._dirty = None
+        return lo, hi
+
+    def _update_block(self, lo: np.ndarray, hi: np.ndarray, steps: int) -> None:
+        window_lo = np.maximum(lo - steps, 0)
+        window_hi = np.minimum(hi + steps, self.shape)
+        window = tuple(slice(start, end) for start, end in zip(window_lo, window_hi))
+        inner = tuple(slice(start, end) for start, end in zip(lo - window_lo, hi - window_lo))
+        occupied = self.occupancy[window] != 0
+
+        # distances between voxel centers, the surface is half a voxel from the centers
+        outside = _truncated_distance(occupied, steps)[inner]
+        inside = _truncated_distance(~occupied, steps)[inner]
+        sdf = np.where(occupied[inner], 0.5 - inside, outside - 0.5) * np.float32(self.voxel_size)
+        np.clip(sdf, -self.max_distance, self.max_distance, out=sdf)
+        self.sdf[tuple(slice(start, end) for start, end in zip(lo, hi))] = sdf
+
+    def distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        Signed distance to the nearest obstacle with trilinear interpolation between voxel centers.
+        Points outside the map get the distance of the nearest map point plus the distance to it,
+        capped at max_distance.
+
+        Args:
+            points: (..., 3) points in the map frame.
+
+        Returns:
+            (...) distances. In meters.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        grid = (points.reshape(-1, 3) - self.origin) / self.voxel_size - 0.5
+        clamped = np.minimum(np.maximum(grid, 0.), self._max_index)
+        # truncation is floor for non-negative values
+        base = np.minimum(clamped.astype(np.int64), self._max_base)
+        values = self._flat_sdf.take((base @ self._strides)[:, None] + self._corner_offsets)
+        weights = np.empty(grid.shape + (2,))
+        np.subtract(clamped, base, out=weights[..., 1])
+        np.subtract(1., weights[..., 1], out=weights[..., 0])
+        ret = np.einsum(
+            'nijk,ni,nj,nk->n', values.reshape(-1, 2, 2, 2), weights[:, 0], weights[:, 1], weights[:, 2])
+
+        offset = grid - clamped
+        outside = np.sqrt(np.einsum('ni,ni->n', offset, offset)) * self.voxel_size
+        ret = np.minimum(ret + outside, self.max_distance)
+        return ret.reshape(points.shape[:-1])
+
+    def sphere_clearance(self, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        Clearance of spheres, e.g. SelfCollisionChecker.world_spheres of link poses from Kinematics.fk_batch.
+
+        Args:
+            centers: (..., S, 3) sphere centers in the map frame.
+            radii: (S,) sphere radii.
+
+        Returns:
+            (..., S) distances from the sphere surfaces to obstacles, negative for contact. In meters.
+        """
+        return self.distance(centers) - radii
@@ -0,0 +1,393 @@
+import hashlib
+import json
+import os
+from typing import Tuple
+
+import numpy as np
+from armliby.ik import Kinematics
+from armliby.robot.joint_limits import JointLimits
+from armliby.robot_model import file_hash, get_cache_dir
+
+
+# bump when the stored index changes
+_FORMAT_VERSION = 1
+
+# end link approach directions are binned into this many directions on the unit sphere,
+# one bit each in the coverage mask
+NUM_DIRECTION_BINS = 32
+
+DEFAULT_VOXEL_SIZE = 0.01
+DEFAULT_NUM_SAMPLES = 2 ** 20
+DEFAULT_BATCH_SIZE = 2 ** 15
+
+
+def direction_bins(num_bins: int = NUM_DIRECTION_BINS) -> np.ndarray:
+    """(num_bins, 3) unit directions evenly spread on the sphere (Fibonacci lattice)."""
+    ind = np.arange(num_bins) + 0.5
+    z = 1. - 2. * ind / num_bins
+    radius = np.sqrt(1. - z * z)
+    angle = np.pi * (1. + 5. ** 0.5) * ind
+    return np.stack([radius * np.cos(angle), radius * np.sin(angle), z], axis=1)
+
+
+def _nearest_voxel(mask: np.ndarray) -> np.ndarray:
+    """
+    Flat index of the nearest True voxel of every voxel, exact Euclidean nearest.
+    Separable minimum over all offsets along each axis that keeps the source coordinates.
+    """
+    shape = mask.shape
+    far = np.float32(3 * max(shape) ** 2 + 1)
+    dist = np.where(mask, np.float32(0.), far)
+    # source voxel coordinates of the current minimum
+    source = np.stack(np.meshgrid(*[np.arange(size, dtype=np.int32) for size in shape], indexing='ij'))
+    for axis in range(3):
+        ret = dist.copy()
+        ret_source = source.copy()
+        size = shape[axis]
+        for offset in range(1, size):
+            square = np.float32(offset * offset)
+            for dst_range, src_range in (
+                    (slice(0, size - offset), slice(offset, size)),
+                    (slice(offset, size), slice(0, size - offset))):
+                dst = [slice(None)] * 3
+                src = [slice(None)] * 3
+                dst[axis] = dst_range
+                src[axis] = src_range
+                dst = tuple(dst)
+                src = tuple(src)
+                candidate = dist[src] + square
+                better = candidate < ret[dst]
+                ret[dst] = np.where(better, candidate, ret[dst])
+                for coord in range(3):
+                    ret_source[coord][dst] = np.where(better, source[coord][src], ret_source[coord][dst])
+        dist = ret
+        source = ret_source
+    return np.ravel_multi_index(tuple(source), shape).astype(np.int32)
+
+
+class ReachabilityIndex:
+    def __init__(
+            self,
+            origin: np.ndarray,
+            voxel_size: float,
+            counts: np.ndarray,
+            manipulability: np.ndarray,
+            coverage: np.ndarray,
+            min_manipulability: float = 0.,
+            approach_axis: int = 2,
+            key: str = '',
+            ) -> None:
+        """
+        Voxel index of end link positions reachable within the joint limits.
+
+        Every voxel stores the number of sampled configurations reaching it, the best
+        manipulability among them and a bit mask of the approach directions reached there,
+        see direction_bins. A voxel is reachable if its best manipulability is above
+        min_manipulability, so near singular regions can be excluded. Lookups and projections
+        of points onto the reachable set are O(1), the nearest reachable voxel of every voxel
+        is precomputed. Use build_reachability_index to create it.
+
+        Args:
+            origin: Minimum corner of the grid in the chain root frame. In meters.
+            voxel_size: Voxel edge length. In meters.
+            counts: (X, Y, Z) uint32 sample counts.
+            manipulability: (X, Y, Z) float32 best manipulability, 0 for unreached voxels.
+            coverage: (X, Y, Z) uint32 approach direction bit masks.
+            min_manipulability: Manipulability threshold of reachable voxels.
+            approach_axis: End link frame axis whose direction is binned, 2 for z.
+            key: Hash of the build inputs, see build_key.
+        """
+        self.key = key
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel_size = float(voxel_size)
+        self.counts = counts
+        self.manipulability = manipulability
+        self.coverage = coverage
+        self.approach_axis = approach_axis
+        self.shape = counts.shape
+        self._strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1])
+        self._max_index = np.array(self.shape) - 1
+        self._flat_manipulability = manipulability.reshape(-1)
+        self._flat_coverage = self.coverage_fraction.reshape(-1)
+        self.set_min_manipulability(min_manipulability)
+
+    def set_min_manipulability(self, min_manipulability: float) -> None:
+        """Change the reachable set threshold, recomputes the nearest reachable voxel map."""
+        self.min_manipulability = float(min_manipulability)
+        self.reachable = (self.counts > 0) & (self.manipulability > self.min_manipulability)
+        if not self.reachable.any():
+            raise ValueError(f"No voxel has manipulability above {min_manipulability}")
+        self._nearest = _nearest_voxel(self.reachable).reshape(-1)
+        self._flat_reachable = self.reachable.reshape(-1)
+        # voxel centers by flat index
+        self._centers = (
+            np.stack(np.unravel_index(np.arange(self.reachable.size), self.shape), axis=1) + 0.5
+        ) * self.voxel_size + self.origin
+
+    @property
+    def coverage_fraction(self) -> np.ndarray:
+        """(X, Y, Z) fraction of approach direction bins reached in every voxel."""
+        bits = np.unpackbits(self.coverage[..., None].view(np.uint8), axis=-1)
+        return (bits.sum(axis=-1) / NUM_DIRECTION_BINS).astype(np.float32)
+
+    def _flat_index(self, points: np.ndarray) -> np.ndarray:
+        grid = np.floor((points.reshape(-1, 3) - self.origin) / self.voxel_size).astype(np.int64)
+        return np.minimum(np.maximum(grid, 0), self._max_index) @ self._strides
+
+    def _inside(self, points: np.ndarray) -> np.ndarray:
+        grid = (points.reshape(-1, 3) - self.origin) / self.voxel_size
+        return ((grid >= 0) & (grid < self.shape)).all(axis=1)
+
+    def is_reachable(self, points: np.ndarray) -> np.ndarray:
+        """
+        Check end link positions.
+
+        Args:
+            points: (..., 3) positions in the chain root frame.
+
+        Returns:
+            (...) boolean flags.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        ret = self._flat_reachable[self._flat_index(points)] & self._inside(points)
+        return ret.reshape(points.shape[:-1])
+
+    def lookup(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Scores of end link positions.
+
+        Args:
+            points: (..., 3) positions in the chain root frame.
+
+        Returns:
+            (...) reachable flags, (...) best manipulability and (...) approach direction coverage
+            fractions. Points outside the grid are unreachable with zero scores.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        index = self._flat_index(points)
+        inside = self._inside(points)
+        shape = points.shape[:-1]
+        reachable = self._flat_reachable[index] & inside
+        manipulability = np.where(inside, self._flat_manipulability[index], 0.)
+        coverage = np.where(inside, self._flat_coverage[index], 0.)
+        return reachable.reshape(shape), manipulability.reshape(shape), coverage.reshape(shape)
+
+    def project(self, points: np.ndarray) -> np.ndarray:
+        """
+        Move unreachable end link positions to the center of the nearest reachable voxel.
+
+        Args:
+            points: (..., 3) positions in the chain root frame.
+
+        Returns:
+            (..., 3) positions, reachable ones unchanged.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        flat_points = points.reshape(-1, 3)
+        index = self._flat_index(flat_points)
+        reachable = self._flat_reachable[index] & self._inside(flat_points)
+        ret = np.where(reachable[:, None], flat_points, self._centers[self._nearest[index]])
+        return ret.reshape(points.shape)
+
+    def save(self, path: str) -> None:
+        """Store the index as a compressed npz file."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # temporary file first so readers never see a partial index
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            meta=json.dumps({
+                'version': _FORMAT_VERSION,
+                'origin': self.origin.tolist(),
+                'voxel_size': self.voxel_size,
+                'min_manipulability': self.min_manipulability,
+                'approach_axis': self.approach_axis,
+                'key': self.key,
+            }),
+            counts=self.counts,
+            manipulability=self.manipulability,
+            coverage=self.coverage,
+        )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'ReachabilityIndex':
+        """Load an index stored with save."""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != _FORMAT_VERSION:
+                raise ValueError(f"Unsupported reachability index format in {path}: {meta}")
+            return ReachabilityIndex(
+                origin=np.array(meta['origin']),
+                voxel_size=meta['voxel_size'],
+                counts=data['counts'],
+                manipulability=data['manipulability'],
+                coverage=data['coverage'],
+                min_manipulability=meta['min_manipulability'],
+                approach_axis=meta['approach_axis'],
+                key=meta['key'],
+            )
+
+
+def build_reachability_index(
+        kinematics: Kinematics,
+        joint_limits: JointLimits,
+        voxel_size: float = DEFAULT_VOXEL_SIZE,
+        num_samples: int = DEFAULT_NUM_SAMPLES,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        min_manipulability: float = 0.,
+        approach_axis: int = 2,
+        seed: int = 0,
+        verbose: bool = False,
+        ) -> ReachabilityIndex:
+    """
+    Sample joint configurations uniformly within the joint limits and index the reached end link positions.
+
+    Args:
+        kinematics: The kinematics of the chain. Manipulability is computed from kinematics.jacobian,
+            so a mod_matrix restricts it to the controlled subspace.
+        joint_limits: Joint limits in degrees, as created by JointLimits.from_urdf
+            with the fixed joints in front of the chain skipped, see JointLimits.chain_limits.
+        voxel_size: Voxel edge length. In meters.
+        num_samples: Number of sampled configurations.
+        batch_size: Configurations evaluated per Jacobian call.
+        min_manipulability: Manipulability threshold of reachable voxels.
+        approach_axis: End link frame axis whose direction is binned, 2 for z.
+        seed: Random seed of the sampling.
+        verbose: Print progress.
+
+    Returns:
+        The reachability index.
+    """
+    lower, upper = joint_limits.chain_limits(kinematics.num_dof)
+    rng = np.random.default_rng(seed)
+    directions = direction_bins()
+
+    positions = np.empty((num_samples, 3))
+    manipulability = np.empty(num_samples, dtype=np.float32)
+    direction_bin = np.empty(num_samples, dtype=np.int64)
+    for start in range(0, num_samples, batch_size):
+        end = min(start + batch_size, num_samples)
+        js = rng.uniform(lower, upper, (end - start, kinematics.num_dof))
+        jac, pose = kinematics.jacobian(js, ret_eef_pose=True)
+        positions[start:end] = pose[:, :3, 3]
+        # Yoshikawa measure, product of the Jacobian singular values
+        manipulability[start:end] = np.linalg.svd(jac, compute_uv=False).prod(axis=1)
+        direction_bin[start:end] = np.argmax(pose[:, :3, approach_axis] @ directions.T, axis=1)
+        if verbose:
+            print(f"Sampled {end} / {num_samples} configurations")
+
+    origin = np.floor(positions.min(axis=0) / voxel_size) * voxel_size - voxel_size
+    shape = tuple(int(size) for size in np.floor((positions.max(axis=0) - origin) / voxel_size) + 2)
+    grid = np.floor((positions - origin) / voxel_size).astype(np.int64)
+    flat = np.ravel_multi_index(tuple(grid.T), shape)
+
+    size = int(np.prod(shape))
+    counts = np.bincount(flat, minlength=size).astype(np.uint32)
+    best = np.zeros(size, dtype=np.float32)
+    np.maximum.at(best, flat, manipulability)
+    coverage = np.zeros(size, dtype=np.uint32)
+    np.bitwise_or.at(coverage, flat, (np.uint32(1) << direction_bin.astype(np.uint32)))
+    if verbose:
+        print(f"Reachability grid {shape}, {int((counts > 0).sum())} reached voxels")
+
+    return ReachabilityIndex(
+        origin=origin,
+        voxel_size=voxel_size,
+        counts=counts.reshape(shape),
+        manipulability=best.reshape(shape),
+        coverage=coverage.reshape(shape),
+        min_manipulability=min_manipulability,
+        approach_axis=approach_axis,
+        key=build_key(kinematics, joint_limits, voxel_size, num_samples, min_manipulability, approach_axis, seed),
+    )
+
+
+def build_key(
+        kinematics: Kinematics,
+        joint_limits: JointLimits,
+        voxel_size: float = DEFAULT_VOXEL_SIZE,
+        num_samples: int = DEFAULT_NUM_SAMPLES,
+        min_manipulability: float = 0.,
+        approach_axis: int = 2,
+        seed: int = 0,
+        ) -> str:
+    """Hash of everything besides the URDF that changes the index built by build_reachability_index."""
+    lower, upper = joint_limits.chain_limits(kinematics.num_dof)
+    mod_matrix = kinematics.mod_matrix
+    params = {
+        'end_link_name': kinematics.end_link_name,
+        'lower': lower.tolist(),
+        'upper': upper.tolist(),
+        'mod_matrix': None if mod_matrix is None else np.asarray(mod_matrix, dtype=np.float64).tolist(),
+        'voxel_size': float(voxel_size),
+        'num_samples': int(num_samples),
+        'min_manipulability': float(min_manipulability),
+        'approach_axis': int(approach_axis),
+        'seed': int(seed),
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_index_path(
+        urdf_path: str,
+        kinematics: Kinematics,
+        joint_limits: JointLimits,
+        voxel_size: float = DEFAULT_VOXEL_SIZE,
+        num_samples: int = DEFAULT_NUM_SAMPLES,
+        min_manipulability: float = 0.,
+        ) -> str:
+    """
+    Path of the reachability index next to the URDF, keyed by the URDF hash and build_key,
+    so changed joint limits, mod_matrix or thresholds never reuse a stale index.
+    """
+    name = f"{os.path.basename(urdf_path)}.{file_hash(urdf_path)[:16]}"
+    key = build_key(kinematics, joint_limits, voxel_size, num_samples, min_manipulability)
+    return os.path.join(
+        get_cache_dir(urdf_path),
+        f"{name}.reach.v{_FORMAT_VERSION}.{kinematics.end_link_name.replace(' ', '_')}.{key}.npz",
+    )
+
+
+def load_or_build_reachability_index(
+        urdf_path: str,
+        kinematics: Kinematics,
+        joint_limits: JointLimits,
+        voxel_size: float = DEFAULT_VOXEL_SIZE,
+        num_samples: int = DEFAULT_NUM_SAMPLES,
+        min_manipulability: float = 0.,
+        verbose: bool = False,
+        ) -> ReachabilityIndex:
+    """
+    Load the index of the kinematics end link stored next to the URDF, build and store it if missing.
+
+    Args:
+        urdf_path: The path to the URDF file the kinematics was created from.
+        kinematics: The kinematics of the chain.
+        joint_limits: Joint limits in degrees, see build_reachability_index.
+        voxel_size: Voxel edge length. In meters.
+        num_samples: Number of sampled configurations.
+        min_manipulability: Manipulability threshold of reachable voxels.
+        verbose: Print build progress.
+
+    Returns:
+        The reachability index.
+    """
+    path = get_index_path(urdf_path, kinematics, joint_limits, voxel_size, num_samples, min_manipulability)
+    if os.path.exists(path):
+        index = ReachabilityIndex.load(path)
+        # guards against copied or renamed index files
+        if index.key == build_key(kinematics, joint_limits, voxel_size, num_samples, min_manipulability):
+            return index
+        print(f"Warning: reachability index {path} was built with other parameters, rebuilding")
+
+    index = build_reachability_index(
+        kinematics=kinematics,
+        joint_limits=joint_limits,
+        voxel_size=voxel_size,
+        num_samples=num_samples,
+        min_manipulability=min_manipulability,
+        verbose=verbose,
+    )
+    index.save(path)
+    return index
@@ -0,0 +1,253 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from armliby.tracing import now_ns
+from armliby.vrteleop.controller_buffer import ControllerDataView, ControllerRingBuffer
+from armliby.vrteleop.controller_data import ControllerData
+from armliby.vrteleop.protocol import FRAME_FLOATS, pack_controller_frame
+
+
+# bump when the recording layout changes
+_FORMAT_VERSION = 1
+_META_FILE = 'meta.json'
+_CHUNK_PATTERN = 'chunk_{:06d}.npz'
+
+
+class SessionRecorder:
+    def __init__(
+            self,
+            path: str,
+            num_joints: int,
+            chunk_size: int = 1000,
+            max_pending_chunks: int = 16,
+            ) -> None:
+        """
+        Append-only recorder of teleop sessions.
+
+        Every record call stores a timestamp, the controller frame in the packed binary
+        protocol layout (poses, buttons and axes, FRAME_FLOATS float32) and the joint command.
+        Rows are collected into fixed size column chunks in memory, full chunks are written
+        as separate npz files by a background thread, so the control loop never waits for the disk.
+        If writing fails, the writer keeps draining its queue and the error is raised
+        by the next record or close call.
+
+        Args:
+            path: Recording directory, created if missing. Must not hold another recording.
+            num_joints: Length of the recorded joint commands.
+            chunk_size: Number of rows per chunk file.
+            max_pending_chunks: Chunks waiting for the writer before new chunks are dropped.
+        """
+        if os.path.exists(os.path.join(path, _META_FILE)):
+            raise ValueError(f"Recording already exists: {path}")
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, _META_FILE), 'w') as f:
+            json.dump({
+                'version': _FORMAT_VERSION,
+                'num_joints': num_joints,
+                'frame_floats': FRAME_FLOATS,
+                'chunk_size': chunk_size,
+            }, f)
+
+        self.path = path
+        self.num_joints = num_joints
+        self.chunk_size = chunk_size
+        # chunks the writer could not keep up with
+        self.num_dropped_chunks = 0
+
+        self._num_chunks = 0
+        self._row = 0
+        self._new_chunk()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending_chunks)
+        # set by close, the writer exits once the queue is empty
+        self._closing = threading.Event()
+        # first exception of the writer thread
+        self._error: Optional[BaseException] = None
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+        self._closed = False
+
+    def _new_chunk(self) -> None:
+        self._timestamps = np.zeros(self.chunk_size, dtype=np.int64)
+        self._frames = np.zeros((self.chunk_size, FRAME_FLOATS), dtype=np.float32)
+        self._joint_commands = np.full((self.chunk_size, self.num_joints), np.nan, dtype=np.float64)
+        self._row = 0
+
+    def _write_chunks(self) -> None:
+        while True:
+            try:
+                index, columns = self._queue.get(timeout=0.05)
+            except queue.Empty:
+                if self._closing.is_set():
+                    return
+                continue
+            if self._error is not None:
+                # keep draining so the recorder never blocks, the error is raised by record or close
+                continue
+            chunk_path = os.path.join(self.path, _CHUNK_PATTERN.format(index))
+            # readers only see complete chunks
+            tmp_path = chunk_path + '.tmp.npz'
+            try:
+                np.savez(tmp_path, **columns)
+                os.replace(tmp_path, chunk_path)
+            except Exception as e:
+                self._error = e
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _raise_writer_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(
+                f"Recording writer failed, chunks are no longer written: {self._error}") from self._error
+
+    def _flush(self) -> None:
+        if self._row == 0:
+            return
+        columns = {
+            'timestamp_ns': self._timestamps[:self._row],
+            'frames': self._frames[:self._row],
+            'joint_commands': self._joint_commands[:self._row],
+        }
+        try:
+            self._queue.put_nowait((self._num_chunks, columns))
+        except queue.Full:
+            self.num_dropped_chunks += 1
+            print(f"Warning: recording writer is behind, dropped chunk {self._num_chunks}")
+        self._num_chunks += 1
+        self._new_chunk()
+
+    def record(
+            self,
+            controller_data: ControllerData,
+            joint_command: Optional[np.ndarray] = None,
+            timestamp_ns: Optional[int] = None,
+            ) -> None:
+        """
+        Append one row.
+
+        Args:
+            controller_data: The controller sample.
+            joint_command: The joint command computed from the sample, nan if None.
+            timestamp_ns: now_ns timestamp. Defaults to the sample receive time if known, else now.
+        """
+        if self._closed:
+            raise RuntimeError("Recorder is closed.")
+        self._raise_writer_error()
+        if timestamp_ns is None:
+            timestamp_ns = controller_data.timestamp_ns or now_ns()
+        self._timestamps[self._row] = timestamp_ns
+        pack_controller_frame(controller_data, self._frames[self._row])
+        if joint_command is not None:
+            self._joint_commands[self._row] = joint_command
+        self._row += 1
+        if self._row == self.chunk_size:
+            self._flush()
+
+    def close(self) -> None:
+        """Write the rest of the rows and wait for the writer. Raises the writer error if writing failed."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._error is None:
+            self._flush()
+        self._closing.set()
+        self._writer.join()
+        self._raise_writer_error()
+
+    def __enter__(self) -> 'SessionRecorder':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class SessionLog:
+    def __init__(self, path: str) -> None:
+        """
+        Read access to a recording made by SessionRecorder.
+
+        Args:
+            path: The recording directory.
+        """
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        if meta['version'] != _FORMAT_VERSION or meta['frame_floats'] != FRAME_FLOATS:
+            raise ValueError(f"Unsupported recording format in {path}: {meta}")
+        self.path = path
+        self.num_joints: int = meta['num_joints']
+        self.chunk_paths: List[str] = sorted(glob.glob(os.path.join(path, 'chunk_*[0-9].npz')))
+
+    def iter_chunks(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Iterate over the recording chunk by chunk, keeping one chunk in memory.
+
+        Yields:
+            (T,) int64 timestamps, (T, FRAME_FLOATS) float32 controller frames
+            and (T, num_joints) joint commands.
+        """
+        for chunk_path in self.chunk_paths:
+            with np.load(chunk_path) as data:
+                yield data['timestamp_ns'], data['frames'], data['joint_commands']
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Load the whole recording, same arrays as iter_chunks concatenated."""
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return (
+                np.zeros(0, dtype=np.int64),
+                np.zeros((0, FRAME_FLOATS), dtype=np.float32),
+                np.zeros((0, self.num_joints)),
+            )
+        return tuple(np.concatenate(column) for column in zip(*chunks))
+
+    def __len__(self) -> int:
+        return sum(len(timestamps) for timestamps, _, _ in self.iter_chunks())
+
+
+def replay(
+        path: str,
+        callback: Callable[[ControllerDataView], object],
+        realtime: bool = False,
+        speed: float = 1.,
+        history_size: int = 256,
+        ) -> Tuple[int, float]:
+    """
+    Feed recorded controller samples through a teleop callback.
+
+    Args:
+        path: The recording directory.
+        callback: Called with every recorded sample, its timestamp_ns is the recorded one.
+            Samples are views into a ring buffer as VRWebsocketServer.samples.
+        realtime: Keep the recorded timing between samples. Otherwise run as fast as possible.
+        speed: Playback speed factor in realtime mode.
+        history_size: Number of recent samples kept in the ring buffer.
+
+    Returns:
+        The number of replayed samples and the total time spent in the callback, seconds.
+    """
+    log = SessionLog(path)
+    samples = ControllerRingBuffer(history_size)
+    num_samples = 0
+    callback_time = 0.
+    start_time = None
+    first_timestamp = 0
+    for timestamps, frames, _ in log.iter_chunks():
+        for timestamp_ns, frame in zip(timestamps.tolist(), frames):
+            if realtime:
+                if start_time is None:
+                    start_time = time.perf_counter()
+                    first_timestamp = timestamp_ns
+                delay = start_time + (timestamp_ns - first_timestamp) / 1e9 / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            controller_data = samples.push_frame(frame, timestamp_ns)
+            call_start = time.perf_counter()
+            callback(controller_data)
+            callback_time += time.perf_counter() - call_start
+            num_samples += 1
+    return num_samples, callback_time
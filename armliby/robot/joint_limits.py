@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 from armliby.urdf_parser import URDFParser
@@ -28,6 +28,29 @@ class JointLimits:
             self.upper,
         )
 
+    def chain_limits(self, num_dof: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the limits of the first num_dof joints in radians, for a kinematic chain.
+
+        The limits must be created without the fixed joints in front of the chain,
+        e.g. with skip_joints=[0] for the bundled URDF, otherwise they are shifted by one joint.
+
+        Args:
+            num_dof: Number of chain joints.
+
+        Returns:
+            Lower and upper limits, shape (num_dof,) each. In radians.
+        """
+        lower = np.asarray(self.lower, dtype=np.float64)[:num_dof]
+        upper = np.asarray(self.upper, dtype=np.float64)[:num_dof]
+        if len(lower) < num_dof or len(upper) < num_dof:
+            raise ValueError(f"Expected limits of at least {num_dof} joints, got {len(lower)}")
+        if np.isnan(lower).any() or np.isnan(upper).any():
+            raise ValueError(
+                f"Joint limits of the chain are undefined, {self.lower}, {self.upper}. "
+                "Skip fixed joints when creating them, e.g. JointLimits.from_urdf(urdf_path, skip_joints=[0])")
+        return np.deg2rad(lower), np.deg2rad(upper)
+
     @staticmethod
     def from_urdf(
             urdf_path: str,
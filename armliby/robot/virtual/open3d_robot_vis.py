@@ -3,9 +3,20 @@ from typing import List, Optional
 import numpy as np
 import open3d as o3d
 from armliby.ik import Kinematics
+from armliby.mesh_cache import MeshCache
 from armliby.urdf_parser import URDFParser
 
 
+# Legacy Visualizer, mesh vertices are recomputed from link-local copies every frame
+RENDERER_LEGACY = 'legacy'
+# O3DVisualizer window, link poses are set as scene transforms
+RENDERER_SCENE = 'scene'
+# Headless OffscreenRenderer, link poses are set as scene transforms
+RENDERER_OFFSCREEN = 'offscreen'
+
+_END_LINK_FRAME_NAME = '__end_link_frame__'
+
+
 class Open3dRobotVis:
     def __init__(
             self, 
@@ -14,6 +25,10 @@ class Open3dRobotVis:
             end_link_name: str,
             skip_links: Optional[List[int]] = None,
             skip_joints: Optional[List[int]] = None,
+            renderer: str = RENDERER_LEGACY,
+            width: int = 1280,
+            height: int = 720,
+            mesh_lod: int = 0,
             ):
         """
         Initialize the Open3D robot visualization.
@@ -24,7 +39,15 @@ class Open3dRobotVis:
             end_link_name: Name of the end effector link to attach the coordinate frame.
             skip_links: Optional list of link indices to skip during visualization.
             skip_joints: Optional list of joint indices to skip during visualization.
+            renderer: 'legacy' updates mesh vertices of the classic Visualizer,
+                'scene' uses O3DVisualizer and 'offscreen' a headless OffscreenRenderer.
+                Scene and offscreen renderers only set per-link transforms, so updates cost O(links).
+            width: Window or image width.
+            height: Window or image height.
+            mesh_lod: Level of detail of the link meshes, 0 is the full mesh, see MeshCache.
         """
+        if renderer not in (RENDERER_LEGACY, RENDERER_SCENE, RENDERER_OFFSCREEN):
+            raise ValueError(f"Unknown renderer: {renderer}")
         self.urdf_path = urdf_path
         self.parser = URDFParser(
             urdf_path=urdf_path,
@@ -35,43 +58,96 @@ class Open3dRobotVis:
         self.kinematics = kinematics
         self.end_link_name = end_link_name
         self.end_link_frame = None
-        self.end_link_frame_tr = np.eye(4)
-        self.visualizer = o3d.visualization.Visualizer()
+        self.renderer = renderer
+        self.width = width
+        self.height = height
+        self.mesh_lod = mesh_lod
+        self.mesh_cache = MeshCache(urdf_path)
+        self.visualizer = None
         self.geometries = {}
-        self.current_transformations = {}
         self.inited = False
 
+        # legacy renderer: link-local vertices and normals, never modified
+        self._ref_vertices = {}
+        self._ref_normals = {}
+
+        # scene and offscreen renderers: Open3DScene holding the geometries
+        self._scene = None
+
     def run(self) -> None:
         """Initialize the Open3D visualizer and load geometries."""
         if self.inited:
             print("Visualizer is already initialized.")
             return
 
-        self.visualizer.create_window()
-
         for link_name, stl_path in self.link_stl_map.items():
             try:
-                mesh = o3d.io.read_triangle_mesh(stl_path)
+                # indexed mesh from the preprocessed cache, no STL parsing after the first run
+                vertices, faces = self.mesh_cache.load_indexed(stl_path, self.mesh_lod)
+                mesh = o3d.geometry.TriangleMesh(
+                    o3d.utility.Vector3dVector(vertices),
+                    o3d.utility.Vector3iVector(faces),
+                )
                 if mesh.is_empty():
                     print(f"Warning: STL file {stl_path} is empty.")
                     continue
                 mesh.compute_vertex_normals()
-                self.visualizer.add_geometry(mesh)
                 self.geometries[link_name] = mesh
-                self.current_transformations[link_name] = np.eye(4)
 
             except Exception as e:
                 print(f"Error loading STL {stl_path}: {e}")
 
+        # Create a coordinate frame for the end link
+        self.end_link_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.1)
+
+        if self.renderer == RENDERER_LEGACY:
+            self._run_legacy()
+        else:
+            self._run_scene()
+
+        self.inited = True
+
+    def _run_legacy(self) -> None:
+        self.visualizer = o3d.visualization.Visualizer()
+        self.visualizer.create_window(width=self.width, height=self.height)
+
+        for link_name, mesh in self.geometries.items():
+            self._ref_vertices[link_name] = np.asarray(mesh.vertices).copy()
+            self._ref_normals[link_name] = np.asarray(mesh.vertex_normals).copy()
+            self.visualizer.add_geometry(mesh)
+
         # Create a coordinate frame for the link
         frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.2)
         self.visualizer.add_geometry(frame)
 
-        # Create a coordinate frame for the end link
-        self.end_link_frame = o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.1)
+        self._ref_vertices[_END_LINK_FRAME_NAME] = np.asarray(self.end_link_frame.vertices).copy()
+        self._ref_normals[_END_LINK_FRAME_NAME] = np.asarray(self.end_link_frame.vertex_normals).copy()
         self.visualizer.add_geometry(self.end_link_frame)
 
-        self.inited = True
+    def _run_scene(self) -> None:
+        material = o3d.visualization.rendering.MaterialRecord()
+        material.shader = "defaultLit"
+
+        if self.renderer == RENDERER_SCENE:
+            app = o3d.visualization.gui.Application.instance
+            app.initialize()
+            self.visualizer = o3d.visualization.O3DVisualizer("Robot", self.width, self.height)
+            app.add_window(self.visualizer)
+        else:
+            self.visualizer = o3d.visualization.rendering.OffscreenRenderer(self.width, self.height)
+        self._scene = self.visualizer.scene
+
+        for link_name, mesh in self.geometries.items():
+            self._scene.add_geometry(link_name, mesh, material)
+        self._scene.add_geometry(
+            "frame", o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.2), material)
+        self._scene.add_geometry(_END_LINK_FRAME_NAME, self.end_link_frame, material)
+
+        bounds = self._scene.bounding_box
+        if self.renderer == RENDERER_SCENE:
+            self.visualizer.reset_camera_to_default()
+        else:
+            self.visualizer.setup_camera(60.0, bounds, bounds.get_center())
 
     def close(self) -> None:
         """Close the Open3D visualizer."""
@@ -79,11 +155,25 @@ class Open3dRobotVis:
             print("Visualizer is not initialized.")
             return
 
-        self.visualizer.destroy_window()
+        if self.renderer == RENDERER_LEGACY:
+            self.visualizer.destroy_window()
+        elif self.renderer == RENDERER_SCENE:
+            self.visualizer.close()
+            o3d.visualization.gui.Application.instance.run_one_tick()
+        self.visualizer = None
+        self._scene = None
         self.geometries.clear()
-        self.current_transformations.clear()
+        self._ref_vertices.clear()
+        self._ref_normals.clear()
         self.inited = False
 
+    def _set_legacy_pose(self, name: str, mesh: o3d.geometry.TriangleMesh, transform: np.ndarray) -> None:
+        # absolute pose from link-local data, no accumulated drift
+        rot = transform[:3, :3]
+        np.asarray(mesh.vertices)[:] = self._ref_vertices[name] @ rot.T + transform[:3, 3]
+        np.asarray(mesh.vertex_normals)[:] = self._ref_normals[name] @ rot.T
+        self.visualizer.update_geometry(mesh)
+
     def visualize(self, jpos: np.ndarray) -> None:
         """Move the robot to the specified target position."""
         if not self.inited:
@@ -95,23 +185,32 @@ class Open3dRobotVis:
         # Update visualization
         for link_name, mesh in self.geometries.items():
             if link_name in fk_results:
-                transform = fk_results[link_name]
-
-                # Undo the current transformation
-                current_transform = self.current_transformations[link_name]
-
-                # Apply the new transformation
-                mesh.transform(transform @ np.linalg.inv(current_transform))
+                transform = np.asarray(fk_results[link_name], dtype=np.float64)
+                if self.renderer == RENDERER_LEGACY:
+                    self._set_legacy_pose(link_name, mesh, transform)
+                else:
+                    self._scene.set_geometry_transform(link_name, transform)
 
-                # Store the new transformation
-                self.current_transformations[link_name] = transform
                 if link_name == self.end_link_name:
-                    self.end_link_frame.transform(transform @ np.linalg.inv(self.end_link_frame_tr))
-                    self.end_link_frame_tr = transform
-                    self.visualizer.update_geometry(self.end_link_frame)
-
-                # Update the geometry in the visualizer
-                self.visualizer.update_geometry(mesh)
+                    if self.renderer == RENDERER_LEGACY:
+                        self._set_legacy_pose(_END_LINK_FRAME_NAME, self.end_link_frame, transform)
+                    else:
+                        self._scene.set_geometry_transform(_END_LINK_FRAME_NAME, transform)
+
+        if self.renderer == RENDERER_LEGACY:
+            self.visualizer.poll_events()
+            self.visualizer.update_renderer()
+        elif self.renderer == RENDERER_SCENE:
+            self.visualizer.post_redraw()
+            o3d.visualization.gui.Application.instance.run_one_tick()
+
+    def render_image(self) -> np.ndarray:
+        """
+        Render the current robot pose. Offscreen renderer only.
 
-        self.visualizer.poll_events()
-        self.visualizer.update_renderer()
+        Returns:
+            (height, width, 3) uint8 image.
+        """
+        if not self.inited or self.renderer != RENDERER_OFFSCREEN:
+            raise RuntimeError("render_image requires an initialized offscreen renderer.")
+        return np.asarray(self.visualizer.render_to_image())
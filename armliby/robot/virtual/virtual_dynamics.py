@@ -0,0 +1,140 @@
+from collections import deque
+from typing import Optional, Union
+
+import numpy as np
+
+
+MODE_POSITION = 0
+MODE_VELOCITY = 1
+
+
+class VirtualJointDynamics:
+    def __init__(
+            self,
+            start_pos: np.ndarray,
+            dt: float = 0.001,
+            max_velocity: Optional[Union[float, np.ndarray]] = None,
+            max_acceleration: Optional[Union[float, np.ndarray]] = None,
+            time_constant: float = 0.,
+            latency: float = 0.,
+            lower: Optional[np.ndarray] = None,
+            upper: Optional[np.ndarray] = None,
+            ) -> None:
+        """
+        Time-stepped joint dynamics of a batch of virtual robots.
+
+        All robots share the parameters and are integrated together with a fixed step:
+        commands take effect after the latency, the commanded velocity goes through
+        a first-order motor lag and is limited by the velocity and acceleration limits.
+        Position commands are tracked so that the joint can still stop at the target
+        with the acceleration limit.
+
+        Args:
+            start_pos: (num_robots, num_joints) or (num_joints,) initial joint positions.
+            dt: Integration step. In seconds.
+            max_velocity: Velocity limit, scalar or per joint. None for no limit.
+            max_acceleration: Acceleration limit, scalar or per joint. None for no limit.
+            time_constant: First-order motor lag time constant. In seconds. 0 for none.
+            latency: Delay between a command and its effect. In seconds.
+            lower: Optional per joint lower position limits.
+            upper: Optional per joint upper position limits.
+        """
+        self.pos = np.array(np.atleast_2d(start_pos), dtype=np.float64)
+        self.vel = np.zeros_like(self.pos)
+        self.dt = dt
+        self.max_velocity = np.inf if max_velocity is None else np.asarray(max_velocity, dtype=np.float64)
+        self.max_acceleration = np.inf if max_acceleration is None else np.asarray(max_acceleration, dtype=np.float64)
+        self.time_constant = time_constant
+        self.latency = latency
+        self.lower = -np.inf if lower is None else np.asarray(lower, dtype=np.float64)
+        self.upper = np.inf if upper is None else np.asarray(upper, dtype=np.float64)
+        self.time = 0.
+
+        # active commands, every robot holds its position until commanded
+        self._mode = np.full(len(self.pos), MODE_POSITION)
+        self._target = self.pos.copy()
+        # (apply time, robot mask, mode, values) waiting for the latency to pass
+        self._pending = deque()
+
+    @property
+    def num_robots(self) -> int:
+        return self.pos.shape[0]
+
+    @property
+    def num_joints(self) -> int:
+        return self.pos.shape[1]
+
+    def _command(self, mode: int, values: np.ndarray, robots: Optional[np.ndarray]) -> None:
+        mask = np.ones(self.num_robots, dtype=bool) if robots is None else np.zeros(self.num_robots, dtype=bool)
+        if robots is not None:
+            mask[robots] = True
+        values = np.broadcast_to(values, (int(mask.sum()), self.num_joints)).astype(np.float64)
+        if self.latency > 0:
+            self._pending.append((self.time + self.latency, mask, mode, values))
+        else:
+            self._apply(mask, mode, values)
+
+    def _apply(self, mask: np.ndarray, mode: int, values: np.ndarray) -> None:
+        self._mode[mask] = mode
+        self._target[mask] = values
+
+    def command_position(self, target_pos: np.ndarray, robots: Optional[np.ndarray] = None) -> None:
+        """
+        Command target positions.
+
+        Args:
+            target_pos: (num_commanded, num_joints) or (num_joints,) target positions.
+            robots: Indices or boolean mask of the commanded robots. All robots if None.
+        """
+        self._command(MODE_POSITION, target_pos, robots)
+
+    def command_velocity(self, velocity: np.ndarray, robots: Optional[np.ndarray] = None) -> None:
+        """
+        Command joint velocities.
+
+        Args:
+            velocity: (num_commanded, num_joints) or (num_joints,) velocities.
+            robots: Indices or boolean mask of the commanded robots. All robots if None.
+        """
+        self._command(MODE_VELOCITY, velocity, robots)
+
+    def step(self, num_steps: int = 1) -> None:
+        """Integrate num_steps steps of dt."""
+        dt = self.dt
+        position_mode = (self._mode == MODE_POSITION)[:, None]
+        lag = dt / (self.time_constant + dt)
+        for _ in range(num_steps):
+            self.time += dt
+            if self._pending and self._pending[0][0] <= self.time + 1e-12:
+                while self._pending and self._pending[0][0] <= self.time + 1e-12:
+                    self._apply(*self._pending.popleft()[1:])
+                position_mode = (self._mode == MODE_POSITION)[:, None]
+
+            # position mode: reach the target in one step, but slow enough to stop there
+            error = self._target - self.pos
+            with np.errstate(invalid='ignore'):
+                # nan without an acceleration limit at zero error, fmin skips it
+                stop_speed = np.sqrt(2. * self.max_acceleration * np.abs(error))
+            desired = np.where(
+                position_mode,
+                np.sign(error) * np.fmin(np.abs(error) / dt, stop_speed),
+                self._target,
+            )
+            desired = np.clip(desired, -self.max_velocity, self.max_velocity)
+
+            if self.time_constant > 0:
+                desired = self.vel + (desired - self.vel) * lag
+            max_dv = self.max_acceleration * dt
+            self.vel += np.clip(desired - self.vel, -max_dv, max_dv)
+
+            self.pos += self.vel * dt
+            clipped = (self.pos < self.lower) | (self.pos > self.upper)
+            if clipped.any():
+                np.clip(self.pos, self.lower, self.upper, out=self.pos)
+                self.vel[clipped] = 0.
+
+    def advance_to(self, time: float) -> None:
+        """Integrate whole steps up to the simulation time, e.g. to follow the wall clock."""
+        num_steps = int((time - self.time) / self.dt + 1e-9)
+        if num_steps > 0:
+            self.step(num_steps)
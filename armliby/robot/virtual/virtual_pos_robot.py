@@ -1,7 +1,9 @@
-from typing import Optional
+import time
+from typing import Optional, Union
 
 import numpy as np
 from armliby.robot.joint_limits import JointLimits
+from armliby.robot.virtual.virtual_dynamics import VirtualJointDynamics
 
 from ..robot import JointRobot, MotorData
 
@@ -11,18 +13,56 @@ class VirtualPosRobot(JointRobot):
             self,
             start_joints: np.ndarray,
             joint_limits: Optional[JointLimits] = None,
+            max_velocity: Optional[Union[float, np.ndarray]] = None,
+            max_acceleration: Optional[Union[float, np.ndarray]] = None,
+            time_constant: float = 0.,
+            latency: float = 0.,
+            dt: float = 0.001,
+            realtime: bool = True,
             ):
         """
         Initialize the virtual robot.
 
+        Without dynamics parameters position commands are applied instantly.
+        With any of max_velocity, max_acceleration, time_constant or latency
+        the robot is simulated by VirtualJointDynamics with step dt.
+
         Args:
             start_joints: The initial joint positions of the robot.
-            joint_limits: Optional joint limits for the robot.
+            joint_limits: Optional joint limits in degrees, as created by JointLimits.from_urdf,
+                see JointLimits.chain_limits. Position commands and the simulated
+                joint positions are kept within them.
+            max_velocity: Joint velocity limit, scalar or per joint. In rad/s.
+            max_acceleration: Joint acceleration limit, scalar or per joint. In rad/s^2.
+            time_constant: First-order motor lag time constant. In seconds.
+            latency: Delay between a command and its effect. In seconds.
+            dt: Simulation step. In seconds.
+            realtime: Simulation follows the wall clock since connect. Otherwise
+                it only advances with step, so it can run faster than real time.
         """
         self._joint_count = len(start_joints)
         self._current_jpos = start_joints
         self._joint_limits = joint_limits
+        # joint positions are in radians
+        self._lower = self._upper = None
+        if joint_limits is not None:
+            self._lower, self._upper = joint_limits.chain_limits(self._joint_count)
         self._connected = False
+        self._realtime = realtime
+        self._start_time = 0.
+
+        self._dynamics: Optional[VirtualJointDynamics] = None
+        if max_velocity is not None or max_acceleration is not None or time_constant > 0 or latency > 0:
+            self._dynamics = VirtualJointDynamics(
+                start_pos=start_joints,
+                dt=dt,
+                max_velocity=max_velocity,
+                max_acceleration=max_acceleration,
+                time_constant=time_constant,
+                latency=latency,
+                lower=self._lower,
+                upper=self._upper,
+            )
 
     @property
     def num_joints(self) -> int:
@@ -33,6 +73,8 @@ class VirtualPosRobot(JointRobot):
             print("Robot is already connected.")
             return
         self._connected = True
+        if self._dynamics is not None:
+            self._start_time = time.perf_counter() - self._dynamics.time
 
     def disconnect(self) -> None:
         if not self._connected:
@@ -44,9 +86,27 @@ class VirtualPosRobot(JointRobot):
         """Set the robot to a relaxed state."""
         ...
 
+    def _sync(self) -> None:
+        if self._dynamics is not None and self._realtime and self._connected:
+            self._dynamics.advance_to(time.perf_counter() - self._start_time)
+
+    def step(self, duration: float) -> None:
+        """
+        Advance the simulation by duration seconds. Only with dynamics and realtime=False.
+
+        Args:
+            duration: Simulated time. In seconds.
+        """
+        if self._dynamics is None or self._realtime:
+            raise RuntimeError("step requires dynamics parameters and realtime=False.")
+        self._dynamics.advance_to(self._dynamics.time + duration)
+
     def read(self) -> MotorData:
         """Read the current state of the robot."""
-        return MotorData(pos=self._current_jpos.copy(), vel=np.zeros(self._joint_count))
+        if self._dynamics is None:
+            return MotorData(pos=self._current_jpos.copy(), vel=np.zeros(self._joint_count))
+        self._sync()
+        return MotorData(pos=self._dynamics.pos[0].copy(), vel=self._dynamics.vel[0].copy())
 
     def position_abs_control(
             self, 
@@ -58,13 +118,30 @@ class VirtualPosRobot(JointRobot):
             raise RuntimeError("VirtualRobot is not connected.")
 
         if self._joint_limits is not None:
-            target_pos = self._joint_limits.process(target_pos)
+            target_pos = np.clip(target_pos, self._lower, self._upper)
+
+        if self._dynamics is None:
+            self._current_jpos = target_pos
+            return
+        self._sync()
+        self._dynamics.command_position(target_pos)
 
-        self._current_jpos = target_pos
-    
     def velocity_control(
             self, 
             velocity: np.ndarray,
             torque_limit: Optional[np.ndarray] = None,
             ) -> np.ndarray:
-        raise NotImplementedError("Velocity control is not supported for VirtualPosRobot.")
+        """
+        Command joint velocities. Requires dynamics parameters.
+
+        Returns:
+            The current joint velocities.
+        """
+        if not self._connected:
+            raise RuntimeError("VirtualRobot is not connected.")
+        if self._dynamics is None:
+            raise NotImplementedError(
+                "Velocity control needs dynamics, set max_velocity, max_acceleration, time_constant or latency.")
+        self._sync()
+        self._dynamics.command_velocity(velocity)
+        return self._dynamics.vel[0].copy()
@@ -0,0 +1,292 @@
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from armliby.serial_chain import JOINT_FIXED, JOINT_PRISMATIC, JOINT_REVOLUTE, SerialChain
+
+
+CACHE_DIR_NAME = '.armliby_cache'
+
+# bump when the cached arrays change
+_CACHE_VERSION = 1
+
+_JOINT_TYPE_MAP = {
+    'fixed': JOINT_FIXED,
+    'revolute': JOINT_REVOLUTE,
+    'continuous': JOINT_REVOLUTE,
+    'prismatic': JOINT_PRISMATIC,
+}
+
+# parsed models of this process by (path, mtime, size)
+_loaded_models: Dict[Tuple[str, int, int], 'RobotModel'] = {}
+
+
+def get_cache_dir(urdf_path: str) -> str:
+    """Directory next to the URDF file where parsed and preprocessed robot data is cached."""
+    return os.path.join(os.path.dirname(os.path.realpath(urdf_path)), CACHE_DIR_NAME)
+
+
+def file_hash(path: str) -> str:
+    """Return the sha256 hex digest of a file."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class RobotModel:
+    def __init__(
+            self,
+            urdf_path: str,
+            link_names: List[str],
+            link_meshes: List[str],
+            joint_names: List[str],
+            joint_types: List[str],
+            joint_parents: List[str],
+            joint_children: List[str],
+            joint_origins: np.ndarray,
+            joint_axes: np.ndarray,
+            joint_lower: np.ndarray,
+            joint_upper: np.ndarray,
+            ) -> None:
+        """
+        Robot description parsed once from a URDF file.
+
+        Args:
+            urdf_path: The path to the URDF file.
+            link_names: Link names in URDF order.
+            link_meshes: Visual mesh file name of each link as written in the URDF,
+                empty string for links without a mesh.
+            joint_names: Joint names in URDF order.
+            joint_types: URDF joint types.
+            joint_parents: Parent link name of each joint.
+            joint_children: Child link name of each joint.
+            joint_origins: (num_joints, 4, 4) joint origin transforms.
+            joint_axes: (num_joints, 3) joint axes.
+            joint_lower: (num_joints,) lower position limits, nan if not set.
+            joint_upper: (num_joints,) upper position limits, nan if not set.
+        """
+        self.urdf_path = urdf_path
+        self.link_names = link_names
+        self.link_meshes = link_meshes
+        self.joint_names = joint_names
+        self.joint_types = joint_types
+        self.joint_parents = joint_parents
+        self.joint_children = joint_children
+        self.joint_origins = joint_origins
+        self.joint_axes = joint_axes
+        self.joint_lower = joint_lower
+        self.joint_upper = joint_upper
+
+        self._link_index = {name: ind for ind, name in enumerate(link_names)}
+        self._joint_index = {name: ind for ind, name in enumerate(joint_names)}
+        self._chains: Dict[Tuple[str, Optional[str]], SerialChain] = {}
+
+    @staticmethod
+    def load(urdf_path: str, use_cache: bool = True) -> 'RobotModel':
+        """
+        Load the robot model, parsing the URDF at most once per process.
+
+        Parsed data is also cached on disk next to the URDF, keyed by the file hash,
+        so later processes skip URDF parsing.
+
+        Args:
+            urdf_path: The path to the URDF file.
+            use_cache: Read and write the on-disk cache.
+
+        Returns:
+            The robot model.
+        """
+        stat = os.stat(urdf_path)
+        key = (os.path.realpath(urdf_path), stat.st_mtime_ns, stat.st_size)
+        if key in _loaded_models:
+            return _loaded_models[key]
+
+        model = None
+        cache_path = None
+        if use_cache:
+            cache_path = os.path.join(
+                get_cache_dir(urdf_path),
+                f"{os.path.basename(urdf_path)}.{file_hash(urdf_path)[:16]}.model.npz",
+            )
+            if os.path.exists(cache_path):
+                model = RobotModel._load_cache(urdf_path, cache_path)
+
+        if model is None:
+            model = RobotModel.from_urdf(urdf_path)
+            if cache_path is not None:
+                model._save_cache(cache_path)
+
+        _loaded_models[key] = model
+        return model
+
+    @staticmethod
+    def from_urdf(urdf_path: str) -> 'RobotModel':
+        """
+        Parse the URDF file without any caching.
+
+        Args:
+            urdf_path: The path to the URDF file.
+
+        Returns:
+            The robot model.
+        """
+        # yourdfpy pulls in trimesh, only import it when parsing is needed
+        from yourdfpy import URDF
+
+        robot = URDF.load(urdf_path, build_scene_graph=False, load_meshes=False).robot
+
+        link_meshes = []
+        for link in robot.links:
+            mesh = link.visuals[0].geometry.mesh if len(link.visuals) > 0 else None
+            link_meshes.append('' if mesh is None else mesh.filename)
+
+        joints = robot.joints
+        return RobotModel(
+            urdf_path=urdf_path,
+            link_names=[link.name for link in robot.links],
+            link_meshes=link_meshes,
+            joint_names=[joint.name for joint in joints],
+            joint_types=[joint.type for joint in joints],
+            joint_parents=[joint.parent for joint in joints],
+            joint_children=[joint.child for joint in joints],
+            joint_origins=np.array(
+                [np.eye(4) if joint.origin is None else joint.origin for joint in joints],
+                dtype=np.float64,
+            ).reshape(-1, 4, 4),
+            joint_axes=np.array(
+                [[1., 0., 0.] if joint.axis is None else joint.axis for joint in joints],
+                dtype=np.float64,
+            ).reshape(-1, 3),
+            joint_lower=np.array(
+                [np.nan if joint.limit is None or joint.limit.lower is None else joint.limit.lower
+                 for joint in joints],
+                dtype=np.float64,
+            ),
+            joint_upper=np.array(
+                [np.nan if joint.limit is None or joint.limit.upper is None else joint.limit.upper
+                 for joint in joints],
+                dtype=np.float64,
+            ),
+        )
+
+    @staticmethod
+    def _load_cache(urdf_path: str, cache_path: str) -> Optional['RobotModel']:
+        try:
+            with np.load(cache_path) as data:
+                if int(data['version']) != _CACHE_VERSION:
+                    return None
+                return RobotModel(
+                    urdf_path=urdf_path,
+                    link_names=data['link_names'].tolist(),
+                    link_meshes=data['link_meshes'].tolist(),
+                    joint_names=data['joint_names'].tolist(),
+                    joint_types=data['joint_types'].tolist(),
+                    joint_parents=data['joint_parents'].tolist(),
+                    joint_children=data['joint_children'].tolist(),
+                    joint_origins=data['joint_origins'],
+                    joint_axes=data['joint_axes'],
+                    joint_lower=data['joint_lower'],
+                    joint_upper=data['joint_upper'],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: ignoring robot model cache {cache_path}: {e}")
+            return None
+
+    def _save_cache(self, cache_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # write to a temporary file first so readers never see a partial cache
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp_path,
+                version=_CACHE_VERSION,
+                link_names=np.array(self.link_names, dtype=str),
+                link_meshes=np.array(self.link_meshes, dtype=str),
+                joint_names=np.array(self.joint_names, dtype=str),
+                joint_types=np.array(self.joint_types, dtype=str),
+                joint_parents=np.array(self.joint_parents, dtype=str),
+                joint_children=np.array(self.joint_children, dtype=str),
+                joint_origins=self.joint_origins,
+                joint_axes=self.joint_axes,
+                joint_lower=self.joint_lower,
+                joint_upper=self.joint_upper,
+            )
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Warning: cannot write robot model cache {cache_path}: {e}")
+
+    def link_index(self, link_name: str) -> int:
+        return self._link_index[link_name]
+
+    def joint_index(self, joint_name: str) -> int:
+        return self._joint_index[joint_name]
+
+    def get_mesh_paths(self) -> Dict[str, str]:
+        """
+        Return absolute visual mesh paths of the links that have a mesh.
+
+        Returns:
+            Dict[str, str]: A dictionary mapping link names to mesh file paths.
+        """
+        urdf_dir = os.path.dirname(self.urdf_path)
+        return {
+            link_name: os.path.normpath(os.path.join(urdf_dir, mesh))
+            for link_name, mesh in zip(self.link_names, self.link_meshes)
+            if mesh
+        }
+
+    def chain(self, end_link_name: str, root_link_name: Optional[str] = None) -> SerialChain:
+        """
+        Get the serial kinematic chain ending at a link. Chains are built once per end link.
+
+        Args:
+            end_link_name: The name of the end effector link.
+            root_link_name: The name of the root link. Defaults to the URDF root.
+
+        Returns:
+            The serial chain from the root link to the end link.
+        """
+        key = (end_link_name, root_link_name)
+        if key not in self._chains:
+            self._chains[key] = self._build_chain(end_link_name, root_link_name)
+        return self._chains[key]
+
+    def _build_chain(self, end_link_name: str, root_link_name: Optional[str]) -> SerialChain:
+        if end_link_name not in self._link_index:
+            raise ValueError(f"Unknown link {end_link_name}.")
+        parent_joints = {child: ind for ind, child in enumerate(self.joint_children)}
+
+        # walk up from the end link to the root
+        link_names = [end_link_name]
+        joints = []
+        while link_names[-1] in parent_joints and link_names[-1] != root_link_name:
+            joint = parent_joints[link_names[-1]]
+            joints.append(joint)
+            link_names.append(self.joint_parents[joint])
+        if root_link_name is not None and link_names[-1] != root_link_name:
+            raise ValueError(f"Link {end_link_name} is not a descendant of {root_link_name}.")
+        link_names.reverse()
+        joints.reverse()
+
+        offsets = [np.eye(4)]
+        axes = [np.zeros(3)]
+        types = [JOINT_FIXED]
+        joint_names = []
+        for joint in joints:
+            joint_type = self.joint_types[joint]
+            if joint_type not in _JOINT_TYPE_MAP:
+                raise ValueError(f"Unsupported joint type {joint_type} of joint {self.joint_names[joint]}.")
+            offsets.append(self.joint_origins[joint])
+            axis = self.joint_axes[joint]
+            axes.append(axis / np.linalg.norm(axis))
+            types.append(_JOINT_TYPE_MAP[joint_type])
+            if joint_type != 'fixed':
+                joint_names.append(self.joint_names[joint])
+
+        return SerialChain(
+            link_names=link_names,
+            joint_names=joint_names,
+            joint_offsets=np.stack(offsets),
+            joint_axes=np.stack(axes),
+            joint_types=np.array(types),
+        )
@@ -0,0 +1,176 @@
+from typing import List, Tuple, Union
+
+import numpy as np
+from armliby.geometry import skew
+
+
+JOINT_FIXED = 0
+JOINT_REVOLUTE = 1
+JOINT_PRISMATIC = 2
+
+
+class SerialChain:
+    def __init__(
+            self,
+            link_names: List[str],
+            joint_names: List[str],
+            joint_offsets: np.ndarray,
+            joint_axes: np.ndarray,
+            joint_types: np.ndarray,
+            ) -> None:
+        """
+        Pure NumPy serial kinematic chain.
+
+        Every link except the root is attached to its parent by one joint.
+        Link transform is parent @ joint_offset @ joint_motion(q).
+
+        Args:
+            link_names: Names of the links from root to end link.
+            joint_names: Names of the movable joints in chain order.
+            joint_offsets: (num_links, 4, 4) fixed transforms of the joints
+                attaching each link to its parent. Identity for the root.
+            joint_axes: (num_links, 3) unit joint axes in the joint frame.
+            joint_types: (num_links,) one of JOINT_FIXED, JOINT_REVOLUTE, JOINT_PRISMATIC.
+        """
+        self.link_names = link_names
+        self.joint_names = joint_names
+        self._offsets = np.asarray(joint_offsets, dtype=np.float64)
+        self._axes = np.asarray(joint_axes, dtype=np.float64)
+        self._types = np.asarray(joint_types, dtype=np.int64)
+
+        # index of the joint value driving each link, -1 for fixed links
+        self._dof_index = np.full(len(link_names), -1, dtype=np.int64)
+        movable = np.nonzero(self._types != JOINT_FIXED)[0]
+        self._dof_index[movable] = np.arange(len(movable))
+
+        # precomputed Rodrigues terms: R = I + sin(q) K + (1 - cos(q)) K^2
+        self._skew = skew(self._axes)
+        self._skew_sq = self._skew @ self._skew
+
+        # single configuration path: offset @ motion(q) = offset + a * first + b * second,
+        # a, b = sin(q), 1 - cos(q) for revolute and q, 0 for prismatic joints
+        terms = np.zeros((len(link_names), 3, 4, 4))
+        terms[:, 0] = self._offsets
+        terms[:, 1, :3, :3] = self._skew
+        terms[:, 2, :3, :3] = self._skew_sq
+        prismatic = self._types == JOINT_PRISMATIC
+        terms[prismatic, 1] = 0.
+        terms[prismatic, 1, :3, 3] = self._axes[prismatic]
+        terms[prismatic, 2] = 0.
+        terms[:, 1:] = self._offsets[:, None] @ terms[:, 1:]
+        terms[self._types == JOINT_FIXED, 1:] = 0.
+        self._single_terms = terms.reshape(len(link_names), 3, 16)
+        self._single_dof = np.maximum(self._dof_index, 0)
+        self._single_revolute = (self._types == JOINT_REVOLUTE).astype(np.float64)
+        self._single_prismatic = prismatic.astype(np.float64)
+
+    @property
+    def num_dof(self) -> int:
+        return len(self.joint_names)
+
+    def _joint_frames(self, js: np.ndarray, end_only: bool):
+        """
+        Yield (link index, joint frame, link frame) along the chain.
+        Joint frame is parent @ joint_offset, i.e. the frame the joint axis is expressed in.
+        """
+        num = js.shape[0]
+        link_tf = np.broadcast_to(np.eye(4), (num, 4, 4))
+        for ind in range(len(self.link_names)):
+            joint_tf = link_tf @ self._offsets[ind]
+            joint_type = self._types[ind]
+            if joint_type == JOINT_FIXED:
+                link_tf = joint_tf
+            else:
+                q = js[:, self._dof_index[ind]]
+                motion = np.zeros((num, 4, 4))
+                motion[:] = np.eye(4)
+                if joint_type == JOINT_REVOLUTE:
+                    motion[:, :3, :3] += (
+                        np.sin(q)[:, None, None] * self._skew[ind]
+                        + (1. - np.cos(q))[:, None, None] * self._skew_sq[ind]
+                    )
+                else:
+                    motion[:, :3, 3] = q[:, None] * self._axes[ind]
+                link_tf = joint_tf @ motion
+            if not end_only or ind == len(self.link_names) - 1:
+                yield ind, joint_tf, link_tf
+
+    def forward_kinematics(self, js: np.ndarray, end_only: bool = False) -> np.ndarray:
+        """
+        Compute link transforms for a batch of joint configurations.
+
+        Args:
+            js: The joint angles, shape (N, dof). In radians.
+            end_only: Compute only the end link transform.
+
+        Returns:
+            (N, num_links, 4, 4) link transforms in the root frame,
+            or (N, 1, 4, 4) if end_only is set.
+        """
+        js = np.atleast_2d(np.asarray(js, dtype=np.float64))
+        if js.shape[0] == 1:
+            return self._forward_kinematics_single(js[0], end_only)
+        num_links = 1 if end_only else len(self.link_names)
+        ret = np.empty((js.shape[0], num_links, 4, 4))
+        for out_ind, (_, _, link_tf) in enumerate(self._joint_frames(js, end_only)):
+            ret[:, out_ind] = link_tf
+        return ret
+
+    def _forward_kinematics_single(self, js: np.ndarray, end_only: bool) -> np.ndarray:
+        # all local transforms with one contraction, then one 4x4 product per link,
+        # avoids the broadcasting overhead of the batched path for N = 1
+        q = js[self._single_dof]
+        coefs = np.empty((len(q), 3))
+        coefs[:, 0] = 1.
+        coefs[:, 1] = self._single_revolute * np.sin(q) + self._single_prismatic * q
+        coefs[:, 2] = self._single_revolute * (1. - np.cos(q))
+        local_tfs = np.einsum('lk,lkj->lj', coefs, self._single_terms).reshape(-1, 4, 4)
+        if end_only:
+            link_tf = local_tfs[0]
+            for local_tf in local_tfs[1:]:
+                link_tf = link_tf @ local_tf
+            return link_tf[None, None]
+        ret = np.empty((1,) + local_tfs.shape)
+        link_tfs = ret[0]
+        link_tfs[0] = local_tfs[0]
+        for ind in range(1, len(local_tfs)):
+            np.matmul(link_tfs[ind - 1], local_tfs[ind], out=link_tfs[ind])
+        return ret
+
+    def jacobian(
+            self,
+            js: np.ndarray,
+            ret_eef_pose: bool = False,
+            ) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute the geometric Jacobian of the end link origin in the root frame.
+
+        Args:
+            js: The joint angles, shape (N, dof). In radians.
+            ret_eef_pose: Also return the end link transforms computed on the way.
+
+        Returns:
+            (N, 6, dof) Jacobian, rows are linear then angular velocity,
+            and (N, 4, 4) end link transforms if ret_eef_pose is set.
+        """
+        js = np.atleast_2d(np.asarray(js, dtype=np.float64))
+        num = js.shape[0]
+        axes_world = np.empty((num, self.num_dof, 3))
+        origins_world = np.empty((num, self.num_dof, 3))
+        end_tf = None
+        for ind, joint_tf, link_tf in self._joint_frames(js, end_only=False):
+            dof = self._dof_index[ind]
+            if dof >= 0:
+                axes_world[:, dof] = joint_tf[:, :3, :3] @ self._axes[ind]
+                origins_world[:, dof] = joint_tf[:, :3, 3]
+            end_tf = link_tf
+
+        jac = np.zeros((num, 6, self.num_dof))
+        revolute = self._types[self._types != JOINT_FIXED] == JOINT_REVOLUTE
+        arm = end_tf[:, None, :3, 3] - origins_world
+        jac[:, :3, revolute] = np.cross(axes_world[:, revolute], arm[:, revolute]).transpose(0, 2, 1)
+        jac[:, 3:, revolute] = axes_world[:, revolute].transpose(0, 2, 1)
+        jac[:, :3, ~revolute] = axes_world[:, ~revolute].transpose(0, 2, 1)
+        if ret_eef_pose:
+            return jac, end_tf
+        return jac
@@ -0,0 +1,165 @@
+import csv
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+
+# durations kept per stage, older ones are overwritten
+DEFAULT_CAPACITY = 4096
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 1.)
+
+
+def now_ns() -> int:
+    """
+    Timestamp used by all spans. CLOCK_MONOTONIC is shared by the processes of one machine,
+    so timestamps taken in the websocket process can be compared in the control process.
+    """
+    return time.monotonic_ns()
+
+
+class _StageBuffer:
+    def __init__(self, capacity: int) -> None:
+        self.durations = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        self.total_ns = 0
+
+    def add(self, duration_ns: int) -> None:
+        self.durations[self.count % len(self.durations)] = duration_ns
+        self.count += 1
+        self.total_ns += duration_ns
+
+    def recent(self) -> np.ndarray:
+        return self.durations[:min(self.count, len(self.durations))]
+
+
+class Tracer:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, enabled: bool = True) -> None:
+        """
+        Low overhead per-stage latency recorder.
+
+        Every stage keeps the last capacity durations in a ring buffer plus running
+        count and sum, quantiles are computed only when statistics are read.
+
+        Args:
+            capacity: Number of recent durations kept per stage.
+            enabled: Record anything at all. A disabled tracer costs one attribute check per call.
+        """
+        self.capacity = capacity
+        self.enabled = enabled
+        self._stages: Dict[str, _StageBuffer] = {}
+
+    def record(self, stage: str, duration_ns: int) -> None:
+        """Record a duration of a stage, nanoseconds."""
+        if not self.enabled:
+            return
+        buffer = self._stages.get(stage)
+        if buffer is None:
+            buffer = self._stages[stage] = _StageBuffer(self.capacity)
+        buffer.add(duration_ns)
+
+    def record_since(self, stage: str, start_ns: int) -> None:
+        """Record a stage that started at a now_ns timestamp, possibly taken in another process."""
+        if self.enabled and start_ns > 0:
+            self.record(stage, now_ns() - start_ns)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Record the duration of the with block as a stage."""
+        if not self.enabled:
+            yield
+            return
+        start_ns = now_ns()
+        try:
+            yield
+        finally:
+            self.record(stage, now_ns() - start_ns)
+
+    @property
+    def stages(self) -> List[str]:
+        return list(self._stages.keys())
+
+    def reset(self) -> None:
+        self._stages.clear()
+
+    def stats(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, Dict[str, float]]:
+        """
+        Per-stage statistics.
+
+        Args:
+            quantiles: Quantiles of the recent durations to compute.
+
+        Returns:
+            Stage name to a dict with count, mean_us and q<quantile>_us values,
+            quantiles over the recent durations, count and mean over all of them.
+        """
+        ret = {}
+        for stage, buffer in self._stages.items():
+            values = np.quantile(buffer.recent(), quantiles) / 1e3
+            stage_stats = {
+                'count': buffer.count,
+                'mean_us': buffer.total_ns / buffer.count / 1e3,
+            }
+            for quantile, value in zip(quantiles, values):
+                stage_stats[f"q{quantile:g}_us"] = float(value)
+            ret[stage] = stage_stats
+        return ret
+
+    def summary(self) -> str:
+        """Human readable per-stage statistics."""
+        lines = []
+        for stage, stage_stats in self.stats().items():
+            values = ' '.join(f"{key} {val:.1f}" for key, val in stage_stats.items() if key != 'count')
+            lines.append(f"{stage}: count {stage_stats['count']} {values}")
+        return '\n'.join(lines)
+
+    def dump_csv(self, path: str) -> None:
+        """
+        Write the recent durations of all stages, one row per duration, oldest first.
+
+        Args:
+            path: The CSV file path, columns stage and duration_us.
+        """
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'duration_us'])
+            for stage, buffer in self._stages.items():
+                recent = buffer.recent()
+                if buffer.count > len(buffer.durations):
+                    recent = np.roll(recent, -(buffer.count % len(buffer.durations)))
+                writer.writerows((stage, value / 1e3) for value in recent.tolist())
+
+    def prometheus_text(self, prefix: str = 'armliby') -> str:
+        """
+        Statistics in the Prometheus text exposition format, as a summary metric per stage.
+
+        Args:
+            prefix: Metric name prefix.
+
+        Returns:
+            The metrics text.
+        """
+        name = f"{prefix}_span_seconds"
+        lines = [
+            f"# HELP {name} Duration of teleop pipeline stages.",
+            f"# TYPE {name} summary",
+        ]
+        for stage, buffer in self._stages.items():
+            values = np.quantile(buffer.recent(), DEFAULT_QUANTILES) / 1e9
+            for quantile, value in zip(DEFAULT_QUANTILES, values):
+                lines.append(f'{name}{{stage="{stage}",quantile="{quantile:g}"}} {value:.9f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {buffer.total_ns / 1e9:.9f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {buffer.count}')
+        return '\n'.join(lines) + '\n'
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """The tracer of this process, shared by the library hot paths."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
@@ -0,0 +1,160 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from armliby.geometry import pose_diff_vector, so3_log
+from armliby.ik import Kinematics
+from armliby.robot.joint_limits import JointLimits
+
+
+DEFAULT_CHUNK_SIZE = 8192
+
+
+class TrajectoryAnalysis:
+    def __init__(
+            self,
+            link_names: List[str],
+            eef_positions: np.ndarray,
+            eef_rotvecs: np.ndarray,
+            cartesian_velocity: np.ndarray,
+            link_bounds: Dict[str, Tuple[np.ndarray, np.ndarray]],
+            limit_violations: Optional[np.ndarray],
+            ) -> None:
+        """
+        Result of analyze_trajectory.
+
+        Args:
+            link_names: The link names of the kinematic chain.
+            eef_positions: (T, 3) end link positions in the root frame.
+            eef_rotvecs: (T, 3) end link orientations as rotation vectors. In radians.
+            cartesian_velocity: (T, 6) end link linear and angular velocity in the root frame,
+                backward differences, the first row is zero. In m/s and rad/s.
+            link_bounds: Link name to (min, max) corners of the box swept by the link origin.
+            limit_violations: (T, dof) boolean mask of joints outside the joint limits,
+                None if no limits were given.
+        """
+        self.link_names = link_names
+        self.eef_positions = eef_positions
+        self.eef_rotvecs = eef_rotvecs
+        self.cartesian_velocity = cartesian_velocity
+        self.link_bounds = link_bounds
+        self.limit_violations = limit_violations
+
+    @property
+    def num_steps(self) -> int:
+        return len(self.eef_positions)
+
+    @property
+    def path_length(self) -> float:
+        """Length of the end link path. In meters."""
+        return float(np.linalg.norm(np.diff(self.eef_positions, axis=0), axis=1).sum())
+
+    @property
+    def max_linear_speed(self) -> float:
+        return float(np.linalg.norm(self.cartesian_velocity[:, :3], axis=1).max(initial=0.))
+
+    @property
+    def max_angular_speed(self) -> float:
+        return float(np.linalg.norm(self.cartesian_velocity[:, 3:], axis=1).max(initial=0.))
+
+    def violation_counts(self) -> Optional[np.ndarray]:
+        """Number of steps each joint spends outside its limits, None if no limits were given."""
+        if self.limit_violations is None:
+            return None
+        return self.limit_violations.sum(axis=0)
+
+
+def analyze_trajectory(
+        kinematics: Kinematics,
+        js: np.ndarray,
+        dt: Optional[float] = None,
+        timestamps_ns: Optional[np.ndarray] = None,
+        joint_limits: Optional[JointLimits] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        link_poses_out: Optional[np.ndarray] = None,
+        ) -> TrajectoryAnalysis:
+    """
+    Compute end link path, velocity, swept link bounds and joint limit violations of a joint trajectory.
+
+    The trajectory is processed in chunks of chunk_size steps with one batched FK call each,
+    so memory use beyond the (T, 3) and (T, 6) results does not grow with the trajectory length.
+
+    Args:
+        kinematics: The kinematics of the chain.
+        js: (T, dof) joint angles. In radians. May be a memory-mapped array.
+        dt: Time step between rows. In seconds.
+        timestamps_ns: (T,) row timestamps, e.g. from a SessionLog. Used if dt is not given.
+        joint_limits: Optional joint limits in degrees, as created by JointLimits.from_urdf
+            with the fixed joints in front of the chain skipped (skip_joints=[0] for the bundled URDF).
+            Only the first dof limits are used, see JointLimits.chain_limits.
+        chunk_size: Number of steps evaluated per FK call.
+        link_poses_out: Optional (T, num_links, 4, 4) array, e.g. np.memmap,
+            that receives the poses of all links.
+
+    Returns:
+        The trajectory analysis.
+    """
+    if dt is None and timestamps_ns is None:
+        raise ValueError("Either dt or timestamps_ns is required.")
+    num_steps = len(js)
+    link_names = kinematics.link_names
+    end_index = link_names.index(kinematics.end_link_name)
+    if link_poses_out is not None and link_poses_out.shape != (num_steps, len(link_names), 4, 4):
+        raise ValueError(
+            f"link_poses_out must have shape {(num_steps, len(link_names), 4, 4)}, got {link_poses_out.shape}")
+
+    lower = upper = None
+    limit_violations = None
+    if joint_limits is not None:
+        lower, upper = joint_limits.chain_limits(kinematics.num_dof)
+        limit_violations = np.zeros((num_steps, kinematics.num_dof), dtype=bool)
+
+    eef_positions = np.empty((num_steps, 3))
+    eef_rotvecs = np.empty((num_steps, 3))
+    cartesian_velocity = np.zeros((num_steps, 6))
+    bounds_min = np.full((len(link_names), 3), np.inf)
+    bounds_max = np.full((len(link_names), 3), -np.inf)
+
+    prev_pose = None
+    for start in range(0, num_steps, chunk_size):
+        end = min(start + chunk_size, num_steps)
+        js_chunk = np.asarray(js[start:end], dtype=np.float64)
+        tfs, _ = kinematics.fk_batch(js_chunk)
+        if link_poses_out is not None:
+            link_poses_out[start:end] = tfs
+
+        origins = tfs[:, :, :3, 3]
+        bounds_min = np.minimum(bounds_min, origins.min(axis=0))
+        bounds_max = np.maximum(bounds_max, origins.max(axis=0))
+
+        eef = tfs[:, end_index].astype(np.float64)
+        eef_positions[start:end] = eef[:, :3, 3]
+        so3_log(eef[:, :3, :3], out=eef_rotvecs[start:end])
+
+        # backward differences, the last pose of the previous chunk starts this one
+        prev = eef[:-1] if prev_pose is None else np.concatenate([prev_pose[None], eef[:-1]])
+        first = start if prev_pose is None else start - 1
+        if timestamps_ns is not None and dt is None:
+            step_dt = np.diff(np.asarray(timestamps_ns[first:end], dtype=np.int64)) / 1e9
+            step_dt = np.where(step_dt > 0, step_dt, np.nan)[:, None]
+        else:
+            step_dt = dt
+        velocity_start = start + (1 if prev_pose is None else 0)
+        velocity = cartesian_velocity[velocity_start:end]
+        pose_diff_vector(prev, eef[velocity_start - start:], out=velocity)
+        velocity /= step_dt
+        prev_pose = eef[-1]
+
+        if lower is not None:
+            limit_violations[start:end] = (js_chunk < lower) | (js_chunk > upper)
+
+    return TrajectoryAnalysis(
+        link_names=link_names,
+        eef_positions=eef_positions,
+        eef_rotvecs=eef_rotvecs,
+        cartesian_velocity=cartesian_velocity,
+        link_bounds={
+            link_name: (bounds_min[ind], bounds_max[ind])
+            for ind, link_name in enumerate(link_names)
+        },
+        limit_violations=limit_violations,
+    )
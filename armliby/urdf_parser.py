@@ -1,7 +1,6 @@
-import os
 from typing import Dict, List, Optional, Tuple
 
-from yourdfpy import URDF
+from armliby.robot_model import RobotModel
 
 
 class URDFParser:
@@ -13,6 +12,7 @@ class URDFParser:
             ) -> None:
         """
         Parse the URDF file.
+        The file is parsed once per process and cached on disk, see RobotModel.load.
 
         Args:
             urdf_path (str): Path to the URDF file.
@@ -20,26 +20,31 @@ class URDFParser:
             skip_joints (Optional[List[int]], optional): List of joint indices to skip. Defaults to None.
         """
         self._urdf_path: str = urdf_path
-        self._urdf: URDF = URDF.load(urdf_path)
+        self._model: RobotModel = RobotModel.load(urdf_path)
         self._skip_links = set() if skip_links is None else set(skip_links)
         self._skip_joints = set() if skip_joints is None else set(skip_joints)
+        self._link_stl_map: Optional[Dict[str, str]] = None
+
+    @property
+    def model(self) -> RobotModel:
+        return self._model
 
     def get_link_stl_map(self) -> Dict[str, str]:
         """
-        Return the link to STL file mapping.
+        Return the link to STL file mapping. Computed once, do not modify the result.
 
         Returns:
             Dict[str, str]: A dictionary mapping link names to STL file paths.
         """
-        return {
-            link.name: os.path.normpath(os.path.join(
-                os.path.dirname(self._urdf_path),
-                link.visuals[0].geometry.mesh.filename),
-            )
-            for ind, link
-            in enumerate(self._urdf.robot.links)
-            if ind not in self._skip_links and len(link.visuals) > 0
-        }
+        if self._link_stl_map is None:
+            mesh_paths = self._model.get_mesh_paths()
+            self._link_stl_map = {
+                link_name: mesh_paths[link_name]
+                for ind, link_name
+                in enumerate(self._model.link_names)
+                if ind not in self._skip_links and link_name in mesh_paths
+            }
+        return self._link_stl_map
 
     def get_links(self) -> List[str]:
         """
@@ -49,8 +54,8 @@ class URDFParser:
             List[str]: A list of link names.
         """
         return [
-            l.name 
-            for ind, l in enumerate(self._urdf.robot.links)
+            l
+            for ind, l in enumerate(self._model.link_names)
             if ind not in self._skip_links
         ]
 
@@ -63,8 +68,8 @@ class URDFParser:
         """
         lower = []
         upper = []
-        for ind, joint in enumerate(self._urdf.robot.joints):
+        for ind in range(len(self._model.joint_names)):
             if ind not in self._skip_joints:
-                lower.append(joint.limit.lower)
-                upper.append(joint.limit.upper)
+                lower.append(float(self._model.joint_lower[ind]))
+                upper.append(float(self._model.joint_upper[ind]))
         return lower, upper
@@ -0,0 +1,189 @@
+from typing import Iterator, List, Union
+
+import numpy as np
+from armliby.vrteleop.controller_data import ControllerData, Pose
+from armliby.vrteleop.protocol import (
+    _AXES_OFFSET,
+    _NUM_AXES_OFFSET,
+    _NUM_BUTTONS_OFFSET,
+    _POSE_OFFSET,
+    _PRESSED_OFFSET,
+    _VALUES_OFFSET,
+    CONTROLLER_FLOATS,
+    FRAME_FLOATS,
+    MAX_AXES,
+    MAX_BUTTONS,
+    decode_controller_frame,
+    pack_controller_frame,
+)
+
+
+# the fields overlay the packed frame layout of the binary protocol, so storing a frame is one copy
+CONTROLLER_DTYPE = np.dtype({
+    'names': ['pose', 'num_buttons', 'pressed', 'values', 'num_axes', 'axes'],
+    'formats': [('<f4', (4, 4)), '<f4', ('<f4', (MAX_BUTTONS,)), ('<f4', (MAX_BUTTONS,)), '<f4', ('<f4', (MAX_AXES,))],
+    'offsets': [4 * offset for offset in (
+        _POSE_OFFSET, _NUM_BUTTONS_OFFSET, _PRESSED_OFFSET, _VALUES_OFFSET, _NUM_AXES_OFFSET, _AXES_OFFSET)],
+    'itemsize': 4 * CONTROLLER_FLOATS,
+})
+
+SAMPLE_DTYPE = np.dtype([
+    ('timestamp_ns', '<i8'),
+    ('left', CONTROLLER_DTYPE),
+    ('right', CONTROLLER_DTYPE),
+])
+
+
+class ButtonView:
+    __slots__ = ('_pressed', '_values', '_index')
+
+    def __init__(self, pressed: np.ndarray, values: np.ndarray, index: int) -> None:
+        self._pressed = pressed
+        self._values = values
+        self._index = index
+
+    @property
+    def pressed(self) -> bool:
+        return bool(self._pressed[self._index] != 0.)
+
+    @property
+    def value(self) -> float:
+        return float(self._values[self._index])
+
+
+class ButtonsView:
+    __slots__ = ('_num_buttons', '_buttons')
+
+    def __init__(self, record: np.ndarray) -> None:
+        """Read-only list-like access to the buttons of a CONTROLLER_DTYPE record."""
+        self._num_buttons = record['num_buttons']
+        pressed = record['pressed'][0]
+        values = record['values'][0]
+        self._buttons = [ButtonView(pressed, values, ind) for ind in range(MAX_BUTTONS)]
+
+    def __len__(self) -> int:
+        return min(int(self._num_buttons[0]), MAX_BUTTONS)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[ButtonView, List[ButtonView]]:
+        buttons = self._buttons[:len(self)]
+        return buttons[index]
+
+    def __iter__(self) -> Iterator[ButtonView]:
+        return iter(self._buttons[:len(self)])
+
+
+class ControllerView:
+    __slots__ = ('pose', 'buttons', '_record')
+
+    def __init__(self, record: np.ndarray) -> None:
+        """
+        Controller access to a one element CONTROLLER_DTYPE array without copies,
+        same attributes as Controller.
+        """
+        self._record = record
+        # the pose is stored column-major, the transposed view is the 4x4 matrix
+        self.pose = Pose(record['pose'][0].T)
+        self.buttons = ButtonsView(record)
+
+    @property
+    def axes(self) -> np.ndarray:
+        return self._record['axes'][0, :min(int(self._record['num_axes'][0]), MAX_AXES)]
+
+
+class ControllerDataView:
+    __slots__ = ('leftController', 'rightController', '_record')
+
+    def __init__(self, record: np.ndarray) -> None:
+        """
+        ControllerData access to a one element SAMPLE_DTYPE array without copies.
+        The view shows whatever is stored in its ring buffer slot,
+        so it changes when the slot is reused.
+        """
+        self._record = record
+        self.leftController = ControllerView(record['left'])
+        self.rightController = ControllerView(record['right'])
+
+    @property
+    def timestamp_ns(self) -> int:
+        return int(self._record['timestamp_ns'][0])
+
+    def to_controller_data(self) -> ControllerData:
+        """Copy into a standalone ControllerData that outlives the ring buffer slot."""
+        controller_data = decode_controller_frame(pack_controller_frame(self, np.empty(FRAME_FLOATS, np.float32)))
+        controller_data.timestamp_ns = self.timestamp_ns
+        return controller_data
+
+
+class ControllerRingBuffer:
+    def __init__(self, capacity: int = 256) -> None:
+        """
+        Preallocated history of controller samples.
+
+        Samples are stored in a SAMPLE_DTYPE array and exposed through views created once
+        per slot, so pushing and reading samples does not allocate. A view returned by
+        push or latest stays valid until capacity more samples are pushed.
+
+        Args:
+            capacity: Number of samples kept, at least 2.
+        """
+        if capacity < 2:
+            raise ValueError(f"Capacity must be at least 2, got {capacity}")
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self._views = [ControllerDataView(self.data[ind:ind + 1]) for ind in range(capacity)]
+        self._timestamps = self.data['timestamp_ns']
+        # (capacity, FRAME_FLOATS) float32 view of both controllers
+        self._frames = np.ndarray(
+            (capacity, FRAME_FLOATS), dtype='<f4', buffer=self.data,
+            offset=SAMPLE_DTYPE.fields['left'][1], strides=(SAMPLE_DTYPE.itemsize, 4))
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    def push_frame(self, frame: np.ndarray, timestamp_ns: int = 0) -> ControllerDataView:
+        """
+        Store a packed binary protocol frame.
+
+        Args:
+            frame: FRAME_FLOATS float32 values.
+            timestamp_ns: armliby.tracing.now_ns receive timestamp.
+
+        Returns:
+            The view of the stored sample.
+        """
+        slot = self._count % self.capacity
+        self._timestamps[slot] = timestamp_ns
+        self._frames[slot] = frame
+        self._count += 1
+        return self._views[slot]
+
+    def push(self, controller_data: ControllerData) -> ControllerDataView:
+        """Store a ControllerData sample."""
+        frame = pack_controller_frame(controller_data, np.empty(FRAME_FLOATS, dtype=np.float32))
+        return self.push_frame(frame, controller_data.timestamp_ns)
+
+    def latest(self, age: int = 0) -> ControllerDataView:
+        """
+        Get a recent sample.
+
+        Args:
+            age: 0 for the newest sample, 1 for the one before and so on.
+
+        Returns:
+            The view of the sample.
+        """
+        if not 0 <= age < len(self):
+            raise IndexError(f"Only {len(self)} samples are stored, requested age {age}")
+        return self._views[(self._count - 1 - age) % self.capacity]
+
+    def history(self, num: int) -> np.ndarray:
+        """
+        Copy the newest num samples, oldest first.
+
+        Returns:
+            SAMPLE_DTYPE array.
+        """
+        num = min(num, len(self))
+        indices = np.arange(self._count - num, self._count) % self.capacity
+        return self.data[indices]
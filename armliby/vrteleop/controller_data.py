@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from armliby.geometry import pose_diff, so3_log
+
+
+@dataclass
+class Vec:
+    array: np.ndarray
+
+    @property
+    def x(self) -> float:
+        return self.array[0];
+
+    @property
+    def y(self) -> float:
+        return self.array[1];
+
+    @property
+    def z(self) -> float:
+        return self.array[2];
+
+
+@dataclass
+class Pose:
+    matrix4: np.ndarray
+
+    @property
+    def x(self) -> float:
+        return self.matrix4[0, 3]
+
+    @property
+    def y(self) -> float:
+        return self.matrix4[1, 3]
+
+    @property
+    def z(self) -> float:
+        return self.matrix4[2, 3]
+
+    def diff_to(self, to_pose: 'Pose', out: Optional['Pose'] = None) -> 'Pose':
+        """Rotation and translation from this pose to to_pose. Written into out if given."""
+        if out is None:
+            return Pose(pose_diff(self.matrix4, to_pose.matrix4))
+        pose_diff(self.matrix4, to_pose.matrix4, out=out.matrix4)
+        return out
+
+    def rotvec(self) -> Vec:
+        return Vec(self.matrix4[:3, :3].T @ so3_log(self.matrix4[:3, :3]))
+
+
+@dataclass
+class Button:
+    pressed: bool
+    value: float
+
+
+@dataclass
+class Controller:
+    pose: Pose
+    buttons: List[Button]
+    axes: List[float]
+        
+
+@dataclass
+class ControllerData:
+    leftController: Controller
+    rightController: Controller
+    # armliby.tracing.now_ns of the websocket receive, 0 if unknown
+    timestamp_ns: int = 0
@@ -1,75 +1,89 @@
 import asyncio
+import http
+import json
+import struct
 import ssl
-from dataclasses import dataclass
 from multiprocessing import Pipe, Process
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
 
 import numpy as np
 import websockets
-from flask import json
-from scipy.spatial.transform import Rotation as R
-
-
-@dataclass
-class Vec:
-    array: np.ndarray
-
-    @property
-    def x(self) -> float:
-        return self.array[0];
-
-    @property
-    def y(self) -> float:
-        return self.array[1];
-
-    @property
-    def z(self) -> float:
-        return self.array[2];
-
-
-@dataclass
-class Pose:
-    matrix4: np.ndarray
-
-    @property
-    def x(self) -> float:
-        return self.matrix4[0, 3]
-
-    @property
-    def y(self) -> float:
-        return self.matrix4[1, 3]
-
-    @property
-    def z(self) -> float:
-        return self.matrix4[2, 3]
-
-    def diff_to(self, to_pose: 'Pose') -> 'Pose':
-        array = np.eye(4)
-        array[:3, :3] = to_pose.matrix4[:3, :3] @ self.matrix4[:3, :3].T
-        array[:3,  3] = to_pose.matrix4[:3,  3] - self.matrix4[:3,  3]
-        return Pose(array)
-    
-    def rotvec(self) -> Vec:
-        return Vec(self.matrix4[:3, :3].T @ R.from_matrix(self.matrix4[:3, :3]).as_rotvec(degrees=False))
-
-
-@dataclass
-class Button:
-    pressed: bool
-    value: float
-
-
-@dataclass
-class Controller:
-    pose: Pose
-    buttons: List[Button]
-    axes: List[float]
-        
-
-@dataclass
-class ControllerData:
-    leftController: Controller
-    rightController: Controller
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+from armliby.tracing import get_tracer, now_ns
+from armliby.vrteleop.controller_buffer import ControllerDataView, ControllerRingBuffer
+from armliby.vrteleop.controller_data import Button, Controller, ControllerData, Pose, Vec
+from armliby.vrteleop.protocol import (
+    BINARY_SUBPROTOCOL,
+    FRAME_BYTES,
+    decode_controller_json,
+    encode_controller_frame,
+    encode_link_header,
+    encode_transforms_binary,
+    encode_transforms_json,
+)
+from armliby.vrteleop.shm_transport import SharedMemoryTransport
+from armliby.vrteleop.static_site import StaticSite
+
+
+# non-blocking pipe mode pushes every controller frame to the control process, at most this many unread.
+# Keeps the pipe buffer from filling up and blocking the websocket loop when the control loop stalls
+_MAX_SAMPLES_IN_FLIGHT = 32
+
+# wake-up message of the shared memory mode, timestamp of the controller frame
+# the published transforms were computed from
+_WAKE_UP = struct.Struct('<q')
+
+# controller samples go over the pipe as raw bytes, receive timestamp followed by the packed frame
+_SAMPLE_HEADER = struct.Struct('<q')
+
+# operator client drives the robot, observers only receive transforms.
+# Clients choose the role with the ?role= query of the websocket url.
+ROLE_OPERATOR = 'operator'
+ROLE_OBSERVER = 'observer'
+
+
+def _message_to_frame(message) -> np.ndarray:
+    if isinstance(message, bytes):
+        if len(message) != FRAME_BYTES:
+            raise ValueError(f"Controller frame must be {FRAME_BYTES} bytes, got {len(message)}")
+    else:
+        message = encode_controller_frame(decode_controller_json(message))
+    return np.frombuffer(message, dtype='<f4')
+
+
+def _message_to_sample(message, received_ns: int) -> bytes:
+    return _SAMPLE_HEADER.pack(received_ns) + _message_to_frame(message).tobytes()
+
+
+class _TransformsMessage:
+    def __init__(self, transforms: Dict[str, np.ndarray], source_timestamp_ns: int = 0) -> None:
+        """Published transforms, encoded lazily once per format and shared by all clients."""
+        self.transforms = transforms
+        self.source_timestamp_ns = source_timestamp_ns
+        self.link_names = list(transforms.keys())
+        self._json: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    def json(self) -> str:
+        if self._json is None:
+            self._json = encode_transforms_json(self.transforms)
+        return self._json
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = encode_transforms_binary(self.transforms, self.link_names)
+        return self._binary
+
+
+class _ClientState:
+    def __init__(self, role: str, binary: bool, max_rate: Optional[float]) -> None:
+        self.role = role
+        self.binary = binary
+        self.min_period = 0. if max_rate is None else 1. / max_rate
+        self.message: Optional[_TransformsMessage] = None
+        self.updated = asyncio.Event()
 
 
 class VRWebsocketServer:
@@ -79,6 +93,12 @@ class VRWebsocketServer:
             port: int,
             cert_path: str,
             key_path: str,
+            non_blocking: bool = False,
+            shared_memory: bool = False,
+            operator_max_rate: Optional[float] = None,
+            observer_max_rate: Optional[float] = 30.,
+            site: Optional[StaticSite] = None,
+            history_size: int = 256,
             ):
         """
         Initialize the VR websocket server.
@@ -89,49 +109,229 @@ class VRWebsocketServer:
             cert_path: The path to the SSL certificate file. 
                 Create using openssl req -x509 -newkey rsa:4096 -keyout key.pem -out cert.pem -days 365 -nodes
             key_path: The path to the SSL key file.
+            non_blocking: Decouple the websocket loop from the control loop.
+                Clients stream controller frames and never wait for a reply,
+                the control loop reads the newest frame with get_latest at its own rate
+                and pushes link transforms with publish. Stale frames are dropped.
+            shared_memory: Exchange controller frames and transforms through shared memory
+                instead of pickling them over a pipe. Implies non_blocking.
+            operator_max_rate: Maximum rate of transform messages sent to the operator client, Hz.
+                None for no limit.
+            observer_max_rate: Maximum rate of transform messages sent to each observer client, Hz.
+                None for no limit. Clients that fall behind get only the newest transforms.
+            site: Serve the web page, link list and meshes from the websocket port,
+                so one process and one TLS port cover the whole session and VRTeleopServer
+                is not needed. Plain HTTP GET requests are answered from memory.
+                The websocket library has no HTTP keep-alive, every plain HTTP response
+                is sent with Connection: close, so each page or mesh request needs its own TLS handshake.
+            history_size: Number of recent controller samples kept in samples.
+                Samples are handed to callbacks as views into this ring buffer,
+                a view stays valid until history_size newer samples arrive.
         """
         self._host = host
         self._port = port
         self._cert_path = cert_path
         self._key_path = key_path
+        self._non_blocking = non_blocking or shared_memory
+        self._operator_max_rate = operator_max_rate
+        self._observer_max_rate = observer_max_rate
+        self._site = site
         self._process = None
         self._parent_conn, self._child_conn = Pipe()
 
+        # the pipe then only carries link order headers and wake-ups
+        self._shm = SharedMemoryTransport() if shared_memory else None
+        self._link_names: Optional[List[str]] = None
+
+        # websocket process state
+        self._clients: Dict[object, _ClientState] = {}
+        self._operator = None
+        self._reply_received: Optional[asyncio.Event] = None
+        self._forwarded_timestamp_ns = 0
+
+        # websocket process state in non-blocking mode, samples sent and not yet read by
+        # the control process and the newest sample held back while too many are unread
+        self._samples_in_flight = 0
+        self._latest_sample: Optional[bytes] = None
+
+        # control process state, recent samples decoded in place without allocations
+        self.samples = ControllerRingBuffer(history_size)
+
     async def _handle_connection(self, websocket):
-        print("Client connected")
+        query = parse_qs(urlparse(websocket.request.path).query)
+        role = ROLE_OBSERVER if query.get('role') == [ROLE_OBSERVER] else ROLE_OPERATOR
+        client = _ClientState(
+            role=role,
+            # clients that negotiated the binary subprotocol get packed float32 transforms
+            binary=websocket.subprotocol == BINARY_SUBPROTOCOL,
+            max_rate=self._observer_max_rate if role == ROLE_OBSERVER else self._operator_max_rate,
+        )
+        print(f"Client connected as {role}")
+        tracer = get_tracer()
+        self._clients[websocket] = client
+        sender = asyncio.create_task(self._send_transforms(websocket, client))
         try:
             async for message in websocket:
-
-                parsed_data = json.loads(message)
-
-                # Convert dictionary to dataclass
-                controller_data = ControllerData(
-                    leftController=Controller(
-                        pose=Pose(np.array(parsed_data["leftController"]["pose"]).reshape(4, 4).T),
-                        buttons=[Button(**btn) for btn in parsed_data["leftController"]["buttons"]],
-                        axes=parsed_data["leftController"]["axes"]
-                    ),
-                    rightController=Controller(
-                        pose=Pose(np.array(parsed_data["rightController"]["pose"]).reshape(4, 4).T),
-                        buttons=[Button(**btn) for btn in parsed_data["rightController"]["buttons"]],
-                        axes=parsed_data["rightController"]["axes"]
-                    )
-                )
+                received_ns = now_ns()
+                # the first operator client to send owns the robot until it disconnects,
+                # messages of other clients are ignored
+                if self._operator is None and client.role == ROLE_OPERATOR:
+                    self._operator = websocket
+                if self._operator is not websocket:
+                    continue
+
+                if self._shm is not None:
+                    with tracer.span('ws_decode'):
+                        frame = _message_to_frame(message)
+                    self._shm.write_controller_frame(frame, received_ns)
+                    continue
+
+                with tracer.span('ws_decode'):
+                    sample = _message_to_sample(message, received_ns)
+
+                if self._non_blocking:
+                    if self._samples_in_flight < _MAX_SAMPLES_IN_FLIGHT:
+                        self._send_sample(sample)
+                    else:
+                        # control loop is behind, keep only the newest sample
+                        self._latest_sample = sample
+                    continue
 
                 # Send the message to the main process through the pipe
-                self._child_conn.send(controller_data)
-
-                # Wait for a response from the main process
-                transforms = self._child_conn.recv()  # Blocks until a value is received
+                self._reply_received.clear()
+                self._forwarded_timestamp_ns = received_ns
+                self._child_conn.send_bytes(sample)
 
-                # Convert the transforms to a JSON-friendly format
-                transforms_json = {key: val.tolist() for key, val in transforms.items()}
-
-                # Send the transformation matrices back to the client
-                await websocket.send(json.dumps(transforms_json))
+                # Wait for a response from the main process, it is broadcast to all clients
+                await self._reply_received.wait()
 
         except websockets.exceptions.ConnectionClosed as e:
             print("Client disconnected:", e)
+        finally:
+            del self._clients[websocket]
+            if self._operator is websocket:
+                self._operator = None
+            sender.cancel()
+
+    async def _send_transforms(self, websocket, client: _ClientState):
+        """Send the newest published transforms to a client, at most at the client rate."""
+        loop = asyncio.get_running_loop()
+        tracer = get_tracer()
+        sent_link_names: Optional[List[str]] = None
+        try:
+            while True:
+                await client.updated.wait()
+                client.updated.clear()
+                sent_time = loop.time()
+                message = client.message
+                if client.binary:
+                    if message.link_names != sent_link_names:
+                        # link order is sent once and then only on change
+                        await websocket.send(encode_link_header(message.link_names))
+                        sent_link_names = message.link_names
+                    with tracer.span('ws_encode'):
+                        data = message.binary()
+                else:
+                    with tracer.span('ws_encode'):
+                        data = message.json()
+                with tracer.span('ws_send'):
+                    await websocket.send(data)
+                # from the websocket receive of the controller frame to the reply hitting the socket
+                tracer.record_since('round_trip', message.source_timestamp_ns)
+
+                # updates arriving meanwhile overwrite each other, so a slow client
+                # gets the newest transforms and never delays other clients
+                delay = client.min_period - (loop.time() - sent_time)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def _send_sample(self, sample: bytes):
+        self._child_conn.send_bytes(sample)
+        self._samples_in_flight += 1
+
+    def _on_control_message(self):
+        """Handle messages from the control process, called by the event loop when the pipe is readable."""
+        if self._shm is not None:
+            source_timestamp_ns = 0
+            while self._child_conn.poll():
+                message = self._child_conn.recv_bytes()
+                if len(message) == _WAKE_UP.size:
+                    source_timestamp_ns, = _WAKE_UP.unpack(message)
+                else:
+                    self._link_names = json.loads(message)["links"]
+            if self._link_names is not None:
+                transforms = self._shm.read_transforms(self._link_names)
+                if transforms is not None:
+                    self._broadcast(transforms, source_timestamp_ns)
+            return
+
+        while self._child_conn.poll():
+            message = self._child_conn.recv()
+            if isinstance(message, int):
+                # number of samples the control process has read
+                self._samples_in_flight -= message
+                if self._latest_sample is not None and self._samples_in_flight < _MAX_SAMPLES_IN_FLIGHT:
+                    self._send_sample(self._latest_sample)
+                    self._latest_sample = None
+            elif self._non_blocking:
+                transforms, source_timestamp_ns = message
+                self._broadcast(transforms, source_timestamp_ns)
+            else:
+                self._broadcast(message, self._forwarded_timestamp_ns)
+                self._reply_received.set()
+
+    def _broadcast(self, transforms: Dict[str, np.ndarray], source_timestamp_ns: int = 0):
+        # transforms are delivered to clients asynchronously, newest only
+        message = _TransformsMessage(transforms, source_timestamp_ns)
+        for client in self._clients.values():
+            client.message = message
+            client.updated.set()
+
+    @staticmethod
+    def _select_subprotocol(connection, subprotocols: Sequence[str]) -> Optional[str]:
+        # binary protocol is opt-in, plain JSON clients offer no subprotocol
+        if BINARY_SUBPROTOCOL in subprotocols:
+            return BINARY_SUBPROTOCOL
+        return None
+
+    def _process_request(self, connection, request) -> Optional[Response]:
+        """Answer plain HTTP requests from the static site, let websocket upgrades through."""
+        if request.headers.get('Upgrade', '').lower() == 'websocket':
+            return None
+
+        if urlparse(request.path).path == '/metrics':
+            # span statistics of the websocket process
+            return Response(
+                http.HTTPStatus.OK.value,
+                http.HTTPStatus.OK.phrase,
+                Headers({
+                    'Connection': 'close',
+                    'Cache-Control': 'no-cache',
+                    'Content-Type': 'text/plain; version=0.0.4',
+                }),
+                get_tracer().prometheus_text().encode(),
+            )
+
+        status, static_response = self._site.get(request.path)
+        if static_response is None:
+            return connection.respond(status, f"{status.phrase}\n")
+
+        headers = Headers()
+        # the websocket server closes plain HTTP connections after the response
+        headers['Connection'] = 'close'
+        headers['ETag'] = static_response.etag
+        if static_response.max_age is not None:
+            headers['Cache-Control'] = f"public, max-age={static_response.max_age}"
+        else:
+            headers['Cache-Control'] = 'no-cache'
+        if request.headers.get('If-None-Match') == static_response.etag:
+            return Response(http.HTTPStatus.NOT_MODIFIED.value, http.HTTPStatus.NOT_MODIFIED.phrase, headers, b'')
+
+        headers['Content-Type'] = static_response.content_type
+        headers['Content-Length'] = str(len(static_response.body))
+        return Response(http.HTTPStatus.OK.value, http.HTTPStatus.OK.phrase, headers, static_response.body)
 
     async def _start_server(self):
         ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
@@ -141,9 +341,13 @@ class VRWebsocketServer:
         )
 
         async with websockets.serve(
-            self._handle_connection, self._host, self._port, ssl=ssl_context
+            self._handle_connection, self._host, self._port, ssl=ssl_context,
+            select_subprotocol=self._select_subprotocol,
+            process_request=None if self._site is None else self._process_request,
         ):
             print(f"WebSocket server started on wss://{self._host}:{self._port}")
+            self._reply_received = asyncio.Event()
+            asyncio.get_running_loop().add_reader(self._child_conn.fileno(), self._on_control_message)
             await asyncio.Future()  # Run forever
 
     def _run(self):
@@ -155,15 +359,94 @@ class VRWebsocketServer:
         self._process.start()
         print(f"WebSocket server process started with PID {self._process.pid}")
 
-    def check(self, callback: Callable[[ControllerData], Dict[str, np.ndarray]]):
+    def _push_sample(self, sample: bytes) -> ControllerDataView:
+        timestamp_ns, = _SAMPLE_HEADER.unpack_from(sample)
+        frame = np.frombuffer(sample, dtype='<f4', offset=_SAMPLE_HEADER.size)
+        return self.samples.push_frame(frame, timestamp_ns)
+
+    def check(self, callback: Callable[[ControllerDataView], Dict[str, np.ndarray]]):
         """
         Checks for messages from the WebSocket process, processes them using the callback,
         and sends the result back to the WebSocket process.
+        In non-blocking mode the callback gets the newest sample only.
+        The callback gets a view into samples, samples.latest(1) is the previous sample.
         """
+        tracer = get_tracer()
+        if self._non_blocking:
+            controller_data = self.get_latest()
+            if controller_data is not None:
+                with tracer.span('control_callback'):
+                    transforms = callback(controller_data)
+                self.publish(transforms, controller_data.timestamp_ns)
+            return
+
         if self._parent_conn.poll():  # Check if there's a message in the pipe
-            message = self._parent_conn.recv()  # Receive the message
+            controller_data = self._push_sample(self._parent_conn.recv_bytes())  # Receive the message
+            tracer.record_since('ws_to_control', controller_data.timestamp_ns)
+            with tracer.span('control_callback'):
+                transforms = callback(controller_data)
             # Send the data back to the WebSocket process
-            self._parent_conn.send(callback(message))
+            self._parent_conn.send(transforms)
+
+    def get_latest(self) -> Optional[ControllerDataView]:
+        """
+        Get the newest controller sample without blocking. Non-blocking mode only.
+        The websocket process pushes every frame as it arrives and this call drains
+        them to the last one, so the sample is the newest received before the call.
+        Only if the control loop falls more than _MAX_SAMPLES_IN_FLIGHT frames behind
+        the websocket process holds back the newest frame until the backlog is read.
+
+        Returns:
+            The newest controller data received since the previous call as a view into samples, or None.
+        """
+        if not self._non_blocking:
+            raise RuntimeError("get_latest is available in non-blocking mode only.")
+
+        tracer = get_tracer()
+        if self._shm is not None:
+            frame = self._shm.read_controller_frame()
+            if frame is None:
+                return None
+            controller_data = self.samples.push_frame(frame, self._shm.controller_timestamp_ns)
+            tracer.record_since('ws_to_control', controller_data.timestamp_ns)
+            return controller_data
+
+        sample = None
+        num_read = 0
+        while self._parent_conn.poll():
+            sample = self._parent_conn.recv_bytes()
+            num_read += 1
+        if sample is None:
+            return None
+        # lets the websocket process send more samples
+        self._parent_conn.send(num_read)
+        controller_data = self._push_sample(sample)
+        tracer.record_since('ws_to_control', controller_data.timestamp_ns)
+        return controller_data
+
+    def publish(self, transforms: Dict[str, np.ndarray], source_timestamp_ns: int = 0):
+        """
+        Push link transforms to all connected clients. Non-blocking mode only.
+
+        Args:
+            transforms: Link name to 4x4 transform mapping.
+            source_timestamp_ns: ControllerData.timestamp_ns of the sample the transforms
+                were computed from, used for round trip latency tracing. 0 if unknown.
+        """
+        if not self._non_blocking:
+            raise RuntimeError("publish is available in non-blocking mode only.")
+
+        if self._shm is not None:
+            link_names = list(transforms.keys())
+            if link_names != self._link_names:
+                self._parent_conn.send_bytes(encode_link_header(link_names).encode())
+                self._link_names = link_names
+            self._shm.write_transforms(transforms, link_names)
+            # wakes up the websocket process
+            self._parent_conn.send_bytes(_WAKE_UP.pack(source_timestamp_ns))
+            return
+
+        self._parent_conn.send((transforms, source_timestamp_ns))
 
     def stop(self):
         """Stops the WebSocket server process."""
@@ -171,3 +454,7 @@ class VRWebsocketServer:
             self._process.terminate()
             self._process.join()
             print("WebSocket server process terminated.")
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
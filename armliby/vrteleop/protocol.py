@@ -0,0 +1,193 @@
+import json
+from typing import Dict, List, Union
+
+import numpy as np
+from armliby.vrteleop.controller_data import Button, Controller, ControllerData, Pose
+
+
+# Websocket subprotocol name clients offer to switch to the packed binary format
+BINARY_SUBPROTOCOL = 'armliby.binary.v1'
+
+# Fixed controller frame layout, float32 values per controller:
+#   pose       16  column-major 4x4 matrix, as three.js Matrix4.elements
+#   n_buttons   1
+#   pressed     MAX_BUTTONS  0 or 1
+#   values      MAX_BUTTONS
+#   n_axes      1
+#   axes        MAX_AXES
+# The frame is the left controller followed by the right controller.
+MAX_BUTTONS = 8
+MAX_AXES = 4
+
+_POSE_OFFSET = 0
+_NUM_BUTTONS_OFFSET = 16
+_PRESSED_OFFSET = _NUM_BUTTONS_OFFSET + 1
+_VALUES_OFFSET = _PRESSED_OFFSET + MAX_BUTTONS
+_NUM_AXES_OFFSET = _VALUES_OFFSET + MAX_BUTTONS
+_AXES_OFFSET = _NUM_AXES_OFFSET + 1
+
+CONTROLLER_FLOATS = _AXES_OFFSET + MAX_AXES
+FRAME_FLOATS = 2 * CONTROLLER_FLOATS
+FRAME_BYTES = FRAME_FLOATS * 4
+
+
+def _decode_controller(values: np.ndarray) -> Controller:
+    num_buttons = min(int(values[_NUM_BUTTONS_OFFSET]), MAX_BUTTONS)
+    num_axes = min(int(values[_NUM_AXES_OFFSET]), MAX_AXES)
+    pressed = values[_PRESSED_OFFSET:_PRESSED_OFFSET + num_buttons]
+    button_values = values[_VALUES_OFFSET:_VALUES_OFFSET + num_buttons]
+    return Controller(
+        pose=Pose(values[_POSE_OFFSET:_POSE_OFFSET + 16].astype(np.float64).reshape(4, 4).T),
+        buttons=[Button(pressed=bool(p), value=float(v)) for p, v in zip(pressed, button_values)],
+        axes=values[_AXES_OFFSET:_AXES_OFFSET + num_axes].tolist(),
+    )
+
+
+def _encode_controller(controller: Controller, out: np.ndarray) -> None:
+    buttons = controller.buttons[:MAX_BUTTONS]
+    axes = controller.axes[:MAX_AXES]
+    out[_POSE_OFFSET:_POSE_OFFSET + 16] = controller.pose.matrix4.T.reshape(16)
+    out[_NUM_BUTTONS_OFFSET] = len(buttons)
+    out[_PRESSED_OFFSET:_PRESSED_OFFSET + len(buttons)] = [btn.pressed for btn in buttons]
+    out[_VALUES_OFFSET:_VALUES_OFFSET + len(buttons)] = [btn.value for btn in buttons]
+    out[_NUM_AXES_OFFSET] = len(axes)
+    out[_AXES_OFFSET:_AXES_OFFSET + len(axes)] = axes
+
+
+def decode_controller_frame(data: Union[bytes, np.ndarray]) -> ControllerData:
+    """
+    Decode a packed binary controller frame.
+
+    Args:
+        data: FRAME_BYTES bytes of little-endian float32 values,
+            or an already unpacked float32 array of FRAME_FLOATS values.
+
+    Returns:
+        The controller data.
+    """
+    if isinstance(data, np.ndarray):
+        values = data
+    else:
+        if len(data) != FRAME_BYTES:
+            raise ValueError(f"Controller frame must be {FRAME_BYTES} bytes, got {len(data)}")
+        values = np.frombuffer(data, dtype='<f4')
+    return ControllerData(
+        leftController=_decode_controller(values[:CONTROLLER_FLOATS]),
+        rightController=_decode_controller(values[CONTROLLER_FLOATS:]),
+    )
+
+
+def encode_controller_frame(controller_data: ControllerData) -> bytes:
+    """
+    Encode controller data into a packed binary frame, the inverse of decode_controller_frame.
+
+    Args:
+        controller_data: The controller data.
+
+    Returns:
+        FRAME_BYTES bytes of little-endian float32 values.
+    """
+    values = np.empty(FRAME_FLOATS, dtype='<f4')
+    pack_controller_frame(controller_data, values)
+    return values.tobytes()
+
+
+def pack_controller_frame(controller_data: ControllerData, out: np.ndarray) -> np.ndarray:
+    """
+    Pack controller data into a preallocated frame array, without intermediate bytes.
+
+    Args:
+        controller_data: The controller data.
+        out: float32 array of FRAME_FLOATS values, e.g. a row of a recording chunk.
+
+    Returns:
+        out.
+    """
+    out[:] = 0.
+    _encode_controller(controller_data.leftController, out[:CONTROLLER_FLOATS])
+    _encode_controller(controller_data.rightController, out[CONTROLLER_FLOATS:])
+    return out
+
+
+def decode_controller_json(message: str) -> ControllerData:
+    """
+    Decode a JSON controller message.
+
+    Args:
+        message: JSON with leftController and rightController objects
+            holding pose (16 column-major values), buttons and axes.
+
+    Returns:
+        The controller data.
+    """
+    parsed_data = json.loads(message)
+    return ControllerData(
+        leftController=Controller(
+            pose=Pose(np.array(parsed_data["leftController"]["pose"]).reshape(4, 4).T),
+            buttons=[Button(**btn) for btn in parsed_data["leftController"]["buttons"]],
+            axes=parsed_data["leftController"]["axes"]
+        ),
+        rightController=Controller(
+            pose=Pose(np.array(parsed_data["rightController"]["pose"]).reshape(4, 4).T),
+            buttons=[Button(**btn) for btn in parsed_data["rightController"]["buttons"]],
+            axes=parsed_data["rightController"]["axes"]
+        )
+    )
+
+
+def encode_link_header(link_names: List[str]) -> str:
+    """
+    Encode the link order used by following binary transform messages.
+
+    Args:
+        link_names: The link names in the order of the transforms.
+
+    Returns:
+        JSON text message.
+    """
+    return json.dumps({"links": link_names})
+
+
+def encode_transforms_binary(transforms: Dict[str, np.ndarray], link_names: List[str]) -> bytes:
+    """
+    Encode link transforms as a packed float32 (num_links, 4, 4) row-major array.
+
+    Args:
+        transforms: Link name to 4x4 transform mapping.
+        link_names: The link order announced with encode_link_header.
+
+    Returns:
+        num_links * 64 bytes of little-endian float32 values.
+    """
+    values = np.empty((len(link_names), 4, 4), dtype='<f4')
+    for ind, link_name in enumerate(link_names):
+        values[ind] = transforms[link_name]
+    return values.tobytes()
+
+
+def decode_transforms_binary(data: bytes, link_names: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Decode link transforms encoded with encode_transforms_binary.
+
+    Args:
+        data: Packed float32 transforms.
+        link_names: The announced link order.
+
+    Returns:
+        Link name to 4x4 transform mapping.
+    """
+    values = np.frombuffer(data, dtype='<f4').reshape(len(link_names), 4, 4)
+    return dict(zip(link_names, values))
+
+
+def encode_transforms_json(transforms: Dict[str, np.ndarray]) -> str:
+    """
+    Encode link transforms as JSON with nested 4x4 lists.
+
+    Args:
+        transforms: Link name to 4x4 transform mapping.
+
+    Returns:
+        JSON text message.
+    """
+    return json.dumps({key: val.tolist() for key, val in transforms.items()})
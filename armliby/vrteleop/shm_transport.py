@@ -0,0 +1,173 @@
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from armliby.vrteleop.protocol import FRAME_FLOATS
+
+
+# payload starts on its own cache line after the sequence counter
+_PAYLOAD_OFFSET = 64
+
+_CONTROLLER_DTYPE = np.dtype([('timestamp_ns', '<i8'), ('frame', '<f4', (FRAME_FLOATS,))])
+
+
+class SeqlockBuffer:
+    def __init__(
+            self,
+            shape: Tuple[int, ...],
+            dtype: np.dtype,
+            name: Optional[str] = None,
+            ) -> None:
+        """
+        Fixed-layout numpy array in shared memory guarded by a seqlock.
+
+        A single writer bumps the sequence counter to an odd value, writes the payload
+        and bumps it to the next even value. Readers copy the payload and retry
+        if the counter changed meanwhile, so they never block the writer.
+
+        Args:
+            shape: The payload array shape.
+            dtype: The payload array dtype.
+            name: Name of an existing buffer to attach to. A new one is created if None.
+        """
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        size = _PAYLOAD_OFFSET + int(np.prod(self._shape)) * self._dtype.itemsize
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._seq = np.ndarray((1,), dtype=np.uint64, buffer=self._shm.buf)
+        self._payload = np.ndarray(self._shape, dtype=self._dtype, buffer=self._shm.buf, offset=_PAYLOAD_OFFSET)
+        if self._owner:
+            self._seq[0] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def seq(self) -> int:
+        """Sequence number, even when no write is in progress, 0 before the first write."""
+        return int(self._seq[0])
+
+    def __getstate__(self):
+        # a process unpickling the buffer attaches to the same shared memory
+        return {'shape': self._shape, 'dtype': self._dtype, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(shape=state['shape'], dtype=state['dtype'], name=state['name'])
+
+    def write(self, values: np.ndarray) -> None:
+        """Write the payload. Must be called from a single writer only."""
+        seq = self._seq[0]
+        self._seq[0] = seq + 1
+        self._payload[...] = values
+        self._seq[0] = seq + 2
+
+    def read(self, out: Optional[np.ndarray] = None) -> Tuple[int, np.ndarray]:
+        """
+        Read a consistent copy of the payload.
+
+        Args:
+            out: Optional preallocated array to copy the payload into.
+
+        Returns:
+            The sequence number of the copy and the copy.
+        """
+        if out is None:
+            out = np.empty(self._shape, dtype=self._dtype)
+        while True:
+            seq = self._seq[0]
+            if seq % 2 == 1:
+                # writer is in the middle of an update
+                time.sleep(0)
+                continue
+            out[...] = self._payload
+            if self._seq[0] == seq:
+                return int(seq), out
+
+    def close(self) -> None:
+        self._seq = None
+        self._payload = None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Free the shared memory. Call from the creating process once all users are done."""
+        self._shm.unlink()
+
+
+class SharedMemoryTransport:
+    def __init__(self, max_links: int = 64) -> None:
+        """
+        Zero-copy exchange of controller frames and link transforms between
+        the websocket process and the control process.
+
+        Controller frames use the packed binary protocol layout (FRAME_FLOATS float32)
+        and carry the receive timestamp, transforms are a float32 (max_links, 4, 4) array. Both sides always see the
+        newest written value, older ones are overwritten.
+
+        Args:
+            max_links: Maximum number of link transforms.
+        """
+        self.max_links = max_links
+        self._controller = SeqlockBuffer((), _CONTROLLER_DTYPE)
+        self._transforms = SeqlockBuffer((max_links, 4, 4), np.float32)
+        self._controller_seq = 0
+        self._transforms_seq = 0
+        self._frame = np.empty((), dtype=_CONTROLLER_DTYPE)
+        self._frame_in = np.empty((), dtype=_CONTROLLER_DTYPE)
+        # timestamp of the frame returned by the last read_controller_frame
+        self.controller_timestamp_ns = 0
+        self._transforms_buf = np.empty((max_links, 4, 4), dtype=np.float32)
+        self._transforms_out = np.zeros((max_links, 4, 4), dtype=np.float32)
+
+    def write_controller_frame(self, frame: np.ndarray, timestamp_ns: int = 0) -> None:
+        """Publish a controller frame received at timestamp_ns. Websocket process side."""
+        self._frame_in['timestamp_ns'] = timestamp_ns
+        self._frame_in['frame'] = frame
+        self._controller.write(self._frame_in)
+
+    def read_controller_frame(self) -> Optional[np.ndarray]:
+        """
+        Read the newest controller frame. Control process side.
+
+        Returns:
+            The frame, or None if nothing new was written since the previous call.
+            The returned array is reused by the next call.
+        """
+        if self._controller.seq == self._controller_seq:
+            return None
+        self._controller_seq, frame = self._controller.read(out=self._frame)
+        self.controller_timestamp_ns = int(frame['timestamp_ns'])
+        return frame['frame']
+
+    def write_transforms(self, transforms: Dict[str, np.ndarray], link_names: List[str]) -> None:
+        """Publish link transforms in link_names order. Control process side."""
+        if len(link_names) > self.max_links:
+            raise ValueError(f"Got {len(link_names)} links, the transport holds at most {self.max_links}")
+        for ind, link_name in enumerate(link_names):
+            self._transforms_out[ind] = transforms[link_name]
+        self._transforms.write(self._transforms_out)
+
+    def read_transforms(self, link_names: List[str]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Read the newest link transforms. Websocket process side.
+
+        Args:
+            link_names: The link order used by the writer.
+
+        Returns:
+            Link name to 4x4 transform mapping, or None if nothing new was written.
+        """
+        if self._transforms.seq == self._transforms_seq:
+            return None
+        self._transforms_seq, values = self._transforms.read(out=self._transforms_buf)
+        return dict(zip(link_names, values[:len(link_names)].copy()))
+
+    def close(self) -> None:
+        self._controller.close()
+        self._transforms.close()
+
+    def unlink(self) -> None:
+        self._controller.unlink()
+        self._transforms.unlink()
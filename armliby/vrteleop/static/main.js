@@ -55,6 +55,16 @@ AFRAME.registerComponent('coordinate-frame', {
   }
 });
 
+// Streams controller poses every rendered frame in non-blocking mode
+AFRAME.registerComponent('pose-sender', {
+  tick: function () {
+    if (NON_BLOCKING && leftController && rightController) {
+      setPose(rightControllerFrame, rightController.object3D.matrix.clone().premultiply(TO_CANONICAL));
+      sendControllerPose(leftController, rightController);
+    }
+  }
+});
+
 // Load bodies and their STL files
 function loadBodies() {
   fetch('/bodies')
@@ -103,13 +113,48 @@ function setPose(entity, matrix) {
   entity.object3D.scale.copy(scale);
 }
 
+// Binary protocol: packed float32 controller frames and transform replies
+const BINARY_SUBPROTOCOL = 'armliby.binary.v1';
+const MAX_BUTTONS = 8;
+const MAX_AXES = 4;
+const CONTROLLER_FLOATS = 16 + 1 + 2 * MAX_BUTTONS + 1 + MAX_AXES;
+const controllerFrame = new Float32Array(2 * CONTROLLER_FLOATS);
+let useBinary = false;
+let linkOrder = [];
+const ROLE = new URLSearchParams(window.location.search).get('role') || 'operator';
+
+function applyPose(bodyName, matrix) {
+  // Find the corresponding A-Frame entity by body name
+  const bodyEntity = document.querySelector(`[id="${bodyName}"]`);
+  if (bodyEntity) {
+    // Apply the 4x4 transformation matrix to the entity
+    var position = new THREE.Vector3();
+    var quaternion = new THREE.Quaternion();
+    var scale = new THREE.Vector3();
+
+    // matrices come row-major, THREE.js expects column-major
+    matrix.transpose().decompose(position, quaternion, scale);
+
+    // Update the entity’s position, rotation, and scale
+    bodyEntity.object3D.position.copy(position.add(INITIAL_SHIFT));
+    bodyEntity.object3D.quaternion.copy(quaternion);
+    bodyEntity.object3D.scale.copy(scale);
+  }
+}
+
 // Initialize WebSocket connection
 function initWebSocket() {
-  socket = new WebSocket('wss://' + WSS_HOST + ':' + WSS_PORT); // Change to your server address
+  // Change to your server address
+  // open the page with ?role=observer to only watch the robot
+  const url = 'wss://' + WSS_HOST + ':' + WSS_PORT + '?role=' + ROLE;
+  socket = BINARY_PROTOCOL ? new WebSocket(url, [BINARY_SUBPROTOCOL]) : new WebSocket(url);
+  socket.binaryType = 'arraybuffer';
 
   socket.onopen = function() {
-    console.log('WebSocket connection established');
-    if (leftController && rightController) {
+    // the server may not support the binary protocol, fall back to JSON then
+    useBinary = socket.protocol === BINARY_SUBPROTOCOL;
+    console.log('WebSocket connection established, binary protocol: ' + useBinary);
+    if (!NON_BLOCKING && leftController && rightController) {
       sendControllerPose(leftController, rightController);
     }
 };
@@ -117,34 +162,29 @@ function initWebSocket() {
   socket.onmessage = function(event) {
     // console.log('Message from server:', event.data);
 
-    // Parse the incoming message
-    const poses = JSON.parse(event.data);
-
-    // Loop through each body in the poses
-    Object.keys(poses).forEach(bodyName => {
-      const poseMatrix = poses[bodyName];  // This is the 4x4 matrix for the current body
-
-      // Find the corresponding A-Frame entity by body name
-      const bodyEntity = document.querySelector(`[id="${bodyName}"]`);
-      if (bodyEntity) {
-        // Apply the 4x4 transformation matrix to the entity
-        var position = new THREE.Vector3();
-        var quaternion = new THREE.Quaternion();
-        var scale = new THREE.Vector3();
-
-        // Flatten the 4x4 matrix and use THREE.js to decompose it
-        const matrix = new THREE2.Matrix4().fromArray(poseMatrix.flat());
-        // const matrix = new THREE2.Matrix4().multiplyMatrices(TO_VR_FRAME, matrix_teleop);
-        matrix.transpose().decompose(position, quaternion, scale);
-
-        // Update the entity’s position, rotation, and scale
-        bodyEntity.object3D.position.copy(position.add(INITIAL_SHIFT));
-        bodyEntity.object3D.quaternion.copy(quaternion);
-        bodyEntity.object3D.scale.copy(scale);
+    if (useBinary) {
+      if (typeof event.data === 'string') {
+        // link order header, sent once before the binary transforms
+        linkOrder = JSON.parse(event.data).links;
+        return;
       }
-    });
+      const transforms = new Float32Array(event.data);
+      linkOrder.forEach((bodyName, ind) => {
+        applyPose(bodyName, new THREE2.Matrix4().fromArray(transforms, ind * 16));
+      });
+    } else {
+      // Parse the incoming message
+      const poses = JSON.parse(event.data);
+
+      // Loop through each body in the poses
+      Object.keys(poses).forEach(bodyName => {
+        const poseMatrix = poses[bodyName];  // This is the 4x4 matrix for the current body
+        applyPose(bodyName, new THREE2.Matrix4().fromArray(poseMatrix.flat()));
+      });
+    }
 
-    if (leftController && rightController) {
+    // in request/reply mode the next controller frame is sent once the reply arrives
+    if (!NON_BLOCKING && leftController && rightController) {
       setPose(rightControllerFrame, rightController.object3D.matrix.clone().premultiply(TO_CANONICAL));
       sendControllerPose(leftController, rightController);
     }
@@ -184,6 +224,21 @@ function getControllerData(controller) {
   return data;
 }
 
+// Pack controller data into the binary frame layout
+function packControllerData(data, offset) {
+  controllerFrame.fill(0, offset, offset + CONTROLLER_FLOATS);
+  controllerFrame.set(data.pose, offset);
+  const buttons = data.buttons.slice(0, MAX_BUTTONS);
+  const axes = Array.from(data.axes).slice(0, MAX_AXES);
+  controllerFrame[offset + 16] = buttons.length;
+  buttons.forEach((button, ind) => {
+    controllerFrame[offset + 17 + ind] = button.pressed ? 1 : 0;
+    controllerFrame[offset + 17 + MAX_BUTTONS + ind] = button.value;
+  });
+  controllerFrame[offset + 17 + 2 * MAX_BUTTONS] = axes.length;
+  controllerFrame.set(axes, offset + 18 + 2 * MAX_BUTTONS);
+}
+
 // Send controller pose data
 function sendControllerPose(leftController, rightController) {
   const controllersData = {
@@ -191,12 +246,20 @@ function sendControllerPose(leftController, rightController) {
     rightController: getControllerData(rightController),
   };
 
-  if (socket && socket.readyState === WebSocket.OPEN) {
-    socket.send(JSON.stringify(controllersData));
+  if (socket && socket.readyState === WebSocket.OPEN && ROLE !== 'observer') {
+    if (useBinary) {
+      packControllerData(controllersData.leftController, 0);
+      packControllerData(controllersData.rightController, CONTROLLER_FLOATS);
+      socket.send(controllerFrame);
+    } else {
+      socket.send(JSON.stringify(controllersData));
+    }
   }
 }
 
 window.onload = function () {
+  // the component is registered after the scene is parsed, attach it explicitly
+  document.getElementById('poseSender').setAttribute('pose-sender', '');
   initWebSocket();
   loadBodies();
 };
@@ -0,0 +1,148 @@
+import hashlib
+import http
+import json
+import mimetypes
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+from armliby.mesh_cache import MeshCache
+from armliby.robot_model import file_hash
+from armliby.urdf_parser import URDFParser
+from jinja2 import Environment, FileSystemLoader
+
+
+_MODULE_FOLDER = os.path.dirname(__file__)
+TEMPLATES_FOLDER = os.path.join(_MODULE_FOLDER, 'templates')
+STATIC_FOLDER = os.path.join(_MODULE_FOLDER, 'static')
+
+# headsets may reuse meshes for this long before revalidating them with the ETag
+STL_MAX_AGE = 3600
+
+
+def load_stl_files(urdf_parser: URDFParser, urdf_path: str) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Build the link to per level of detail (mesh path, ETag) table once.
+    Meshes are converted to cached binary STL levels of detail on first run.
+
+    Args:
+        urdf_parser: The parser of the URDF file.
+        urdf_path: The path to the URDF file.
+
+    Returns:
+        Link name to a list of (absolute binary STL path, ETag) indexed by level of detail.
+    """
+    mesh_cache = MeshCache(urdf_path)
+    stl_files = {}
+    for link_name, stl_file_path in urdf_parser.get_link_stl_map().items():
+        if not os.path.isfile(stl_file_path):
+            print(f"Warning: STL file {stl_file_path} of link {link_name} not found.")
+            continue
+        stl_lods = []
+        for lod in range(mesh_cache.num_lods):
+            # absolute, so the paths stay valid if the working directory changes
+            lod_path = os.path.abspath(mesh_cache.get_stl_path(stl_file_path, lod))
+            stl_lods.append((lod_path, file_hash(lod_path)))
+        stl_files[link_name] = stl_lods
+    return stl_files
+
+
+class StaticResponse(NamedTuple):
+    body: bytes
+    content_type: str
+    etag: str
+    max_age: Optional[int]
+
+
+def _static_response(body: bytes, content_type: str, max_age: Optional[int] = None) -> StaticResponse:
+    return StaticResponse(
+        body=body,
+        content_type=content_type,
+        etag='"' + hashlib.sha256(body).hexdigest() + '"',
+        max_age=max_age,
+    )
+
+
+class StaticSite:
+    def __init__(
+            self,
+            urdf_path: str,
+            wss_host: str,
+            wss_port: int,
+            binary_protocol: bool = False,
+            non_blocking: bool = False,
+            mesh_lod: int = 0,
+            ):
+        """
+        In-memory copy of the VR teleop web page, link list and meshes.
+
+        Everything is rendered and read once, so requests are answered from memory
+        without touching the disk or the template engine. Used to serve the page
+        from the websocket server port, see VRWebsocketServer(site=...).
+        That port closes the connection after every response, there is no HTTP keep-alive.
+
+        Args:
+            urdf_path: The path to the URDF file.
+            wss_host: The websocket host the page connects to.
+            wss_port: The websocket port the page connects to.
+            binary_protocol: Make the web page talk the packed binary websocket protocol.
+            non_blocking: Make the web page stream controller frames every rendered frame.
+            mesh_lod: Default level of detail of the served meshes, see MeshCache.
+                A request may pick another one with /stl/<link>.stl?lod=<level>.
+        """
+        self._mesh_lod = mesh_lod
+        self._responses: Dict[str, StaticResponse] = {}
+        self._stl_responses: Dict[str, List[StaticResponse]] = {}
+
+        template = Environment(loader=FileSystemLoader(TEMPLATES_FOLDER)).get_template('index.html')
+        page = template.render(
+            wss_host=wss_host,
+            wss_port=wss_port,
+            binary_protocol=binary_protocol,
+            non_blocking=non_blocking,
+        )
+        self._responses['/'] = _static_response(page.encode(), 'text/html; charset=utf-8')
+
+        urdf_parser = URDFParser(urdf_path)
+        self._responses['/bodies'] = _static_response(
+            json.dumps(urdf_parser.get_links()).encode(), 'application/json')
+
+        for filename in os.listdir(STATIC_FOLDER):
+            with open(os.path.join(STATIC_FOLDER, filename), 'rb') as f:
+                content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                self._responses['/' + filename] = _static_response(f.read(), content_type)
+
+        for link_name, stl_lods in load_stl_files(urdf_parser, urdf_path).items():
+            responses = []
+            for stl_file_path, _ in stl_lods:
+                with open(stl_file_path, 'rb') as f:
+                    responses.append(_static_response(f.read(), 'model/stl', STL_MAX_AGE))
+            self._stl_responses[link_name] = responses
+
+    def get(self, path: str) -> Tuple[http.HTTPStatus, Optional[StaticResponse]]:
+        """
+        Look up the response to a GET request.
+
+        Args:
+            path: The request path with the query string.
+
+        Returns:
+            The status and the response, None if the status is not OK.
+        """
+        url = urlparse(path)
+        url_path = unquote(url.path)
+        if url_path in self._responses:
+            return http.HTTPStatus.OK, self._responses[url_path]
+
+        if url_path.startswith('/stl/') and url_path.endswith('.stl'):
+            stl_lods = self._stl_responses.get(url_path[len('/stl/'):-len('.stl')])
+            if stl_lods is not None:
+                lod = parse_qs(url.query).get('lod', [None])[0]
+                try:
+                    lod = self._mesh_lod if lod is None else int(lod)
+                except ValueError:
+                    return http.HTTPStatus.BAD_REQUEST, None
+                if 0 <= lod < len(stl_lods):
+                    return http.HTTPStatus.OK, stl_lods[lod]
+
+        return http.HTTPStatus.NOT_FOUND, None
@@ -0,0 +1,131 @@
+from typing import Optional
+
+import numpy as np
+from armliby.collision import SelfCollisionChecker
+from armliby.ik import Kinematics
+from armliby.obstacle_map import ObstacleMap
+from armliby.reachability import ReachabilityIndex
+from armliby.tracing import get_tracer
+from armliby.vrteleop.controller_buffer import ControllerDataView
+from armliby.vrteleop.controller_data import Pose
+
+
+class TeleopIK:
+    def __init__(
+            self,
+            kinematics: Kinematics,
+            collision_checker: Optional[SelfCollisionChecker] = None,
+            obstacle_map: Optional[ObstacleMap] = None,
+            obstacle_clearance: float = 0.01,
+            reachability: Optional[ReachabilityIndex] = None,
+            verbose: bool = False,
+            ) -> None:
+        """
+        Per tick teleoperation step: right controller motion to an arm joint command.
+
+        Shared by the live and the replay examples, so replayed sessions go through
+        exactly the same reachability projection, IK and collision checks.
+        The joint after the arm joints is the gripper, driven by the trigger (button 0).
+
+        Args:
+            kinematics: Arm kinematics, the end link follows the controller.
+            collision_checker: Commands with colliding links are skipped. Its kinematics
+                must cover the arm and gripper joints.
+            obstacle_map: Commands bringing link spheres closer than obstacle_clearance
+                to obstacles are skipped. Requires collision_checker.
+            obstacle_clearance: In meters.
+            reachability: End link targets outside the reachable set are moved to the nearest reachable voxel.
+            verbose: Print joint deltas.
+        """
+        if obstacle_map is not None and collision_checker is None:
+            raise ValueError("obstacle_map requires collision_checker for the link spheres")
+        self.kinematics = kinematics
+        self.collision_checker = collision_checker
+        self.obstacle_map = obstacle_map
+        self.obstacle_clearance = obstacle_clearance
+        self.reachability = reachability
+        self.verbose = verbose
+        # reused by every tick instead of allocating a new pose
+        self._diff_pose = Pose(np.eye(4))
+        self._tracer = get_tracer()
+
+    def step(
+            self,
+            prev_controller_data: ControllerDataView,
+            controller_data: ControllerDataView,
+            cur_joints: np.ndarray,
+            ) -> Optional[np.ndarray]:
+        """
+        Compute the joint command of one tick.
+
+        Args:
+            prev_controller_data: Controller sample of the previous tick.
+            controller_data: Current controller sample.
+            cur_joints: Current arm and gripper joint positions. In radians.
+
+        Returns:
+            The joint command, None if B is not pressed or the command was skipped because of collisions.
+        """
+        if not (
+            len(controller_data.rightController.buttons) > 4 and
+            controller_data.rightController.buttons[5].pressed  # B pressed
+        ):
+            return None
+
+        tracer = self._tracer
+        num_dof = self.kinematics.num_dof
+
+        # calculate the difference between current and previous controller pose
+        self._diff_pose = diff_pose = prev_controller_data.rightController.pose.diff_to(
+            controller_data.rightController.pose, out=self._diff_pose)
+        rotvec = diff_pose.rotvec()  # in radians
+
+        # calculate the cartesian delta to move the robot
+        dx = np.array([
+            diff_pose.x,
+            diff_pose.y,
+            diff_pose.z,
+            rotvec.x,
+            rotvec.y,
+            rotvec.z,
+        ])
+
+        cur_joints = np.array(cur_joints, dtype=np.float64)
+
+        # keep the target inside the reachable workspace instead of
+        # driving the arm into the workspace boundary singularities
+        if self.reachability is not None:
+            with tracer.span('reachability'):
+                cur_pos = self.kinematics.fk(
+                    cur_joints[:num_dof], end_only=True)[self.kinematics.end_link_name][:3, 3]
+                target = cur_pos + dx[:3]
+                if not self.reachability.is_reachable(target):
+                    dx[:3] = self.reachability.project(target) - cur_pos
+
+        # calculate the joint deltas to achieve the cartesian delta
+        # dj uses damped least squares, so deltas stay within |dx| / max_damping near singularities
+        with tracer.span('dj'):
+            djoints = self.kinematics.dj(
+                js=cur_joints[:num_dof],
+                dx=dx,
+            )
+
+        if self.verbose:
+            print(f'--- dj {djoints}')
+
+        # update the joint positions
+        cur_joints[:num_dof] += djoints
+        cur_joints[num_dof] = np.pi * 0.25 * (1 - controller_data.rightController.buttons[0].value)
+
+        if self.collision_checker is not None:
+            with tracer.span('self_collision'):
+                link_poses, _ = self.collision_checker.kinematics.fk_batch(cur_joints)
+                colliding = self.collision_checker.in_collision_from_poses(link_poses[0])
+                if self.obstacle_map is not None and not colliding:
+                    centers, radii = self.collision_checker.world_spheres(link_poses[0])
+                    colliding = self.obstacle_map.sphere_clearance(centers, radii).min() < self.obstacle_clearance
+            if colliding:
+                print("Warning: command skipped, links would collide")
+                return None
+
+        return cur_joints
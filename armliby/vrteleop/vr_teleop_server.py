@@ -1,8 +1,8 @@
-import os
 from multiprocessing import Process
 
 from armliby.urdf_parser import URDFParser
-from flask import Flask, jsonify, render_template, send_from_directory
+from armliby.vrteleop.static_site import STL_MAX_AGE, load_stl_files
+from flask import Flask, jsonify, render_template, request, send_file, send_from_directory
 
 
 class VRTeleopServer:
@@ -13,7 +13,10 @@ class VRTeleopServer:
             wss_port: int,
             urdf_path: str,
             ssl_cert: str,
-            ssl_key: str
+            ssl_key: str,
+            binary_protocol: bool = False,
+            non_blocking: bool = False,
+            mesh_lod: int = 0,
             ):
         """
         Initialize the VR teleop server.
@@ -26,6 +29,12 @@ class VRTeleopServer:
             ssl_cert: The path to the SSL certificate file.
                 Create using openssl req -x509 -newkey rsa:4096 -keyout key.pem -out cert.pem -days 365 -nodes
             ssl_key: The path to the SSL key file.
+            binary_protocol: Make the web page talk the packed binary websocket protocol
+                instead of JSON.
+            non_blocking: Make the web page stream controller frames every rendered frame
+                instead of waiting for a reply. Use with VRWebsocketServer(non_blocking=True).
+            mesh_lod: Level of detail of the served meshes, 0 is the full mesh, see MeshCache.
+                A request may pick another one with /stl/<link>.stl?lod=<level>.
         """
         self._host = host
         self._wss_port = wss_port
@@ -33,20 +42,38 @@ class VRTeleopServer:
         self._urdf_path = urdf_path
         self._ssl_cert = ssl_cert
         self._ssl_key = ssl_key
+        self._binary_protocol = binary_protocol
+        self._non_blocking = non_blocking
+        self._mesh_lod = mesh_lod
 
     def _setup_routes(self):
         @self._app.route('/')
         def home():
-            return render_template('index.html', wss_host=self._host, wss_port=self._wss_port)
+            return render_template(
+                'index.html',
+                wss_host=self._host,
+                wss_port=self._wss_port,
+                binary_protocol=self._binary_protocol,
+                non_blocking=self._non_blocking,
+            )
 
         @self._app.route('/stl/<link_name>.stl')
         def serve_stl(link_name):
-            stl_mapping = self._urdf_parser.get_link_stl_map()
-            stl_file_path = stl_mapping.get(link_name)
-            if stl_file_path and os.path.exists(stl_file_path):
-                return send_from_directory(os.path.dirname(stl_file_path), os.path.basename(stl_file_path))
-            else:
+            stl_lods = self._stl_files.get(link_name)
+            if stl_lods is None:
                 return f"STL file not found for the link name: {link_name}", 404
+            lod = request.args.get('lod', default=self._mesh_lod, type=int)
+            if not 0 <= lod < len(stl_lods):
+                return f"Level of detail must be in [0, {len(stl_lods)}), got {lod}", 404
+            stl_file_path, etag = stl_lods[lod]
+            # strong ETag lets reloads revalidate with a 304 instead of re-downloading
+            return send_file(
+                stl_file_path,
+                mimetype='model/stl',
+                etag=etag,
+                conditional=True,
+                max_age=STL_MAX_AGE,
+            )
 
         @self._app.route('/bodies')
         def bodies():
@@ -59,6 +86,7 @@ class VRTeleopServer:
 
     def _run_app(self):
         self._urdf_parser = URDFParser(self._urdf_path)
+        self._stl_files = load_stl_files(self._urdf_parser, self._urdf_path)
         self._app = Flask(__name__)
 
         # Initialize Flask routes
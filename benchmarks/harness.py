@@ -0,0 +1,149 @@
+import gc
+import json
+import platform
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class Benchmark:
+    def __init__(
+            self,
+            name: str,
+            func: Callable[[], object],
+            batch: int = 1,
+            ) -> None:
+        """
+        A timed operation.
+
+        Args:
+            name: Unique benchmark name, used to match results with the baseline.
+            func: The operation, called without arguments. Setup must happen outside.
+            batch: Number of items (configurations, messages) one call processes,
+                used to report throughput.
+        """
+        self.name = name
+        self.func = func
+        self.batch = batch
+
+
+def _time_calls(func: Callable[[], object], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def run_benchmark(bench: Benchmark, min_time: float = 0.2, repeats: int = 5) -> Dict[str, float]:
+    """
+    Time a benchmark.
+
+    The number of calls per round is calibrated to last about min_time,
+    the reported time is the median over rounds. Peak memory is measured
+    with tracemalloc in a separate call, so tracing does not slow down the timed rounds.
+
+    Args:
+        bench: The benchmark.
+        min_time: Approximate duration of one round, seconds.
+        repeats: Number of timed rounds.
+
+    Returns:
+        Result with us_per_op, items_per_s, peak_memory_kb and rounds timing details.
+    """
+    # warm up caches and lazy initialization
+    bench.func()
+
+    number = 1
+    while True:
+        elapsed = _time_calls(bench.func, number)
+        if elapsed >= min_time / 10 or number >= 10 ** 6:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rounds = [_time_calls(bench.func, number) / number for _ in range(repeats)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        bench.func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = float(np.median(rounds))
+    return {
+        'us_per_op': median * 1e6,
+        'min_us_per_op': float(np.min(rounds)) * 1e6,
+        'items_per_s': bench.batch / median,
+        'batch': bench.batch,
+        'peak_memory_kb': peak / 1024,
+        'calls_per_round': number,
+        'rounds': repeats,
+    }
+
+
+def environment_info() -> Dict[str, str]:
+    """Machine and library versions stored with the results, to tell incomparable runs apart."""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'system': platform.platform(),
+    }
+
+
+def save_results(path: str, results: Dict[str, Dict[str, float]]) -> None:
+    with open(path, 'w') as f:
+        json.dump({'environment': environment_info(), 'results': results}, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict[str, Dict[str, float]]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare_results(
+        results: Dict[str, Dict[str, float]],
+        baseline: Dict[str, Dict[str, float]],
+        threshold: float,
+        ) -> List[str]:
+    """
+    Compare results with a baseline and print a table.
+
+    Args:
+        results: Current results.
+        baseline: Baseline results. Benchmarks missing from results count as failures.
+        threshold: Relative slowdown of us_per_op regarded as a regression, e.g. 0.2 for 20%.
+
+    Returns:
+        Names of regressed and missing benchmarks.
+    """
+    regressions = []
+    print(f"{'benchmark':40s} {'baseline us':>12s} {'current us':>12s} {'ratio':>7s}")
+    for name, result in results.items():
+        base: Optional[Dict[str, float]] = baseline.get(name)
+        if base is None:
+            print(f"{name:40s} {'-':>12s} {result['us_per_op']:12.2f}    new")
+            continue
+        ratio = result['us_per_op'] / base['us_per_op']
+        flag = ''
+        if ratio > 1. + threshold:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        elif ratio < 1. / (1. + threshold):
+            flag = ' faster'
+        print(f"{name:40s} {base['us_per_op']:12.2f} {result['us_per_op']:12.2f} {ratio:7.2f}{flag}")
+    for name, base in baseline.items():
+        if name not in results:
+            print(f"{name:40s} {base['us_per_op']:12.2f} {'-':>12s}    MISSING")
+            regressions.append(name)
+    return regressions
@@ -0,0 +1,271 @@
+"""
+Benchmarks of the kinematics, IK, collision, reachability and serialization hot paths on the bundled SO-ARM100 URDF.
+
+    python benchmarks/run_benchmarks.py --out results.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+
+Exits with status 1 if a benchmark is slower than the baseline by more than --threshold.
+"""
+import argparse
+import os
+import sys
+from typing import List
+
+import numpy as np
+from harness import Benchmark, compare_results, load_results, run_benchmark, save_results
+
+
+SCRIPT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_FOLDER))
+
+URDF_PATH = os.path.join(
+    SCRIPT_FOLDER, '../assets/SO_5DOF_ARM100_8j_URDF.SLDASM/SO_5DOF_ARM100_8j_URDF.SLDASM.urdf')
+END_LINK_NAME = "Fixed_Jaw"
+BATCH_SIZE = 1024
+SEED = 0
+
+
+def kinematics_benchmarks(backend: str) -> List[Benchmark]:
+    from armliby.ik import Kinematics
+
+    kinematics = Kinematics(
+        urdf_path=URDF_PATH,
+        end_link_name=END_LINK_NAME,
+        mod_matrix=np.eye(6)[:5],
+        backend=backend,
+    )
+    rng = np.random.default_rng(SEED)
+    js = rng.uniform(-1., 1., kinematics.num_dof)
+    js_batch = rng.uniform(-1., 1., (BATCH_SIZE, kinematics.num_dof))
+    js_batch2 = js_batch + rng.normal(0., 0.05, js_batch.shape)
+    dx = np.array([0.01, 0., 0.01, 0.02, 0., 0.])
+    targets, _ = kinematics.fk_batch(js_batch2[:64], end_only=True)
+    targets = targets[:, 0].astype(np.float64)
+
+    return [
+        Benchmark(f'{backend}/fk', lambda: kinematics.fk(js)),
+        Benchmark(f'{backend}/fk_end_only', lambda: kinematics.fk(js, end_only=True)),
+        Benchmark(f'{backend}/fk_batch', lambda: kinematics.fk_batch(js_batch), batch=BATCH_SIZE),
+        Benchmark(f'{backend}/dj', lambda: kinematics.dj(js, dx)),
+        Benchmark(f'{backend}/dx', lambda: kinematics.dx(js, js_batch2[0])),
+        Benchmark(f'{backend}/dx_batch', lambda: kinematics.dx(js_batch, js_batch2), batch=BATCH_SIZE),
+        Benchmark(
+            f'{backend}/ik_batch',
+            lambda: kinematics.ik_batch(targets, js_batch[:64], max_iters=20),
+            batch=64,
+        ),
+    ]
+
+
+def joint_limits_benchmarks() -> List[Benchmark]:
+    from armliby.robot.joint_limits import JointLimits
+
+    joint_limits = JointLimits.from_urdf(urdf_path=URDF_PATH, skip_joints=[0])
+    rng = np.random.default_rng(SEED)
+    joints = rng.uniform(-180., 180., len(joint_limits.lower))
+    joints_batch = rng.uniform(-180., 180., (BATCH_SIZE, len(joint_limits.lower)))
+    return [
+        Benchmark('joint_limits/process', lambda: joint_limits.process(joints)),
+        Benchmark('joint_limits/process_batch', lambda: joint_limits.process(joints_batch), batch=BATCH_SIZE),
+    ]
+
+
+def protocol_benchmarks() -> List[Benchmark]:
+    from armliby.ik import BACKEND_NUMPY, Kinematics
+    from armliby.vrteleop.controller_data import Button, Controller, ControllerData, Pose
+    from armliby.vrteleop.protocol import (
+        decode_controller_frame,
+        decode_controller_json,
+        decode_transforms_binary,
+        encode_controller_frame,
+        encode_transforms_binary,
+        encode_transforms_json,
+    )
+
+    rng = np.random.default_rng(SEED)
+
+    def controller() -> Controller:
+        pose = np.eye(4)
+        pose[:3, 3] = rng.normal(size=3)
+        return Controller(
+            pose=Pose(pose),
+            buttons=[Button(pressed=bool(ind % 2), value=float(ind % 2)) for ind in range(7)],
+            axes=rng.normal(size=4).tolist(),
+        )
+
+    controller_data = ControllerData(leftController=controller(), rightController=controller())
+    frame = encode_controller_frame(controller_data)
+    # message as sent by the web page
+    json_message = (
+        '{"leftController": {"pose": ' + str(controller_data.leftController.pose.matrix4.T.reshape(-1).tolist())
+        + ', "buttons": [' + ', '.join('{"pressed": true, "value": 1.0}' for _ in range(7))
+        + '], "axes": [0, 0, 0.5, 0.5]}, "rightController": {"pose": '
+        + str(controller_data.rightController.pose.matrix4.T.reshape(-1).tolist())
+        + ', "buttons": [' + ', '.join('{"pressed": false, "value": 0.0}' for _ in range(7))
+        + '], "axes": [0, 0, 0.5, 0.5]}}'
+    )
+
+    kinematics = Kinematics(urdf_path=URDF_PATH, end_link_name=END_LINK_NAME, backend=BACKEND_NUMPY)
+    transforms = kinematics.fk(np.zeros(kinematics.num_dof))
+    link_names = list(transforms.keys())
+    transforms_binary = encode_transforms_binary(transforms, link_names)
+
+    return [
+        Benchmark('protocol/decode_controller_json', lambda: decode_controller_json(json_message)),
+        Benchmark('protocol/decode_controller_frame', lambda: decode_controller_frame(frame)),
+        Benchmark('protocol/encode_controller_frame', lambda: encode_controller_frame(controller_data)),
+        Benchmark('protocol/encode_transforms_json', lambda: encode_transforms_json(transforms)),
+        Benchmark('protocol/encode_transforms_binary', lambda: encode_transforms_binary(transforms, link_names)),
+        Benchmark(
+            'protocol/decode_transforms_binary',
+            lambda: decode_transforms_binary(transforms_binary, link_names),
+        ),
+        Benchmark(
+            'protocol/round_trip_binary',
+            lambda: decode_transforms_binary(
+                encode_transforms_binary(transforms, link_names), link_names),
+        ),
+    ]
+
+
+def collision_benchmarks() -> List[Benchmark]:
+    from armliby.collision import SelfCollisionChecker
+    from armliby.ik import BACKEND_NUMPY, Kinematics
+    from armliby.obstacle_map import ObstacleMap
+
+    checker = SelfCollisionChecker(
+        urdf_path=URDF_PATH,
+        kinematics=Kinematics(urdf_path=URDF_PATH, end_link_name="Moving Jaw", backend=BACKEND_NUMPY),
+    )
+    rng = np.random.default_rng(SEED)
+    js_batch = rng.uniform(-1., 1., (BATCH_SIZE, checker.kinematics.num_dof))
+    poses, _ = checker.kinematics.fk_batch(js_batch)
+    centers, radii = checker.world_spheres(poses)
+
+    # table top below the arm
+    obstacle_map = ObstacleMap(origin=(-0.5, -0.5, -0.2), voxel_size=0.01, shape=(100, 100, 80))
+    obstacle_map.add_box((-0.5, -0.5, -0.2), (0.5, 0.5, -0.02))
+    obstacle_map.update()
+    return [
+        Benchmark('collision/in_collision', lambda: checker.in_collision(js_batch[0])),
+        Benchmark('collision/in_collision_from_poses', lambda: checker.in_collision_from_poses(poses[0])),
+        Benchmark('collision/distance_from_poses', lambda: checker.distance_from_poses(poses[0])),
+        Benchmark('collision/in_collision_batch', lambda: checker.in_collision(js_batch), batch=BATCH_SIZE),
+        Benchmark('collision/min_distance_batch', lambda: checker.min_distance(js_batch), batch=BATCH_SIZE),
+        Benchmark('collision/obstacle_clearance', lambda: obstacle_map.sphere_clearance(centers[0], radii)),
+        Benchmark(
+            'collision/obstacle_clearance_batch',
+            lambda: obstacle_map.sphere_clearance(centers, radii),
+            batch=BATCH_SIZE,
+        ),
+        Benchmark('collision/obstacle_map_update', lambda: (
+            obstacle_map.add_points([[0.1, 0.1, 0.1]]), obstacle_map.update())),
+    ]
+
+
+def reachability_benchmarks() -> List[Benchmark]:
+    from armliby.ik import BACKEND_NUMPY, Kinematics
+    from armliby.reachability import build_reachability_index
+    from armliby.robot.joint_limits import JointLimits
+
+    index = build_reachability_index(
+        kinematics=Kinematics(
+            urdf_path=URDF_PATH, end_link_name=END_LINK_NAME, mod_matrix=np.eye(6)[:5], backend=BACKEND_NUMPY),
+        joint_limits=JointLimits.from_urdf(urdf_path=URDF_PATH, skip_joints=[0]),
+        num_samples=2 ** 16,
+        seed=SEED,
+    )
+    rng = np.random.default_rng(SEED)
+    points = rng.uniform(-0.3, 0.3, (BATCH_SIZE, 3))
+    return [
+        Benchmark('reachability/is_reachable', lambda: index.is_reachable(points[0])),
+        Benchmark('reachability/lookup', lambda: index.lookup(points[0])),
+        Benchmark('reachability/project', lambda: index.project(points[0])),
+        Benchmark('reachability/project_batch', lambda: index.project(points), batch=BATCH_SIZE),
+    ]
+
+
+def visualization_benchmarks() -> List[Benchmark]:
+    from armliby.ik import Kinematics
+    from armliby.robot.virtual.open3d_robot_vis import RENDERER_OFFSCREEN, Open3dRobotVis
+
+    vis = Open3dRobotVis(
+        urdf_path=URDF_PATH,
+        kinematics=Kinematics(urdf_path=URDF_PATH, end_link_name="Moving Jaw"),
+        end_link_name=END_LINK_NAME,
+        skip_joints=[0],
+        renderer=RENDERER_OFFSCREEN,
+        width=640,
+        height=480,
+    )
+    vis.run()
+    js = np.zeros(vis.kinematics.num_dof)
+    return [
+        Benchmark('open3d/visualize_offscreen', lambda: vis.visualize(js)),
+        Benchmark('open3d/visualize_render_offscreen', lambda: (vis.visualize(js), vis.render_image())),
+    ]
+
+
+SUITES = {
+    'numpy': lambda: kinematics_benchmarks('numpy'),
+    'torch': lambda: kinematics_benchmarks('torch'),
+    'joint_limits': joint_limits_benchmarks,
+    'protocol': protocol_benchmarks,
+    'collision': collision_benchmarks,
+    'reachability': reachability_benchmarks,
+    'open3d': visualization_benchmarks,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=os.path.join(SCRIPT_FOLDER, 'results.json'), help='Results JSON path.')
+    parser.add_argument('--baseline', default=None, help='Baseline results JSON to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown regarded as a regression.')
+    parser.add_argument('--suites', nargs='*', default=list(SUITES.keys()), choices=list(SUITES.keys()))
+    parser.add_argument('--filter', default='', help='Run only benchmarks whose name contains this.')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Duration of one timed round, seconds.')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timed rounds.')
+    args = parser.parse_args()
+
+    results = {}
+    skipped_suites = []
+    for suite in args.suites:
+        try:
+            benchmarks = SUITES[suite]()
+        except ImportError as e:
+            # optional dependencies like open3d or pytorch_kinematics may be missing,
+            # any other error fails the run
+            print(f"Skipping suite {suite}: {e}")
+            skipped_suites.append(suite)
+            continue
+        for bench in benchmarks:
+            if args.filter not in bench.name:
+                continue
+            result = run_benchmark(bench, min_time=args.min_time, repeats=args.repeats)
+            results[bench.name] = result
+            print(
+                f"{bench.name:40s} {result['us_per_op']:10.2f} us/op "
+                f"{result['items_per_s']:12.0f} items/s {result['peak_memory_kb']:10.1f} KiB peak"
+            )
+
+    save_results(args.out, results)
+    print(f"Results saved to {args.out}")
+
+    if args.baseline is not None:
+        # benchmark names start with their suite name
+        run_suites = set(args.suites) - set(skipped_suites)
+        baseline = {
+            name: result for name, result in load_results(args.baseline).items()
+            if name.split('/')[0] in run_suites and args.filter in name
+        }
+        regressions = compare_results(results, baseline, args.threshold)
+        if skipped_suites:
+            print(f"Skipped suites, not compared: {', '.join(skipped_suites)}")
+        if regressions:
+            print(f"Regressions or missing benchmarks: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+from armliby.ik import BACKEND_NUMPY, Kinematics
+from armliby.reachability import (
+    DEFAULT_NUM_SAMPLES,
+    DEFAULT_VOXEL_SIZE,
+    build_reachability_index,
+    get_index_path,
+)
+from armliby.robot.joint_limits import JointLimits
+
+
+SCRIPT_FOLDER = os.path.dirname(__file__)
+
+URDF_PATH = os.path.realpath(os.path.join(SCRIPT_FOLDER, '../assets/SO_5DOF_ARM100_8j_URDF.SLDASM/SO_5DOF_ARM100_8j_URDF.SLDASM.urdf'))
+END_LINK_NAME = "Fixed_Jaw"
+VOXEL_SIZE = DEFAULT_VOXEL_SIZE
+NUM_SAMPLES = DEFAULT_NUM_SAMPLES
+# voxels reached only by configurations with lower manipulability are treated as unreachable
+MIN_MANIPULABILITY = 0.
+
+
+def main():
+
+    np.set_printoptions(suppress=True, precision=4)
+
+    # same kinematics as in try_vr_teleop.py, rotation over z is not controlled
+    kinematics = Kinematics(
+        urdf_path=URDF_PATH,
+        end_link_name=END_LINK_NAME,
+        mod_matrix=np.eye(6)[:5],
+        backend=BACKEND_NUMPY,
+    )
+    joint_limits = JointLimits.from_urdf(
+        urdf_path=URDF_PATH,
+        skip_joints=[0],
+    )
+
+    index = build_reachability_index(
+        kinematics=kinematics,
+        joint_limits=joint_limits,
+        voxel_size=VOXEL_SIZE,
+        num_samples=NUM_SAMPLES,
+        min_manipulability=MIN_MANIPULABILITY,
+        verbose=True,
+    )
+
+    reached = index.counts > 0
+    print(f'grid {index.shape}, origin {index.origin}, voxel size {index.voxel_size}')
+    print(f'reachable voxels {int(index.reachable.sum())} / {int(reached.sum())} reached')
+    print(f'workspace volume {index.reachable.sum() * index.voxel_size ** 3:.5f} m^3')
+    print(f'mean approach direction coverage {index.coverage_fraction[reached].mean():.3f}')
+    print(f'manipulability percentiles 5/50/95 {np.percentile(index.manipulability[reached], [5, 50, 95])}')
+
+    path = get_index_path(URDF_PATH, kinematics, joint_limits, VOXEL_SIZE, NUM_SAMPLES, MIN_MANIPULABILITY)
+    index.save(path)
+    print(f'saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+from typing import Optional
+
+import numpy as np
+from armliby.collision import SelfCollisionChecker
+from armliby.ik import BACKEND_NUMPY, Kinematics
+from armliby.obstacle_map import ObstacleMap
+from armliby.reachability import ReachabilityIndex, get_index_path
+from armliby.recording import SessionLog, replay
+from armliby.robot.joint_limits import JointLimits
+from armliby.robot.virtual.virtual_pos_robot import VirtualPosRobot
+from armliby.tracing import get_tracer
+from armliby.vrteleop.controller_buffer import ControllerDataView
+from armliby.vrteleop.teleop_ik import TeleopIK
+
+
+SCRIPT_FOLDER = os.path.dirname(__file__)
+
+URDF_PATH = os.path.realpath(os.path.join(SCRIPT_FOLDER, '../assets/SO_5DOF_ARM100_8j_URDF.SLDASM/SO_5DOF_ARM100_8j_URDF.SLDASM.urdf'))
+END_LINK_NAME = "Fixed_Jaw"
+VIS_END_LINK_NAME = "Moving Jaw"
+# False replays as fast as possible, for profiling
+REALTIME = False
+# settings of the recorded try_vr_teleop.py session, the replayed commands only match with the same values
+OBSTACLE_MAP_DIR = None
+OBSTACLE_CLEARANCE = 0.01
+REACHABILITY = False
+
+START_POS = np.deg2rad(np.array([0., 143, 129, 72.6855, 0, 0]))
+
+
+def main(record_dir: str):
+    """Replay a session recorded by try_vr_teleop.py through the same IK pipeline, without VR and rendering."""
+
+    np.set_printoptions(suppress=True, precision=4)
+
+    kinematics = Kinematics(
+        urdf_path=URDF_PATH,
+        end_link_name=END_LINK_NAME,
+        mod_matrix=np.eye(6)[:5],
+        backend=BACKEND_NUMPY,
+    )
+    joint_limits = JointLimits.from_urdf(urdf_path=URDF_PATH, skip_joints=[0])
+    robot = VirtualPosRobot(
+        start_joints=START_POS.copy(),
+        joint_limits=joint_limits,
+    )
+    robot.connect()
+
+    collision_checker = SelfCollisionChecker(
+        urdf_path=URDF_PATH,
+        kinematics=Kinematics(
+            urdf_path=URDF_PATH,
+            end_link_name=VIS_END_LINK_NAME,
+            backend=BACKEND_NUMPY,
+        ),
+    )
+    reachability = None
+    if REACHABILITY:
+        reachability_path = get_index_path(urdf_path=URDF_PATH, kinematics=kinematics, joint_limits=joint_limits)
+        if not os.path.exists(reachability_path):
+            raise RuntimeError(f"No reachability index at {reachability_path}, run build_reachability_index.py first")
+        reachability = ReachabilityIndex.load(reachability_path)
+    teleop_ik = TeleopIK(
+        kinematics=kinematics,
+        collision_checker=collision_checker,
+        obstacle_map=None if OBSTACLE_MAP_DIR is None else ObstacleMap.load(OBSTACLE_MAP_DIR, mmap_mode='r'),
+        obstacle_clearance=OBSTACLE_CLEARANCE,
+        reachability=reachability,
+    )
+
+    tracer = get_tracer()
+    joint_commands = []
+    prev_controller_data: Optional[ControllerDataView] = None
+
+    def teleop_callback(controller_data: ControllerDataView):
+        nonlocal prev_controller_data
+
+        if prev_controller_data is not None:
+            command = teleop_ik.step(prev_controller_data, controller_data, robot.read().pos)
+            if command is not None:
+                robot.position_abs_control(command)
+
+        prev_controller_data = controller_data
+        joint_commands.append(robot.read().pos)
+        with tracer.span('fk'):
+            kinematics.fk(robot.read().pos[:5])
+
+    num_samples, callback_time = replay(record_dir, teleop_callback, realtime=REALTIME)
+    print(f"Replayed {num_samples} samples, {callback_time / max(num_samples, 1) * 1e6:.1f} us per sample")
+    print(tracer.summary())
+
+    # the replayed commands should match the recorded ones unless the pipeline changed
+    _, _, recorded = SessionLog(record_dir).load()
+    valid = ~np.isnan(recorded).any(axis=1)
+    if valid.any():
+        diff = np.abs(np.array(joint_commands)[valid] - recorded[valid]).max()
+        print(f"Max joint command difference to the recording: {diff:.6f} rad")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -1,14 +1,22 @@
 import os
-import time
-from typing import Dict
+from typing import Dict, Optional
 
 import numpy as np
 import open3d as o3d  # need to load open3d before pytorch
-from armliby.ik import Kinematics
+from armliby.collision import SelfCollisionChecker
+from armliby.control_loop import ControlLoop
+from armliby.ik import BACKEND_NUMPY, Kinematics
+from armliby.obstacle_map import ObstacleMap
+from armliby.reachability import ReachabilityIndex, get_index_path
+from armliby.recording import SessionRecorder
 from armliby.robot.joint_limits import JointLimits
 from armliby.robot.virtual.open3d_robot_vis import Open3dRobotVis
 from armliby.robot.virtual.virtual_pos_robot import VirtualPosRobot
-from armliby.vrteleop.ik_ws_server import ControllerData, VRWebsocketServer
+from armliby.tracing import get_tracer
+from armliby.vrteleop.controller_buffer import ControllerDataView
+from armliby.vrteleop.ik_ws_server import VRWebsocketServer
+from armliby.vrteleop.static_site import StaticSite
+from armliby.vrteleop.teleop_ik import TeleopIK
 from armliby.vrteleop.vr_teleop_server import VRTeleopServer
 
 
@@ -22,6 +30,28 @@ URDF_PATH = os.path.realpath(os.path.join(SCRIPT_FOLDER, '../assets/SO_5DOF_ARM1
 END_LINK_NAME = "Fixed_Jaw"
 VIS_END_LINK_NAME = "Moving Jaw"
 CONTROL_FREQ = 25
+# packed float32 websocket messages instead of JSON
+BINARY_PROTOCOL = True
+# controller frames are streamed and the control loop runs at its own rate
+NON_BLOCKING = True
+# controller frames and transforms cross processes through shared memory
+SHARED_MEMORY = True
+# serve the web page from the websocket port, no separate Flask process.
+# Every HTTP request then uses its own TLS connection (Connection: close)
+SINGLE_PORT = True
+# per-stage latencies of the control process are written here on exit,
+# websocket process stages are at https://your-ip:8765/metrics with SINGLE_PORT
+TRACE_CSV = os.path.join(SCRIPT_FOLDER, 'trace.csv')
+# controller samples and joint commands are recorded here for offline replay,
+# see replay_vr_teleop.py. None disables recording.
+RECORD_DIR = None  # e.g. os.path.join(SCRIPT_FOLDER, 'recordings/session1')
+# ObstacleMap directory of the robot cell, commands bringing links closer than
+# OBSTACLE_CLEARANCE to obstacles are skipped. None disables the check.
+OBSTACLE_MAP_DIR = None
+OBSTACLE_CLEARANCE = 0.01
+# end link targets outside the sampled workspace are moved to the nearest reachable voxel,
+# the index has to be built beforehand with build_reachability_index.py
+REACHABILITY = False
 
 SSL_CERT = os.path.join(SCRIPT_FOLDER, 'cert.pem')
 SSL_KEY = os.path.join(SCRIPT_FOLDER, 'key.pem')
@@ -35,25 +65,39 @@ def main():
 
     # Initialize and start the VRWebsocketServer
     # This server is used to send VR controllers data to this script
+    # and with SINGLE_PORT also hosts the web page opened by VR headset
     ws_server = VRWebsocketServer(
         host=HOST,
         port=WSS_PORT,
         cert_path=SSL_CERT,
         key_path=SSL_KEY,
+        non_blocking=NON_BLOCKING,
+        shared_memory=SHARED_MEMORY,
+        site=StaticSite(
+            urdf_path=URDF_PATH,
+            wss_host=HOST,
+            wss_port=WSS_PORT,
+            binary_protocol=BINARY_PROTOCOL,
+            non_blocking=NON_BLOCKING,
+        ) if SINGLE_PORT else None,
     )
     ws_server.start()
 
     # Initialize and start the VRTeleop server
     # This server is used to host web page opened by VR headset
-    server = VRTeleopServer(
-        host=HOST,
-        wss_port=WSS_PORT,
-        app_port=APP_PORT,
-        urdf_path=URDF_PATH,
-        ssl_cert=SSL_CERT,
-        ssl_key=SSL_KEY
-    )
-    server.start()
+    server = None
+    if not SINGLE_PORT:
+        server = VRTeleopServer(
+            host=HOST,
+            wss_port=WSS_PORT,
+            app_port=APP_PORT,
+            urdf_path=URDF_PATH,
+            ssl_cert=SSL_CERT,
+            ssl_key=SSL_KEY,
+            binary_protocol=BINARY_PROTOCOL,
+            non_blocking=NON_BLOCKING,
+        )
+        server.start()
 
     # give freedom to rotation over z
     # because we have only 5 DoF
@@ -82,6 +126,31 @@ def main():
         skip_joints=[0],
     )
 
+    # sphere approximations of the link meshes, commands that make links intersect are dropped
+    collision_checker = SelfCollisionChecker(
+        urdf_path=URDF_PATH,
+        kinematics=Kinematics(
+            urdf_path=URDF_PATH,
+            end_link_name=VIS_END_LINK_NAME,
+            backend=BACKEND_NUMPY,
+        ),
+    )
+    reachability = None
+    if REACHABILITY:
+        reachability_path = get_index_path(
+            urdf_path=URDF_PATH,
+            kinematics=kinematics,
+            joint_limits=joint_limits,
+        )
+        if os.path.exists(reachability_path):
+            reachability = ReachabilityIndex.load(reachability_path)
+        else:
+            print(f"Warning: no reachability index at {reachability_path}, "
+                  "run build_reachability_index.py first. Targets are not projected")
+
+    # memory-mapped, only the voxels around the arm are read
+    obstacle_map = None if OBSTACLE_MAP_DIR is None else ObstacleMap.load(OBSTACLE_MAP_DIR, mmap_mode='r')
+
     # create a virtual robot that will be controlled
     robot = VirtualPosRobot(
         start_joints=START_POS,
@@ -92,73 +161,60 @@ def main():
     robot.connect()
     vis_robot.run()
 
-    prev_controller_data: ControllerData = None
+    prev_controller_data: Optional[ControllerDataView] = None
+    # reachability projection, IK and collision checks of one tick, shared with replay_vr_teleop.py
+    teleop_ik = TeleopIK(
+        kinematics=kinematics,
+        collision_checker=collision_checker,
+        obstacle_map=obstacle_map,
+        obstacle_clearance=OBSTACLE_CLEARANCE,
+        reachability=reachability,
+        verbose=True,
+    )
+    tracer = get_tracer()
+    recorder = None if RECORD_DIR is None else SessionRecorder(RECORD_DIR, num_joints=len(START_POS))
 
-    def teleop_callback(controller_data: ControllerData) -> Dict[str, np.ndarray]:
+    def teleop_callback(controller_data: ControllerDataView) -> Dict[str, np.ndarray]:
         nonlocal prev_controller_data
 
         if prev_controller_data is not None:
-            if (
-                len(controller_data.rightController.buttons) > 4 and
-                controller_data.rightController.buttons[5].pressed  # B pressed
-            ):
-                # print current controller pose
-                # print(controller_data.rightController.pose)
-
-                # calculate the difference between current and previous controller pose
-                diff_pose = prev_controller_data.rightController.pose.diff_to(controller_data.rightController.pose)
-                rotvec = diff_pose.rotvec()  # in radians
-
-                # calculate the cartesian delta to move the robot
-                dx = np.array([
-                    diff_pose.x,
-                    diff_pose.y,
-                    diff_pose.z,
-                    rotvec.x,
-                    rotvec.y,
-                    rotvec.z,
-                ])
-
-                cur_joints = robot.read().pos
-
-                # calculate the joint deltas to achieve the cartesian delta
-                djoints = kinematics.dj(
-                    js=cur_joints[:5],
-                    dx=dx,
-                )
-
-                # Warning: when use with real robot additional safety is needed
-                # beacuse inverse kinematics is unstable near singularities
-                # it can provide big djoints values,so robot
-                # can move fast and damage itself or environment
-                # put additional safety here
-                safety_djoints = np.clip(djoints, -1, 1)
-
-                print(f'--- dj {djoints}')
-
-                # update the joint positions
-                cur_joints[:5] += safety_djoints
-                cur_joints[ 5] = np.pi * 0.25 * (1 - controller_data.rightController.buttons[0].value)
-                robot.position_abs_control(cur_joints)
+            # Warning: when use with real robot additional safety is needed
+            # (speed limits) before sending commands
+            command = teleop_ik.step(prev_controller_data, controller_data, robot.read().pos)
+            if command is not None:
+                with tracer.span('position_abs_control'):
+                    robot.position_abs_control(command)
 
                 # visualize the robot
-                vis_robot.visualize(robot.read().pos)
+                with tracer.span('visualize'):
+                    vis_robot.visualize(robot.read().pos)
 
         prev_controller_data = controller_data
-        time.sleep(1. / CONTROL_FREQ)
+
+        if recorder is not None:
+            recorder.record(controller_data, robot.read().pos)
 
         # send updated robot links poses to the VR headset
-        transforms = kinematics.fk(robot.read().pos[:5])
+        with tracer.span('fk'):
+            transforms = kinematics.fk(robot.read().pos[:5])
         return transforms
 
 
+    # fixed rate loop with absolute deadlines, callback time does not stretch the period
+    control_loop = ControlLoop(freq=CONTROL_FREQ)
+
     try:
-        while True:
-            ws_server.check(teleop_callback)
+        control_loop.run(lambda: ws_server.check(teleop_callback))
     finally:
+        print(control_loop.stats.summary())
+        print(tracer.summary())
+        tracer.dump_csv(TRACE_CSV)
+        if recorder is not None:
+            recorder.close()
         robot.relax()
         robot.disconnect()
-        server.stop()
+        if server is not None:
+            server.stop()
         ws_server.stop()
 
 